@@ -0,0 +1,266 @@
+"""Swagger 文档：缓存在磁盘上的 OpenAPI 规范、按需加载的 flasgger、预压缩的 Swagger UI 静态文件
+
+原来的 ``Swagger(app)`` 在 api_server 加载时就导入 flasgger 及其依赖(jsonschema、yaml、mistune …)，
+每个进程第一次请求 ``/apispec_1.json`` 时还要解析所有路由文档字符串里的 YAML。
+``ApiDocs`` 注册与 flasgger 相同的 URL 和 endpoint 名(``flasgger.apispec_1``、``flasgger.apidocs``、
+``flasgger.static`` …)，Swagger UI 和 YApi 导入不受影响：
+
+- 规范以「所有路由的规则、方法、文档字符串 + flasgger 版本和配置」的哈希为键存在 ``cache_dir`` 下，
+  哈希不变时直接读文件；变了(改了接口文档或升级了 flasgger)才重新生成
+- 规范作为预先序列化好的 bytes 返回，带强 ETag，If-None-Match 命中时返回 304
+- flasgger 只在需要重新生成规范、或渲染 /apidocs/ 页面时才导入
+- 文档页引用的静态文件 URL 带内容哈希(``?v=``)，带版本号的请求可以长期缓存；
+  gzip / deflate 结果用最高压缩级别生成一次，同样存在 ``cache_dir`` 下，之后的进程直接读取
+
+部署时可以先执行 ``python api_docs.py`` 生成好所有缓存文件。
+"""
+import glob
+import hashlib
+import importlib.metadata
+import importlib.util
+import json
+import logging
+import mimetypes
+import os
+import tempfile
+import threading
+
+from flask import Blueprint, abort, current_app, redirect, render_template, request, url_for
+from werkzeug.security import safe_join
+
+from compression import ENCODINGS, Compressor
+from response_cache import CachedResponse, make_etag
+
+SPEC_ENDPOINT = "apispec_1"
+# 带版本号的静态文件内容不会变，缓存一年
+STATIC_CACHE_CONTROL = "public, max-age=31536000, immutable"
+ASSET_LEVEL = 9
+# 文档页引用的静态文件：flasgger 配置项 -> 文件名
+PAGE_ASSETS = {
+    "favicon": "favicon-32x32.png",
+    "swagger_ui_bundle_js": "swagger-ui-bundle.js",
+    "swagger_ui_standalone_preset_js": "swagger-ui-standalone-preset.js",
+    "jquery_js": "lib/jquery.min.js",
+    "swagger_ui_css": "swagger-ui.css",
+}
+
+logger = logging.getLogger(__name__)
+
+
+def _flasgger_dir():
+    """flasgger 包所在目录；只查找，不导入"""
+    return importlib.util.find_spec("flasgger").submodule_search_locations[0]
+
+
+def _view_docs(view):
+    """视图函数(或 MethodView 各方法)的文档字符串"""
+    docs = [view.__doc__ or ""]
+    view_class = getattr(view, "view_class", None)
+    if view_class is not None:
+        for method in sorted(getattr(view_class, "methods", None) or ()):
+            docs.append(getattr(getattr(view_class, method.lower(), None), "__doc__", None) or "")
+    return "\0".join(docs)
+
+
+class ApiDocs:
+    """/apispec_1.json、/apidocs/ 和 Swagger UI 静态文件"""
+
+    def __init__(self, app, compressor, cache_dir):
+        self.app = app
+        self.compressor = compressor
+        self.cache_dir = cache_dir
+        self.ui_dir = os.path.join(_flasgger_dir(), "ui3")
+        self._spec = None
+        self._page = None
+        self._assets = {}
+        self._lock = threading.Lock()
+
+        blueprint = Blueprint("flasgger", __name__, template_folder=os.path.join(self.ui_dir, "templates"))
+        blueprint.add_url_rule(f"/{SPEC_ENDPOINT}.json", SPEC_ENDPOINT, self.spec_view)
+        blueprint.add_url_rule("/apidocs/", "apidocs", self.docs_view)
+        blueprint.add_url_rule("/apidocs/index.html", "apidocs_index",
+                               lambda: redirect(url_for("flasgger.apidocs")))
+        blueprint.add_url_rule("/oauth2-redirect.html", "oauth_redirect", self.oauth_redirect_view)
+        blueprint.add_url_rule("/flasgger_static/<path:filename>", "static", self.static_view)
+        app.register_blueprint(blueprint)
+
+    # ---------- 视图 ----------
+
+    def spec_view(self):
+        """OpenAPI 规范"""
+        return self._respond(self.spec(), "no-cache")
+
+    def docs_view(self):
+        """Swagger UI 页面"""
+        if request.args.get("json"):
+            return self._render_docs()
+        if self._page is None:
+            self._page = CachedResponse(None, self._render_docs().encode("utf-8"), "text/html; charset=utf-8")
+        return self._respond(self._page, "no-cache")
+
+    def oauth_redirect_view(self):
+        """Swagger UI 的 OAuth2 回调页"""
+        return render_template(["flasgger/oauth2-redirect.html", "flasgger/o2c.html"])
+
+    def static_view(self, filename):
+        """Swagger UI 静态文件；版本号与内容一致时允许长期缓存"""
+        entry = self.asset(filename)
+        if request.args.get("v") == self._version(entry):
+            return self._respond(entry, STATIC_CACHE_CONTROL)
+        return self._respond(entry, "no-cache")
+
+    # ---------- 规范 ----------
+
+    def spec_key(self):
+        """规范的缓存键：路由和文档字符串变了、flasgger 升级或配置变了时都会变"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(importlib.metadata.version("flasgger").encode())
+        digest.update(json.dumps(self.app.config.get("SWAGGER"), sort_keys=True, default=str).encode())
+        for rule in sorted(self.app.url_map.iter_rules(), key=lambda r: (r.rule, r.endpoint)):
+            view = self.app.view_functions.get(rule.endpoint)
+            digest.update(f"{rule.rule}\0{rule.endpoint}\0{sorted(rule.methods)}\0".encode())
+            digest.update(_view_docs(view).encode("utf-8") if view is not None else b"")
+        return digest.hexdigest()
+
+    def spec(self):
+        """规范的缓存条目；进程内只生成(或从磁盘读取)一次"""
+        if self._spec is None:
+            with self._lock:
+                if self._spec is None:
+                    self._spec = self._load_spec()
+        return self._spec
+
+    def _load_spec(self):
+        key = self.spec_key()
+        path = os.path.join(self.cache_dir, f"apispec-{key}.json")
+        try:
+            with open(path, "rb") as f:
+                body = f.read()
+        except FileNotFoundError:
+            body = self._build_spec()
+            self._write(path, body)
+            # 旧版本的规范不会再用到
+            for old in glob.glob(os.path.join(self.cache_dir, "apispec-*.json")):
+                if old != path:
+                    self._remove_spec(old)
+        return CachedResponse(key, body, "application/json")
+
+    def _build_spec(self):
+        from flasgger import Swagger
+
+        swagger = Swagger()
+        swagger.app = self.app
+        swagger.load_config(self.app)
+        with self.app.app_context():
+            spec = swagger.get_apispecs(SPEC_ENDPOINT)
+        return json.dumps(spec, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")
+
+    # ---------- 文档页与静态文件 ----------
+
+    def _render_docs(self):
+        from flasgger import Swagger
+        from flasgger.base import APIDocsView
+
+        config = dict(Swagger.DEFAULT_CONFIG, **self.app.config.get("SWAGGER", {}))
+        for option, filename in PAGE_ASSETS.items():
+            if option not in config:
+                config[option] = url_for("flasgger.static", filename=filename,
+                                         v=self._version(self.asset(filename)))
+        return APIDocsView(view_args={"config": config}).get()
+
+    def asset_names(self):
+        static = os.path.join(self.ui_dir, "static")
+        return sorted(os.path.relpath(os.path.join(root, name), static).replace(os.sep, "/")
+                      for root, _, names in os.walk(static) for name in names)
+
+    def asset(self, filename):
+        entry = self._assets.get(filename)
+        if entry is None:
+            path = safe_join(os.path.join(self.ui_dir, "static"), filename)
+            if path is None or not os.path.isfile(path):
+                abort(404)
+            with open(path, "rb") as f:
+                body = f.read()
+            # source map 是 JSON，mimetypes 不认识它的扩展名
+            mimetype = (mimetypes.guess_type(filename)[0]
+                        or ("application/json" if filename.endswith(".map") else "application/octet-stream"))
+            if mimetype.startswith("text/"):
+                mimetype += "; charset=utf-8"
+            entry = self._assets[filename] = CachedResponse(None, body, mimetype)
+        return entry
+
+    @staticmethod
+    def _version(entry):
+        return entry.etag[:12]
+
+    # ---------- 响应与磁盘缓存 ----------
+
+    def _respond(self, entry, cache_control):
+        encoding = None
+        if self.compressor.compressible_type(entry.content_type):
+            encoding = self.compressor.negotiate(request.accept_encodings)
+        etag = self.compressor.etag(entry.etag, encoding)
+        if request.if_none_match.contains_weak(etag):
+            response = current_app.response_class(status=304)
+        else:
+            response = current_app.response_class(self._encoded(entry, encoding) if encoding else entry.body,
+                                                  content_type=entry.content_type)
+            if encoding:
+                response.headers["Content-Encoding"] = encoding
+        response.set_etag(etag)
+        response.vary.add("Accept-Encoding")
+        response.headers["Cache-Control"] = cache_control
+        return response
+
+    def _encoded(self, entry, encoding):
+        """entry 压缩后的响应体：先查内存，再查磁盘，都没有时压缩一次并写入磁盘"""
+        data = entry.encoded.get(encoding)
+        if data is None:
+            path = os.path.join(self.cache_dir, f"{entry.etag}.{encoding}")
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                data = Compressor(level=ASSET_LEVEL).compress(entry.body, encoding)
+                self._write(path, data)
+            entry.encoded[encoding] = data
+        return data
+
+    def _write(self, path, data):
+        """先写临时文件再改名，并发写同一个文件的进程互不影响；写不了时只记日志"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, prefix=".tmp-")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning("写入文档缓存失败 %s: %s", path, e)
+
+    def _remove_spec(self, path):
+        """删除一个旧规范文件和它的压缩结果"""
+        try:
+            with open(path, "rb") as f:
+                etag = make_etag(f.read())
+            for name in [path] + [os.path.join(self.cache_dir, f"{etag}.{e}") for e in ENCODINGS]:
+                if os.path.exists(name):
+                    os.remove(name)
+        except OSError:
+            pass
+
+    def precompile(self):
+        """生成规范和所有静态文件的压缩结果并写入缓存目录，返回处理的文件数"""
+        entries = [self.spec()] + [self.asset(name) for name in self.asset_names()]
+        for entry in entries:
+            if self.compressor.compressible_type(entry.content_type):
+                for encoding in ENCODINGS:
+                    self._encoded(entry, encoding)
+        return len(entries)
+
+
+if __name__ == "__main__":
+    from api_server import app
+
+    api_docs = app.extensions["api"].api_docs
+    count = api_docs.precompile()
+    print(f"已生成 {count} 个文件的缓存: {api_docs.cache_dir}")
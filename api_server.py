@@ -1,18 +1,109 @@
-from flask import Flask, jsonify, request, g
-from flasgger import Swagger
-from datetime import datetime, timedelta
+from flask import Blueprint, Flask, Response, current_app, jsonify, request, g
+from datetime import datetime
+import atexit
+import base64
+import copy
+import functools
 import random
-import json
 import logging
+import os
+import shutil
+import tempfile
 import time
+import weakref
+from operator import itemgetter
 
-app = Flask(__name__)
+from werkzeug.local import LocalProxy
 
-# ==================== 中文支持配置 ====================
-app.config['JSON_AS_ASCII'] = False  # 支持中文返回
-app.config['JSONIFY_MIMETYPE'] = 'application/json; charset=utf-8'
+from api_docs import ApiDocs
+from compression import DEFAULT_LEVEL, DEFAULT_MIN_SIZE, Compressor
+from json_provider import FastJSONProvider
+from metrics import Metrics
+from prefork import DEFAULT_THREADS, serve
+from profiling import DEFAULT_KEEP, DEFAULT_PROFILE_DIR, ProfilingMiddleware
+from request_log import RequestLog
+from response_cache import DEFAULT_MAX_BYTES, CachedResponse, ResponseCache
+from traffic import DEFAULT_RECORD_FILE, TrafficRecorder
+from signed_tokens import RevocationList, TokenSigner
+from store import BACKENDS, compute_rollups, open_storage
+from token_store import DEFAULT_MAX_TOKENS, DEFAULT_TTL
+from validation import compile_validators
 
-swagger = Swagger(app)
+# 所有路由和钩子注册在蓝图 api 上，由 create_app 注册到新建的 app(见文件末尾的应用工厂)
+api = Blueprint('api', __name__)
+
+# ==================== 应用状态 ====================
+# 存储、请求日志、流量录制、签名器、指标、响应缓存等每个 app 各有一份(AppState)，
+# 保存在 app.extensions["api"] 上；视图和钩子通过下面的代理访问处理当前请求的 app 的组件，
+# 同一进程里可以同时存在多个配置不同的 app
+
+def current_state():
+    """处理当前请求的 app 的 AppState"""
+    return current_app.extensions["api"]
+
+storage = LocalProxy(lambda: current_app.extensions["api"].storage)
+request_log = LocalProxy(lambda: current_app.extensions["api"].request_log)
+metrics = LocalProxy(lambda: current_app.extensions["api"].metrics)
+compressor = LocalProxy(lambda: current_app.extensions["api"].compressor)
+response_cache = LocalProxy(lambda: current_app.extensions["api"].response_cache)
+request_validators = LocalProxy(lambda: current_app.extensions["api"].validators)
+
+# ==================== 指标 ====================
+# 按路由统计延迟、报文大小、请求数和在途请求数，GET /metrics 以 Prometheus 格式导出。
+# 指标钩子在压缩钩子之前注册、在它之后执行，响应大小是实际发出的(压缩后的)字节数，耗时也包含压缩
+
+@api.before_app_request
+def metrics_begin():
+    """在途请求数加一"""
+    g.metrics_route = request.url_rule.rule if request.url_rule else "<unmatched>"
+    g.metrics_start = time.perf_counter()
+    metrics.begin(request.method, g.metrics_route)
+
+@api.after_app_request
+def metrics_observe(response):
+    """记录请求耗时、请求/响应大小(压缩后)和状态码"""
+    duration_us = int((time.perf_counter() - g.metrics_start) * 1e6)
+    metrics.observe(request.method, g.metrics_route, response.status_code, duration_us,
+                    request.content_length or 0, response.calculate_content_length())
+    return response
+
+@api.teardown_app_request
+def metrics_end(exc):
+    """在途请求数减一(请求出错时也会执行)"""
+    route = g.pop('metrics_route', None)
+    if route is not None:
+        metrics.end(request.method, route)
+
+# ==================== 响应压缩 ====================
+# 按 Accept-Encoding 用 gzip / deflate 压缩不小于 API_COMPRESS_MIN_SIZE 字节的文本响应，
+# 压缩级别由 API_COMPRESS_LEVEL 指定(0 表示不压缩)
+
+# after_request 钩子按注册的逆序执行：压缩钩子在日志和流量录制之前注册、在它们之后执行，
+# 日志和录制看到的是压缩前的响应；只有指标钩子在它之后执行(见上)
+@api.after_app_request
+def compress_response(response):
+    """压缩响应体；响应缓存命中的请求复用缓存里的压缩结果"""
+    state = current_state()
+    compressor = state.compressor
+    cached = g.pop('cached_response', None)
+    if cached is not None:
+        key, entry, encoding = cached
+        if encoding:
+            compressor.apply(response, encoding,
+                             state.response_cache.encoded(key, entry, encoding, compressor.compress))
+        return response
+    if not compressor.compressible(response):
+        return response
+    encoding = compressor.negotiate(request.accept_encodings)
+    if encoding and (response.is_streamed or len(response.get_data()) >= compressor.min_size):
+        compressor.apply(response, encoding)
+    else:
+        response.vary.add('Accept-Encoding')
+    return response
+
+# ==================== Swagger 文档 ====================
+# 规范生成后缓存在 API_DOCS_CACHE 目录(默认 .apidocs_cache)，接口文档不变时重启也不用重新生成；
+# flasgger 只在生成规范、渲染 /apidocs/ 页面时才导入(见 api_docs.py)。每个 app 在 create_app 里创建自己的 ApiDocs
 
 # ==================== 日志配置 ====================
 logging.basicConfig(
@@ -22,17 +113,19 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# 日志颜色 (终端支持)
-class Colors:
-    GREEN = '\033[92m'
-    YELLOW = '\033[93m'
-    BLUE = '\033[94m'
-    CYAN = '\033[96m'
-    RED = '\033[91m'
-    RESET = '\033[0m'
-    BOLD = '\033[1m'
-
-@app.before_request
+# 请求/响应日志：钩子只把结构化记录放进有界队列，由后台线程批量格式化并写出，
+# 启动时用 --log-file / API_LOG_FILE 指定写入的文件(默认 stdout)
+
+# 响应体最多记录的字节数(API_LOG_BODY_MAX，0 表示都不记录)，
+# 以及各路由(endpoint)记录响应体的采样率，未列出的路由全部记录
+LOG_BODY_MAX = int(os.environ.get('API_LOG_BODY_MAX', 4096))
+LOG_BODY_RATES = {
+    "flasgger.apispec_1": 0,  # Swagger 规范很大，且每次都一样
+    "api.create_users_batch": 0.1,
+    "api.create_orders_batch": 0.1,
+}
+
+@api.before_app_request
 def log_request_info():
     """记录请求日志"""
     g.start_time = time.time()
@@ -45,61 +138,91 @@ def log_request_info():
         except:
             request_body = request.data.decode('utf-8') if request.data else None
     
-    # 打印请求日志
-    print(f"\n{Colors.GREEN}{'='*60}{Colors.RESET}")
-    print(f"{Colors.BOLD}{Colors.CYAN}>>> REQUEST{Colors.RESET}")
-    print(f"{Colors.GREEN}{'='*60}{Colors.RESET}")
-    print(f"{Colors.YELLOW}Method:{Colors.RESET} {request.method}")
-    print(f"{Colors.YELLOW}URL:{Colors.RESET} {request.url}")
-    print(f"{Colors.YELLOW}Path:{Colors.RESET} {request.path}")
-    
-    if request.args:
-        print(f"{Colors.YELLOW}Query Params:{Colors.RESET} {dict(request.args)}")
-    
-    if request.headers.get('Authorization'):
-        print(f"{Colors.YELLOW}Authorization:{Colors.RESET} {request.headers.get('Authorization')}")
-    
-    if request_body:
-        print(f"{Colors.YELLOW}Body:{Colors.RESET}")
-        print(json.dumps(request_body, ensure_ascii=False, indent=2))
-    
-    logger.info(f"REQUEST: {request.method} {request.path}")
+    request_log.submit({
+        "kind": "request",
+        "time": g.start_time,
+        "method": request.method,
+        "url": request.url,
+        "path": request.path,
+        "args": dict(request.args),
+        "authorization": request.headers.get('Authorization'),
+        "body": request_body,
+    })
 
-@app.after_request
+@api.after_app_request
 def log_response_info(response):
     """记录响应日志"""
     # 计算响应时间
-    duration = (time.time() - g.start_time) * 1000  # 转换为毫秒
+    now = time.time()
+    duration = (now - g.start_time) * 1000  # 转换为毫秒
     
-    # 获取响应体
-    response_body = None
+    # 只截取已生成的响应体字节，不解析也不重新序列化；流式响应不读取
+    log = current_state().request_log
+    response_body = body_size = None
     if response.content_type and 'application/json' in response.content_type:
-        try:
-            response_body = json.loads(response.get_data(as_text=True))
-        except:
-            response_body = response.get_data(as_text=True)
-    
-    # 状态码颜色
-    status_color = Colors.GREEN if response.status_code < 400 else Colors.RED
-    
-    # 打印响应日志
-    print(f"\n{Colors.BLUE}{'='*60}{Colors.RESET}")
-    print(f"{Colors.BOLD}{Colors.CYAN}<<< RESPONSE{Colors.RESET}")
-    print(f"{Colors.BLUE}{'='*60}{Colors.RESET}")
-    print(f"{Colors.YELLOW}Status:{Colors.RESET} {status_color}{response.status_code} {response.status}{Colors.RESET}")
-    print(f"{Colors.YELLOW}Duration:{Colors.RESET} {duration:.2f}ms")
-    print(f"{Colors.YELLOW}Content-Type:{Colors.RESET} {response.content_type}")
-    
-    if response_body:
-        print(f"{Colors.YELLOW}Body:{Colors.RESET}")
-        print(json.dumps(response_body, ensure_ascii=False, indent=2))
+        response_body, body_size = log.capture_body(request.endpoint, response)
     
-    print(f"{Colors.BLUE}{'='*60}{Colors.RESET}\n")
-    
-    logger.info(f"RESPONSE: {response.status_code} - {duration:.2f}ms")
+    log.submit({
+        "kind": "response",
+        "time": now,
+        "status_code": response.status_code,
+        "status": response.status,
+        "duration": duration,
+        "content_type": response.content_type,
+        "body": response_body,
+        "body_size": body_size,
+    })
     
     return response
 
+# 流量录制：用 --record / API_RECORD_FILE 打开，回放见 traffic.py
+@api.after_app_request
+def record_traffic(response):
+    """录制请求"""
+    recorder = current_state().traffic_recorder
+    if recorder is not None:
+        recorder.record(
+            request.method, request.path, request.query_string.decode('latin-1'),
+            request.headers.items(), request.get_data(), g.start_time,
+            (time.time() - g.start_time) * 1000, response.status_code)
+    return response
+
+@api.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Prometheus metrics
+    ---
+    tags:
+      - Monitoring
+    description: 按 method、route(路由规则)、status_class 分组的请求数、在途请求数，以及延迟和请求/响应大小的 p50/p90/p99/p999；另有登录 token 的当前数量、过期清理和超出上限挤掉的累计数，以及已吊销的签名 token 数
+    produces:
+      - text/plain
+    responses:
+      200:
+        description: Prometheus text exposition format
+    """
+    tokens = storage.tokens.stats()
+    revoked = storage.revocations.stats()
+    text = metrics.render() + "\n".join((
+        "# HELP api_tokens_live 当前保存的登录 token 数",
+        "# TYPE api_tokens_live gauge",
+        f"api_tokens_live {tokens['live']}",
+        "# HELP api_tokens_removed_total 被删除的登录 token 数(expired 过期清理，evicted 超出上限挤掉)",
+        "# TYPE api_tokens_removed_total counter",
+        f'api_tokens_removed_total{{reason="expired"}} {tokens["expired"]}',
+        f'api_tokens_removed_total{{reason="evicted"}} {tokens["evicted"]}',
+        "# HELP api_tokens_revoked 未过期的已吊销签名 token 数",
+        "# TYPE api_tokens_revoked gauge",
+        f"api_tokens_revoked {revoked['live']}",
+    )) + "\n"
+    return Response(text, mimetype='text/plain; version=0.0.4')
+
+# ==================== 按请求剖析 ====================
+# 带 X-Profile: 1 请求头或 ?__profile 参数的请求单独剖析，返回热点函数；
+# X-Profile: collapsed 把调用栈写入 profiles/ 供生成火焰图。
+# API_PROFILE / --profile 控制谁可以触发：local(默认，仅本机)、any、off。
+# 剖析中间件包在每个 app 的 wsgi_app 外面(见 create_app)
+
 # ==================== 测试账号 ====================
 # 可用于登录测试的账号
 test_accounts = {
@@ -110,11 +233,8 @@ test_accounts = {
     "vip": {"password": "vip888", "role": "vip", "name": "VIP用户"},
 }
 
-# 用于存储登录后的 token
-active_tokens = {}
-
 # ==================== 用户数据 ====================
-users = [
+SEED_USERS = [
     {"id": 1, "name": "张三", "email": "zhangsan@example.com", "phone": "13800138001", "status": "active"},
     {"id": 2, "name": "李四", "email": "lisi@example.com", "phone": "13800138002", "status": "active"},
     {"id": 3, "name": "王五", "email": "wangwu@example.com", "phone": "13800138003", "status": "inactive"},
@@ -125,7 +245,7 @@ users = [
 ]
 
 # ==================== 商品数据 ====================
-products = [
+SEED_PRODUCTS = [
     {"id": 1, "name": "iPhone 15 Pro", "price": 8999.00, "category": "手机", "stock": 100, "status": "on_sale"},
     {"id": 2, "name": "MacBook Pro 14", "price": 14999.00, "category": "电脑", "stock": 50, "status": "on_sale"},
     {"id": 3, "name": "AirPods Pro 2", "price": 1899.00, "category": "配件", "stock": 200, "status": "on_sale"},
@@ -137,7 +257,7 @@ products = [
 ]
 
 # ==================== 订单数据 ====================
-orders = [
+SEED_ORDERS = [
     {"id": "ORD20231201001", "user_id": 1, "product_id": 1, "quantity": 1, "total": 8999.00, "status": "completed", "created_at": "2023-12-01 10:30:00"},
     {"id": "ORD20231202001", "user_id": 2, "product_id": 2, "quantity": 1, "total": 14999.00, "status": "shipped", "created_at": "2023-12-02 14:20:00"},
     {"id": "ORD20231203001", "user_id": 1, "product_id": 3, "quantity": 2, "total": 3798.00, "status": "pending", "created_at": "2023-12-03 09:15:00"},
@@ -145,7 +265,195 @@ orders = [
     {"id": "ORD20231205001", "user_id": 4, "product_id": 6, "quantity": 1, "total": 6999.00, "status": "paid", "created_at": "2023-12-05 11:00:00"},
 ]
 
-@app.route('/users', methods=['GET'])
+# ==================== 存储后端 ====================
+# 所有数据(用户、商品、订单、登录 token)都通过 storage 上的仓库读写，
+# 启动时用 --storage / API_STORAGE 选择 memory(默认) 或 sqlite 后端
+
+# 命名快照保存在 storage.snapshots 中，由 /test/snapshot/<name> 保存、/test/restore/<name> 恢复；
+# "initial" 是启动时的数据，/test/reset 恢复的就是它
+INITIAL_SNAPSHOT = "initial"
+
+def init_storage(backend='memory', path=None, **token_options):
+    """创建存储后端；数据为空时装入初始数据，并保存为 initial 快照"""
+    storage = open_storage(backend, path, **token_options)
+    if storage.is_empty():
+        storage.users.load(copy.deepcopy(SEED_USERS))
+        storage.products.load(copy.deepcopy(SEED_PRODUCTS))
+        storage.orders.load(copy.deepcopy(SEED_ORDERS))
+    # sqlite 库里可能留有上次运行保存的快照，先释放它们
+    for snap in storage.snapshots.values():
+        storage.drop_snapshot(snap)
+    storage.snapshots.clear()
+    storage.snapshots[INITIAL_SNAPSHOT] = storage.snapshot()
+    return storage
+
+# ==================== 登录 token ====================
+# 默认(opaque)签发随机 token，保存在 storage.tokens 中(有效期与数量上限见 token_store.py)；
+# --token-mode signed / API_TOKEN_MODE=signed 时签发 HMAC 签名的 token(见 signed_tokens.py)，
+# 校验只需要密钥，不查存储。多个节点共用 --token-secret / API_TOKEN_SECRET 即可互相校验，
+# 同一台机器上的多个工作进程不指定时共用启动时随机生成的密钥
+TOKEN_MODES = ("opaque", "signed")
+
+def init_token_signer(storage, mode='opaque', secret=None, ttl=DEFAULT_TTL):
+    """签名模式下创建签名器(吊销列表保存在 storage 的 revocations 仓库里)，opaque 模式下为 None"""
+    if mode != 'signed':
+        return None
+    return TokenSigner(secret, ttl=ttl, revocations=RevocationList(storage.revocations))
+
+def token_user(token):
+    """token 对应的用户信息(username、role、name、expires)；无效、过期或已退出登录时返回 None"""
+    token_signer = current_state().token_signer
+    if token_signer is not None:
+        claims = token_signer.verify(token)
+        return token_signer.user_info(claims) if claims else None
+    token_info = storage.tokens.get(token)
+    if token_info is None:
+        return None
+    return {k: v for k, v in token_info.items() if k != 'token'}
+
+def bearer_token():
+    auth_header = request.headers.get('Authorization')
+    if auth_header and auth_header.startswith('Bearer '):
+        return auth_header[7:]
+    return None
+
+# ==================== 响应缓存 ====================
+# 轮询频繁的 GET 接口缓存整个响应体，数据没变(仓库版本号相同)时直接返回缓存的 bytes；
+# 响应带强 ETag，If-None-Match 命中时返回 304。API_CACHE_BYTES 限制缓存总大小(0 表示关闭)
+
+def cached(*collections):
+    """缓存 GET 接口的 200 响应；collections 是响应内容依赖的仓库名
+
+    缓存键是 (endpoint, 路径参数, 查询参数)，查询参数按参数名排序(同名参数保持原顺序)，
+    参数顺序不同的同一查询共用一条缓存
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            state = current_state()
+            storage, response_cache, compressor = state.storage, state.response_cache, state.compressor
+            if not response_cache.max_bytes:
+                return view(**kwargs)
+            key = (request.endpoint, tuple(sorted(kwargs.items())),
+                   tuple(sorted(request.args.items(multi=True), key=itemgetter(0))))
+            # 先取版本号再生成响应：生成期间有写入时，缓存的版本号只会偏旧，下次读取时重新生成
+            version = tuple(getattr(storage, name).version for name in collections)
+            entry = response_cache.get(key, version)
+            if entry is None:
+                response = current_app.make_response(view(**kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                entry = CachedResponse(version, response.get_data(), response.content_type)
+                response_cache.put(key, entry)
+
+            # 压缩后的表示有自己的 ETag；是否压缩、用哪种压缩要在判断 304 之前确定
+            encoding = None
+            if len(entry.body) >= compressor.min_size and compressor.compressible_type(entry.content_type):
+                encoding = compressor.negotiate(request.accept_encodings)
+            if request.if_none_match.contains_weak(compressor.etag(entry.etag, encoding)):
+                response = current_app.response_class(status=304)
+                response.set_etag(compressor.etag(entry.etag, encoding))
+            else:
+                # 响应体由 compress_response 换成缓存里的压缩结果，ETag 后缀也由它加上
+                response = current_app.response_class(entry.body, content_type=entry.content_type)
+                response.set_etag(entry.etag)
+                g.cached_response = (key, entry, encoding)
+            response.vary.add('Accept-Encoding')
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
+# ==================== 分页 ====================
+# 单页最多返回的条数，防止一次请求拉取整张表
+MAX_PAGE_LIMIT = 1000
+
+def encode_cursor(seq):
+    """把行序号编码为不透明的翻页游标"""
+    return base64.urlsafe_b64encode(f"v1:{seq}".encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """解析翻页游标，格式非法时返回 None"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        version, seq = raw.split(':')
+        if version == 'v1':
+            return int(seq)
+    except (ValueError, UnicodeDecodeError):
+        pass
+    return None
+
+def paginated_response(table, filters=None, search=None):
+    """列表接口的通用分页
+
+    - 传 ``cursor`` 时按 keyset 翻页(深页与第一页代价相同)，否则兼容旧的 ``page``/``limit``
+    - 有下一页时返回 ``next_cursor``，否则为 null
+    - ``include_total=false`` 时不计算 ``total``
+    """
+    page = request.args.get('page', 1, type=int)
+    limit = min(max(request.args.get('limit', 10, type=int), 0), MAX_PAGE_LIMIT)
+    include_total = request.args.get('include_total', 'true').lower() not in ('false', '0', 'no')
+    cursor = request.args.get('cursor')
+
+    body = {"limit": limit}
+    if cursor:
+        after = decode_cursor(cursor)
+        if after is None:
+            return jsonify({"error": "无效的 cursor"}), 400
+        rows, next_after = table.page_compact(filters, search, after=after, limit=limit)
+    else:
+        rows, next_after = table.page_compact(filters, search, offset=max((page - 1) * limit, 0), limit=limit)
+        body["page"] = page
+
+    body["data"] = rows
+    body["next_cursor"] = encode_cursor(next_after) if next_after is not None else None
+    if include_total:
+        body["total"] = table.count(filters, search)
+    return jsonify(body)
+
+# ==================== 批量接口 ====================
+# 一次批量创建的最大条数，以及 ?ids= 一次最多查询的 ID 数
+MAX_BATCH_SIZE = 10000
+MAX_IDS = MAX_PAGE_LIMIT
+
+def ids_response(table, convert=str):
+    """``?ids=1,2,3`` 按 ID 批量查询：按请求顺序返回找到的行，未找到的 ID 放在 missing 中"""
+    try:
+        ids = [convert(part.strip()) for part in request.args['ids'].split(',') if part.strip()]
+    except ValueError:
+        return jsonify({"error": "无效的 ids"}), 400
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > MAX_IDS:
+        return jsonify({"error": f"ids 最多 {MAX_IDS} 个"}), 400
+
+    rows = table.get_many(ids)
+    return jsonify({
+        "data": [row for row in rows if row is not None],
+        "missing": [key for key, row in zip(ids, rows) if row is None],
+    })
+
+def batch_items():
+    """取出批量创建的请求体(JSON 数组)；格式不对时返回错误响应"""
+    items = request.get_json()
+    if not isinstance(items, list) or not items:
+        return None, (jsonify({"error": "请提供非空的 JSON 数组"}), 400)
+    if len(items) > MAX_BATCH_SIZE:
+        return None, (jsonify({"error": f"单次最多 {MAX_BATCH_SIZE} 条"}), 400)
+    return items, None
+
+def item_error(index, error):
+    """批量条目没有通过 schema 校验时的逐条结果"""
+    code, message = error
+    return {"index": index, "status": 400, "error": message, "error_code": code}
+
+def batch_response(results):
+    """逐条结果：全部成功返回 201，否则返回 207"""
+    failed = sum(1 for result in results if result["status"] != 201)
+    body = {"created": len(results) - failed, "failed": failed, "results": results}
+    return jsonify(body), 201 if not failed else 207
+
+@api.route('/users', methods=['GET'])
+@cached('users')
 def get_users():
     """
     Get all users
@@ -167,6 +475,19 @@ def get_users():
         in: query
         type: string
         description: Filter by name
+      - name: cursor
+        in: query
+        type: string
+        description: 上一页返回的 next_cursor，传入后按游标翻页并忽略 page
+      - name: include_total
+        in: query
+        type: boolean
+        description: 为 false 时不计算 total
+        default: true
+      - name: ids
+        in: query
+        type: string
+        description: 逗号分隔的用户 ID，传入后按 ID 批量查询并忽略其他参数
     responses:
       200:
         description: List of users
@@ -190,29 +511,17 @@ def get_users():
               type: integer
             limit:
               type: integer
+            next_cursor:
+              type: string
     """
-    # Filtering
-    name_filter = request.args.get('name')
-    filtered_users = users
-    if name_filter:
-        filtered_users = [u for u in users if name_filter.lower() in u['name'].lower()]
-
-    # Pagination
-    page = request.args.get('page', 1, type=int)
-    limit = request.args.get('limit', 10, type=int)
-    start = (page - 1) * limit
-    end = start + limit
-    
-    paginated_users = filtered_users[start:end]
+    if 'ids' in request.args:
+        return ids_response(storage.users, int)
     
-    return jsonify({
-        "data": paginated_users,
-        "total": len(filtered_users),
-        "page": page,
-        "limit": limit
-    })
+    # Filtering
+    search = {"name": request.args.get('name') or None}
+    return paginated_response(storage.users, search=search)
 
-@app.route('/users/<int:user_id>', methods=['GET'])
+@api.route('/users/<int:user_id>', methods=['GET'])
 def get_user(user_id):
     """
     Get a single user
@@ -240,12 +549,12 @@ def get_user(user_id):
       404:
         description: User not found
     """
-    user = next((u for u in users if u['id'] == user_id), None)
+    user = storage.users.get(user_id)
     if user:
         return jsonify(user)
     return jsonify({"error": "User not found"}), 404
 
-@app.route('/users', methods=['POST'])
+@api.route('/users', methods=['POST'])
 def create_user():
     """
     Create a new user
@@ -282,18 +591,66 @@ def create_user():
         description: Invalid data
     """
     data = request.get_json()
-    if not data or 'name' not in data or 'email' not in data:
-        return jsonify({"error": "Invalid data"}), 400
-    
-    new_user = {
-        "id": users[-1]['id'] + 1 if users else 1,
+    # 主键在仓库的写锁内分配，并发创建不会拿到相同的 ID
+    new_user = storage.users.create({
         "name": data['name'],
         "email": data['email']
-    }
-    users.append(new_user)
+    })
     return jsonify(new_user), 201
 
-@app.route('/users/<int:user_id>', methods=['PUT'])
+@api.route('/users/batch', methods=['POST'])
+def create_users_batch():
+    """
+    Create users in batch
+    ---
+    tags:
+      - Users
+    description: 一次创建多个用户。先校验全部条目，再一次性写入合法的条目，逐条返回结果；全部成功返回 201，部分失败返回 207
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: array
+          items:
+            type: object
+            required:
+              - name
+              - email
+            properties:
+              name:
+                type: string
+              email:
+                type: string
+    responses:
+      201:
+        description: All users created
+      207:
+        description: Some items failed, see results
+      400:
+        description: Body is not a non-empty array
+    """
+    items, error = batch_items()
+    if error:
+        return error
+    
+    results = [None] * len(items)
+    valid = []
+    validate = request_validators[request.endpoint].items
+    for i, data in enumerate(items):
+        error = validate(data)
+        if error is None:
+            valid.append(i)
+        else:
+            results[i] = item_error(i, error)
+    
+    created = storage.users.create_many(
+        {"name": items[i]['name'], "email": items[i]['email']} for i in valid)
+    for i, user in zip(valid, created):
+        results[i] = {"index": i, "status": 201, "data": user}
+    return batch_response(results)
+
+@api.route('/users/<int:user_id>', methods=['PUT'])
 def update_user(user_id):
     """
     Update a user
@@ -322,15 +679,14 @@ def update_user(user_id):
       404:
         description: User not found
     """
-    user = next((u for u in users if u['id'] == user_id), None)
-    if not user:
-        return jsonify({"error": "User not found"}), 404
-    
     data = request.get_json()
-    user.update(data)
+    # 查找与合并在同一把写锁内完成，并发删除时返回 404，并发更新不会互相覆盖
+    user = storage.users.update(user_id, data)
+    if user is None:
+        return jsonify({"error": "User not found"}), 404
     return jsonify(user)
 
-@app.route('/users/<int:user_id>', methods=['DELETE'])
+@api.route('/users/<int:user_id>', methods=['DELETE'])
 def delete_user(user_id):
     """
     Delete a user
@@ -347,13 +703,12 @@ def delete_user(user_id):
       200:
         description: User deleted
     """
-    global users
-    users = [u for u in users if u['id'] != user_id]
+    storage.users.delete(user_id)
     return jsonify({"message": "User deleted"}), 200
 
 # --- New Endpoints ---
 
-@app.route('/login', methods=['POST'])
+@api.route('/login', methods=['POST'])
 def login():
     """
     Login to get a token
@@ -420,92 +775,10 @@ def login():
     import hashlib
     import re
     
-    # 1. 检查请求体是否为空
+    # 1-6. 请求体、必填字段、类型、空字符串与长度由 schema 编译出的校验函数检查(见 validate_request_body)
     data = request.get_json(silent=True)
-    if data is None:
-        return jsonify({
-            "success": False,
-            "error": "请求体不能为空",
-            "error_code": "EMPTY_BODY"
-        }), 400
-    
-    # 2. 检查必填字段是否存在
-    if 'username' not in data:
-        return jsonify({
-            "success": False,
-            "error": "缺少必填字段: username",
-            "error_code": "MISSING_USERNAME"
-        }), 400
-    
-    if 'password' not in data:
-        return jsonify({
-            "success": False,
-            "error": "缺少必填字段: password",
-            "error_code": "MISSING_PASSWORD"
-        }), 400
-    
-    username = data.get('username')
-    password = data.get('password')
-    
-    # 3. 检查字段类型 - username
-    if username is None:
-        return jsonify({
-            "success": False,
-            "error": "username 不能为 null",
-            "error_code": "NULL_USERNAME"
-        }), 400
-    
-    if not isinstance(username, str):
-        return jsonify({
-            "success": False,
-            "error": f"username 类型错误，期望 string，实际为 {type(username).__name__}",
-            "error_code": "INVALID_USERNAME_TYPE"
-        }), 400
-    
-    # 4. 检查字段类型 - password
-    if password is None:
-        return jsonify({
-            "success": False,
-            "error": "password 不能为 null",
-            "error_code": "NULL_PASSWORD"
-        }), 400
-    
-    if not isinstance(password, str):
-        return jsonify({
-            "success": False,
-            "error": f"password 类型错误，期望 string，实际为 {type(password).__name__}",
-            "error_code": "INVALID_PASSWORD_TYPE"
-        }), 400
-    
-    # 5. 检查空字符串
-    if username.strip() == '':
-        return jsonify({
-            "success": False,
-            "error": "username 不能为空",
-            "error_code": "EMPTY_USERNAME"
-        }), 400
-    
-    if password.strip() == '':
-        return jsonify({
-            "success": False,
-            "error": "password 不能为空",
-            "error_code": "EMPTY_PASSWORD"
-        }), 400
-    
-    # 6. 检查长度限制
-    if len(username) > 50:
-        return jsonify({
-            "success": False,
-            "error": f"username 长度超出限制，最大50字符，当前{len(username)}字符",
-            "error_code": "USERNAME_TOO_LONG"
-        }), 400
-    
-    if len(password) > 50:
-        return jsonify({
-            "success": False,
-            "error": f"password 长度超出限制，最大50字符，当前{len(password)}字符",
-            "error_code": "PASSWORD_TOO_LONG"
-        }), 400
+    username = data['username']
+    password = data['password']
     
     # 7. 安全检查 - XSS 防护
     xss_pattern = re.compile(r'<[^>]*script|javascript:|on\w+\s*=', re.IGNORECASE)
@@ -542,15 +815,22 @@ def login():
         }), 401
     
     # 11. 登录成功，生成 token
-    token = f"token_{username}_{hashlib.md5(f'{username}{datetime.now().isoformat()}'.encode()).hexdigest()[:16]}"
-    
-    # 存储 token
-    active_tokens[token] = {
-        "username": username,
-        "role": test_accounts[username]['role'],
-        "name": test_accounts[username]['name'],
-        "expires": (datetime.now() + timedelta(hours=24)).isoformat()
-    }
+    token_signer = current_state().token_signer
+    if token_signer is not None:
+        # 签名模式：用户名、角色和过期时间都在 token 里，不保存
+        token = token_signer.issue(username, test_accounts[username]['role'], test_accounts[username]['name'])
+    else:
+        token = f"token_{username}_{hashlib.md5(f'{username}{datetime.now().isoformat()}'.encode()).hexdigest()[:16]}"
+        
+        # 存储 token，过期时间由 token 仓库按 TTL 计算 (同一用户同一时刻重复登录会得到同一个 token，已存在时无需再存)
+        try:
+            storage.tokens.issue(token, {
+                "username": username,
+                "role": test_accounts[username]['role'],
+                "name": test_accounts[username]['name'],
+            })
+        except KeyError:
+            pass
     
     return jsonify({
         "success": True,
@@ -563,7 +843,7 @@ def login():
         }
     }), 200
 
-@app.route('/protected', methods=['GET'])
+@api.route('/protected', methods=['GET'])
 def protected():
     """
     Access protected resource
@@ -582,21 +862,50 @@ def protected():
       401:
         description: Unauthorized
     """
-    auth_header = request.headers.get('Authorization')
-    if auth_header and auth_header.startswith('Bearer '):
-        token = auth_header[7:]
-        if token in active_tokens:
-            user_info = active_tokens[token]
-            return jsonify({
-                "message": "访问成功",
-                "user": user_info,
-                "secret_data": "这是受保护的数据"
-            }), 200
+    token = bearer_token()
+    user_info = token_user(token) if token else None
+    if user_info:
+        return jsonify({
+            "message": "访问成功",
+            "user": user_info,
+            "secret_data": "这是受保护的数据"
+        }), 200
     return jsonify({"error": "未授权访问，请先登录"}), 401
 
+@api.route('/logout', methods=['POST'])
+def logout():
+    """
+    Logout
+    ---
+    tags:
+      - Auth
+    description: 使当前 token 失效。签名模式下 token 加入吊销列表，共用数据库的所有工作进程随即拒绝它
+    parameters:
+      - name: Authorization
+        in: header
+        type: string
+        required: true
+        description: Bearer <token>
+    responses:
+      200:
+        description: Logged out
+      401:
+        description: Unauthorized
+    """
+    token = bearer_token()
+    if not token or not token_user(token):
+        return jsonify({"error": "未授权访问，请先登录"}), 401
+    token_signer = current_state().token_signer
+    if token_signer is not None:
+        token_signer.revoke(token)
+    else:
+        storage.tokens.delete(token)
+    return jsonify({"message": "已退出登录"}), 200
+
 # ==================== 商品接口 ====================
 
-@app.route('/products', methods=['GET'])
+@api.route('/products', methods=['GET'])
+@cached('products')
 def get_products():
     """
     Get all products
@@ -622,34 +931,35 @@ def get_products():
         in: query
         type: string
         description: Filter by status (on_sale/out_of_stock/off_sale)
+      - name: cursor
+        in: query
+        type: string
+        description: 上一页返回的 next_cursor，传入后按游标翻页并忽略 page
+      - name: include_total
+        in: query
+        type: boolean
+        description: 为 false 时不计算 total
+        default: true
+      - name: ids
+        in: query
+        type: string
+        description: 逗号分隔的商品 ID，传入后按 ID 批量查询并忽略其他参数
     responses:
       200:
         description: List of products
     """
-    # Filtering
-    category = request.args.get('category')
-    status = request.args.get('status')
-    filtered = products
-    
-    if category:
-        filtered = [p for p in filtered if p['category'] == category]
-    if status:
-        filtered = [p for p in filtered if p['status'] == status]
+    if 'ids' in request.args:
+        return ids_response(storage.products, int)
     
-    # Pagination
-    page = request.args.get('page', 1, type=int)
-    limit = request.args.get('limit', 10, type=int)
-    start = (page - 1) * limit
-    end = start + limit
-    
-    return jsonify({
-        "data": filtered[start:end],
-        "total": len(filtered),
-        "page": page,
-        "limit": limit
-    })
+    # Filtering
+    filters = {
+        "category": request.args.get('category') or None,
+        "status": request.args.get('status') or None,
+    }
+    return paginated_response(storage.products, filters)
 
-@app.route('/products/<int:product_id>', methods=['GET'])
+@api.route('/products/<int:product_id>', methods=['GET'])
+@cached('products')
 def get_product(product_id):
     """
     Get a single product
@@ -667,14 +977,14 @@ def get_product(product_id):
       404:
         description: Product not found
     """
-    product = next((p for p in products if p['id'] == product_id), None)
+    product = storage.products.get(product_id)
     if product:
         return jsonify(product)
     return jsonify({"error": "商品不存在"}), 404
 
 # ==================== 订单接口 ====================
 
-@app.route('/orders', methods=['GET'])
+@api.route('/orders', methods=['GET'])
 def get_orders():
     """
     Get all orders
@@ -686,29 +996,127 @@ def get_orders():
         in: query
         type: integer
         description: Filter by user ID
+      - name: page
+        in: query
+        type: integer
+        description: Page number
+        default: 1
+      - name: limit
+        in: query
+        type: integer
+        description: Items per page
+        default: 10
       - name: status
         in: query
         type: string
         description: Filter by status (pending/paid/shipped/completed/cancelled)
+      - name: cursor
+        in: query
+        type: string
+        description: 上一页返回的 next_cursor，传入后按游标翻页并忽略 page
+      - name: include_total
+        in: query
+        type: boolean
+        description: 为 false 时不计算 total
+        default: true
+      - name: ids
+        in: query
+        type: string
+        description: 逗号分隔的订单 ID，传入后按 ID 批量查询并忽略其他参数
     responses:
       200:
         description: List of orders
     """
-    user_id = request.args.get('user_id', type=int)
-    status = request.args.get('status')
-    filtered = orders
+    if 'ids' in request.args:
+        return ids_response(storage.orders)
     
-    if user_id:
-        filtered = [o for o in filtered if o['user_id'] == user_id]
-    if status:
-        filtered = [o for o in filtered if o['status'] == status]
+    filters = {
+        "user_id": request.args.get('user_id', type=int) or None,
+        "status": request.args.get('status') or None,
+    }
     
-    return jsonify({
-        "data": filtered,
-        "total": len(filtered)
-    })
+    return paginated_response(storage.orders, filters)
 
-@app.route('/orders/<order_id>', methods=['GET'])
+def stats_body(rollups):
+    """把仓库的汇总结果转成响应格式，各分组为 [{字段: 取值, count, total}]"""
+    (count, total), groups = rollups
+    body = {"count": count, "total": float(total)}
+    for field, group in groups.items():
+        body[f"by_{field}"] = [{field: value, "count": n, "total": float(amount)}
+                               for value, n, amount in group]
+    return body
+
+@api.route('/orders/stats', methods=['GET'])
+def get_order_stats():
+    """
+    Get order statistics
+    ---
+    tags:
+      - Orders
+    description: 订单数与金额合计，按 status、user_id、product_id 分组。汇总随订单写入增量维护，查询不扫描订单表
+    responses:
+      200:
+        description: Order statistics
+        schema:
+          type: object
+          properties:
+            count:
+              type: integer
+            total:
+              type: number
+            by_status:
+              type: array
+              items:
+                type: object
+            by_user_id:
+              type: array
+              items:
+                type: object
+            by_product_id:
+              type: array
+              items:
+                type: object
+    """
+    return jsonify(stats_body(storage.orders.rollups()))
+
+@api.route('/orders/stats/check', methods=['GET'])
+def check_order_stats():
+    """
+    Check order statistics against a full recomputation
+    ---
+    tags:
+      - Orders
+    description: 扫描全部订单重新计算汇总，与增量维护的汇总逐组比较，返回不一致的分组
+    responses:
+      200:
+        description: Check result
+    """
+    orders = storage.orders
+    rollups = orders.rollups()
+    recomputed = compute_rollups(orders, orders.rollup_fields, orders.rollup_sum)
+    
+    mismatches = []
+    if rollups[0] != recomputed[0]:
+        mismatches.append({"group": "all", "rollup": rollups[0][0], "recomputed": recomputed[0][0]})
+    for field in orders.rollup_fields:
+        actual = {value: (n, amount) for value, n, amount in rollups[1][field]}
+        expected = {value: (n, amount) for value, n, amount in recomputed[1][field]}
+        for value in actual.keys() | expected.keys():
+            if actual.get(value) != expected.get(value):
+                mismatches.append({
+                    "group": f"by_{field}", "value": value,
+                    "rollup": stats_entry(actual.get(value)),
+                    "recomputed": stats_entry(expected.get(value)),
+                })
+    return jsonify({"consistent": not mismatches, "checked": recomputed[0][0], "mismatches": mismatches})
+
+def stats_entry(entry):
+    if entry is None:
+        return None
+    count, total = entry
+    return {"count": count, "total": float(total)}
+
+@api.route('/orders/<order_id>', methods=['GET'])
 def get_order(order_id):
     """
     Get a single order
@@ -726,12 +1134,12 @@ def get_order(order_id):
       404:
         description: Order not found
     """
-    order = next((o for o in orders if o['id'] == order_id), None)
+    order = storage.orders.get(order_id)
     if order:
         return jsonify(order)
     return jsonify({"error": "订单不存在"}), 404
 
-@app.route('/orders', methods=['POST'])
+@api.route('/orders', methods=['POST'])
 def create_order():
     """
     Create a new order
@@ -747,7 +1155,6 @@ def create_order():
           required:
             - user_id
             - product_id
-            - quantity
           properties:
             user_id:
               type: integer
@@ -757,6 +1164,8 @@ def create_order():
               example: 1
             quantity:
               type: integer
+              minimum: 1
+              default: 1
               example: 1
     responses:
       201:
@@ -765,32 +1174,115 @@ def create_order():
         description: Invalid data
     """
     data = request.get_json()
-    if not data:
-        return jsonify({"error": "请提供订单数据"}), 400
-    
-    product = next((p for p in products if p['id'] == data.get('product_id')), None)
+    product = storage.products.get(data['product_id'])
     if not product:
         return jsonify({"error": "商品不存在"}), 400
     
-    quantity = data.get('quantity', 1)
-    total = product['price'] * quantity
+    fields = order_fields(data, product)
+    # 同一秒内随机后缀可能重复，插入时主键冲突(包括并发请求抢先插入)就重新生成
+    while True:
+        new_order = {"id": new_order_id(), **fields}
+        try:
+            storage.orders.insert(new_order)
+            break
+        except KeyError:
+            continue
     
-    new_order = {
-        "id": f"ORD{datetime.now().strftime('%Y%m%d%H%M%S')}{random.randint(100, 999)}",
+    return jsonify(new_order), 201
+
+def order_fields(data, product):
+    """由请求数据和商品算出新订单除 ID 外的字段"""
+    quantity = data.get('quantity', 1)
+    return {
         "user_id": data['user_id'],
         "product_id": data['product_id'],
         "quantity": quantity,
-        "total": total,
+        "total": product['price'] * quantity,
         "status": "pending",
         "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     }
-    orders.append(new_order)
+
+def new_order_id(digits=3):
+    """ORD + 当前时间 + digits 位随机数"""
+    low = 10 ** (digits - 1)
+    return f"ORD{datetime.now().strftime('%Y%m%d%H%M%S')}{random.randint(low, 10 * low - 1)}"
+
+@api.route('/orders/batch', methods=['POST'])
+def create_orders_batch():
+    """
+    Create orders in batch
+    ---
+    tags:
+      - Orders
+    description: 一次创建多个订单。先校验全部条目(商品一次批量查询)，再一次性写入合法的条目，逐条返回结果；全部成功返回 201，部分失败返回 207。批量创建的订单号随机部分为 5 位
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: array
+          items:
+            type: object
+            required:
+              - user_id
+              - product_id
+            properties:
+              user_id:
+                type: integer
+              product_id:
+                type: integer
+              quantity:
+                type: integer
+                minimum: 1
+                default: 1
+    responses:
+      201:
+        description: All orders created
+      207:
+        description: Some items failed, see results
+      400:
+        description: Body is not a non-empty array
+    """
+    items, error = batch_items()
+    if error:
+        return error
     
-    return jsonify(new_order), 201
+    results = [None] * len(items)
+    validate = request_validators[request.endpoint].items
+    errors = [validate(data) for data in items]
+    products = storage.products.get_many(
+        [data['product_id'] if error is None else None for data, error in zip(items, errors)])
+    pending = []
+    for i, (data, error, product) in enumerate(zip(items, errors, products)):
+        if error:
+            results[i] = item_error(i, error)
+        elif not product:
+            results[i] = {"index": i, "status": 400, "error": "商品不存在"}
+        else:
+            pending.append((i, order_fields(data, product)))
+    
+    # 批内订单号先去重，与已有订单冲突的条目换一个订单号重试
+    while pending:
+        used = set()
+        attempt = []
+        for i, fields in pending:
+            order_id = new_order_id(5)
+            while order_id in used:
+                order_id = new_order_id(5)
+            used.add(order_id)
+            attempt.append((i, fields, {"id": order_id, **fields}))
+        inserted = storage.orders.insert_many([order for _, _, order in attempt])
+        pending = []
+        for (i, fields, order), ok in zip(attempt, inserted):
+            if ok:
+                results[i] = {"index": i, "status": 201, "data": order}
+            else:
+                pending.append((i, fields))
+    return batch_response(results)
 
 # ==================== 测试辅助接口 ====================
 
-@app.route('/test/accounts', methods=['GET'])
+@api.route('/test/accounts', methods=['GET'])
 def get_test_accounts():
     """
     Get all test accounts (for testing purpose)
@@ -815,33 +1307,265 @@ def get_test_accounts():
         "accounts": accounts_info
     })
 
-@app.route('/test/reset', methods=['POST'])
+@api.route('/test/reset', methods=['POST'])
 def reset_data():
     """
     Reset all data to initial state
     ---
     tags:
       - Test Helper
-    description: 重置所有数据到初始状态，用于测试前清理
+    description: 重置所有数据(用户、商品、订单、登录 token)到服务启动时的状态，用于测试前清理
     responses:
       200:
         description: Data reset successfully
     """
-    global users, products, orders, active_tokens
-    
-    users = [
-        {"id": 1, "name": "张三", "email": "zhangsan@example.com", "phone": "13800138001", "status": "active"},
-        {"id": 2, "name": "李四", "email": "lisi@example.com", "phone": "13800138002", "status": "active"},
-        {"id": 3, "name": "王五", "email": "wangwu@example.com", "phone": "13800138003", "status": "inactive"},
-        {"id": 4, "name": "Alice", "email": "alice@example.com", "phone": "13800138004", "status": "active"},
-        {"id": 5, "name": "Bob", "email": "bob@example.com", "phone": "13800138005", "status": "active"},
-    ]
-    
-    active_tokens = {}
+    storage.restore(storage.snapshots[INITIAL_SNAPSHOT])
     
     return jsonify({"message": "数据已重置"})
 
+@api.route('/test/snapshot/<name>', methods=['POST'])
+def save_snapshot(name):
+    """
+    Save a named snapshot of all data
+    ---
+    tags:
+      - Test Helper
+    description: 把当前所有数据保存为命名快照，同名快照会被覆盖；内存后端保存和恢复都与数据量无关
+    parameters:
+      - name: name
+        in: path
+        type: string
+        required: true
+        description: 快照名称
+    responses:
+      200:
+        description: Snapshot saved
+    """
+    old = storage.snapshots.get(name)
+    storage.snapshots[name] = storage.snapshot()
+    if old is not None:
+        storage.drop_snapshot(old)
+    return jsonify({"message": "快照已保存", "name": name})
+
+@api.route('/test/restore/<name>', methods=['POST'])
+def restore_snapshot(name):
+    """
+    Restore all data from a named snapshot
+    ---
+    tags:
+      - Test Helper
+    description: 把所有数据恢复到命名快照保存时的状态，快照可以反复恢复
+    parameters:
+      - name: name
+        in: path
+        type: string
+        required: true
+        description: 快照名称
+    responses:
+      200:
+        description: Snapshot restored
+      404:
+        description: Snapshot not found
+    """
+    snap = storage.snapshots.get(name)
+    if snap is None:
+        return jsonify({"error": "快照不存在"}), 404
+    storage.restore(snap)
+    return jsonify({"message": "快照已恢复", "name": name})
+
+# ==================== 请求体校验 ====================
+# 各接口文档字符串里声明的请求体约束(required、type、minLength、maxLength、minimum …)
+# 在 create_app 注册完路由后编译一次，请求进入视图前按表校验，不通过时返回 400 和对应的 error_code。
+# 批量接口的请求体只校验是不是数组，条目由视图用 .items 逐条校验
+
+@api.before_app_request
+def validate_request_body():
+    """按路由的 schema 校验请求体"""
+    if request.method not in ('POST', 'PUT', 'PATCH'):
+        return None
+    validator = current_state().validators.get(request.endpoint)
+    if validator is None:
+        return None
+    error = validator(request.get_json(silent=True))
+    if error is None:
+        return None
+    code, message = error
+    return jsonify({"success": False, "error": message, "error_code": code}), 400
+
+# ==================== 应用工厂 ====================
+
+class AppState:
+    """一个 app 的运行状态：存储、请求日志、流量录制、签名器、指标、响应缓存、压缩和请求体校验
+
+    由 create_app 按 settings 创建，保存在 app.extensions["api"] 上
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.compressor = Compressor(settings['compress_min_size'], settings['compress_level'])
+        self.response_cache = ResponseCache(settings['cache_bytes'])
+        self.metrics = Metrics()
+        self.storage = init_storage(settings['storage'], settings['db'],
+                                    ttl=settings['token_ttl'], max_tokens=settings['max_tokens'])
+        self.token_signer = init_token_signer(self.storage, settings['token_mode'], settings['token_secret'],
+                                              settings['token_ttl'])
+        self.request_log = None
+        self.traffic_recorder = None
+        self.init_request_log(settings['log_file'])
+        self.init_traffic_recorder(settings['record'], settings['record_secrets'])
+        self.validators = {}
+        self.api_docs = None
+        self.profiler = None
+
+    def init_request_log(self, path=None):
+        """创建请求日志写出器；替换旧的写出器时先写完它队列里的记录"""
+        if self.request_log is not None:
+            self.request_log.close()
+        self.request_log = RequestLog(path, body_max=LOG_BODY_MAX, body_rates=LOG_BODY_RATES)
+        return self.request_log
+
+    def init_traffic_recorder(self, path, secrets=False):
+        """开始把请求录制到 path；path 为空时关闭录制。secrets 为 True 时不替换凭据"""
+        if self.traffic_recorder is not None:
+            self.traffic_recorder.close()
+        self.traffic_recorder = TrafficRecorder(path, secrets=secrets) if path else None
+        return self.traffic_recorder
+
+    def close(self):
+        """写完日志和录制文件，停止 token 仓库的后台清理线程"""
+        self.storage.close()
+        self.request_log.close()
+        if self.traffic_recorder is not None:
+            self.traffic_recorder.close()
+
+
+# 进程退出时关闭所有还在使用的 app 的日志和录制文件
+_states = weakref.WeakSet()
+atexit.register(lambda: [state.close() for state in list(_states)])
+
+
+def create_app(config=None):
+    """按 config 创建一个新的 app，各组件(存储、日志、指标 …)都是这个 app 独有的
+
+    config 的键(未给出的取对应的环境变量)：
+    - storage：存储后端，memory 或 sqlite (API_STORAGE，默认 memory)
+    - db：sqlite 数据库文件 (API_DB_PATH，默认 api_server.db)
+    - log_file：请求日志文件，None 表示 stdout (API_LOG_FILE)
+    - record：流量录制文件，None 表示不录制 (API_RECORD_FILE)
+    - record_secrets：录制时保留 Authorization 等请求头和登录密码的原值 (API_RECORD_SECRETS=1，默认替换掉)
+    - token_mode：登录 token 的形式，opaque 或 signed (API_TOKEN_MODE，默认 opaque)
+    - token_secret：signed 模式的签名密钥，None 表示随机生成 (API_TOKEN_SECRET)
+    - token_ttl：登录 token 的有效期，秒 (API_TOKEN_TTL，默认 24 小时)
+    - max_tokens：最多保存的 token 数，超出时挤掉最早签发的，0 表示不限 (API_MAX_TOKENS，默认 100000)
+    - compress_level、compress_min_size：响应压缩级别和最小字节数 (API_COMPRESS_LEVEL、API_COMPRESS_MIN_SIZE)
+    - cache_bytes：响应缓存的总大小，0 表示关闭 (API_CACHE_BYTES)
+    - profile：允许哪些客户端剖析请求，local、any 或 off (API_PROFILE，默认 local)
+    - profile_dir：X-Profile: collapsed 写调用栈文件的目录，只保留最新的 100 个 (API_PROFILE_DIR，默认 profiles)
+    - docs_cache：Swagger 规范的缓存目录 (API_DOCS_CACHE，默认 .apidocs_cache)
+
+    同一进程里可以创建多个配置不同的 app，互不影响；共用同一个 sqlite 文件的 app 看到的是同一份数据。
+    不再使用的 app 调用 ``app.extensions["api"].close()`` 释放日志写出器和清理线程。
+    """
+    settings = {
+        "storage": os.environ.get('API_STORAGE', 'memory'),
+        "db": os.environ.get('API_DB_PATH', 'api_server.db'),
+        "log_file": os.environ.get('API_LOG_FILE'),
+        "record": os.environ.get('API_RECORD_FILE'),
+        "record_secrets": os.environ.get('API_RECORD_SECRETS') == '1',
+        "token_mode": os.environ.get('API_TOKEN_MODE', 'opaque'),
+        "token_secret": os.environ.get('API_TOKEN_SECRET'),
+        "token_ttl": int(os.environ.get('API_TOKEN_TTL', DEFAULT_TTL)),
+        "max_tokens": int(os.environ.get('API_MAX_TOKENS', DEFAULT_MAX_TOKENS)),
+        "compress_level": int(os.environ.get('API_COMPRESS_LEVEL', DEFAULT_LEVEL)),
+        "compress_min_size": int(os.environ.get('API_COMPRESS_MIN_SIZE', DEFAULT_MIN_SIZE)),
+        "cache_bytes": int(os.environ.get('API_CACHE_BYTES', DEFAULT_MAX_BYTES)),
+        "profile": os.environ.get('API_PROFILE', 'local'),
+        "profile_dir": os.environ.get('API_PROFILE_DIR', DEFAULT_PROFILE_DIR),
+        "docs_cache": os.environ.get('API_DOCS_CACHE'),
+    }
+    settings.update(config or {})
+
+    app = Flask(__name__)
+    # ==================== 中文支持配置 ====================
+    app.config['JSON_AS_ASCII'] = False  # 支持中文返回
+    app.config['JSONIFY_MIMETYPE'] = 'application/json; charset=utf-8'
+    # jsonify 优先用 orjson 序列化，输出与 Flask 默认的 provider 逐字节相同(见 json_provider.py)
+    app.json = FastJSONProvider(app)
+    app.config['API_SETTINGS'] = settings
+
+    state = AppState(settings)
+    app.extensions["api"] = state
+    _states.add(state)
+    app.register_blueprint(api)
+    state.api_docs = ApiDocs(app, state.compressor,
+                             settings['docs_cache'] or os.path.join(app.root_path, '.apidocs_cache'))
+    state.validators = compile_validators(app)
+    state.profiler = ProfilingMiddleware(app.wsgi_app, allow=settings['profile'], directory=settings['profile_dir'])
+    app.wsgi_app = state.profiler
+    return app
+
+
+def __getattr__(name):
+    """``api_server.app``：第一次用到时按环境变量创建的默认 app(基准脚本、``flask --app api_server`` 等使用)"""
+    if name == 'app':
+        globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 if __name__ == '__main__':
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="API 测试服务器")
+    parser.add_argument('--storage', choices=BACKENDS, default=os.environ.get('API_STORAGE'),
+                        help="存储后端 (默认 memory，多进程时默认 sqlite，也可用环境变量 API_STORAGE 指定)")
+    parser.add_argument('--db', default=os.environ.get('API_DB_PATH', 'api_server.db'),
+                        help="sqlite 后端的数据库文件 (默认 api_server.db)")
+    parser.add_argument('--log-file', default=os.environ.get('API_LOG_FILE'),
+                        help="请求日志追加写入的文件 (默认输出到 stdout，也可用环境变量 API_LOG_FILE 指定)")
+    parser.add_argument('--record', nargs='?', const=DEFAULT_RECORD_FILE, default=os.environ.get('API_RECORD_FILE'),
+                        help=f"把每个请求录制到文件，供 traffic.py 回放 (不写文件名时为 {DEFAULT_RECORD_FILE})")
+    parser.add_argument('--record-secrets', action='store_true', default=os.environ.get('API_RECORD_SECRETS') == '1',
+                        help="录制时保留 Authorization / Cookie / X-Api-Key 请求头和登录密码的原值 (默认替换为 [REDACTED])")
+    parser.add_argument('--profile', choices=('local', 'any', 'off'), default=os.environ.get('API_PROFILE', 'local'),
+                        help="允许哪些客户端用 X-Profile / ?__profile 剖析请求 (默认 local，仅本机)")
+    parser.add_argument('--profile-dir', default=os.environ.get('API_PROFILE_DIR', DEFAULT_PROFILE_DIR),
+                        help=f"X-Profile: collapsed 写调用栈文件的目录，只保留最新的 {DEFAULT_KEEP} 个 (默认 {DEFAULT_PROFILE_DIR})")
+    parser.add_argument('--compress-level', type=int, choices=range(10),
+                        default=int(os.environ.get('API_COMPRESS_LEVEL', DEFAULT_LEVEL)),
+                        metavar='{0-9}', help=f"gzip/deflate 压缩级别，0 表示不压缩 (默认 {DEFAULT_LEVEL})")
+    parser.add_argument('--compress-min-size', type=int,
+                        default=int(os.environ.get('API_COMPRESS_MIN_SIZE', DEFAULT_MIN_SIZE)),
+                        help=f"小于这个字节数的响应不压缩 (默认 {DEFAULT_MIN_SIZE})")
+    parser.add_argument('--token-mode', choices=TOKEN_MODES, default=os.environ.get('API_TOKEN_MODE', 'opaque'),
+                        help="登录 token 的形式：opaque 保存在服务器上，signed 为 HMAC 签名、不查存储 (默认 opaque)")
+    parser.add_argument('--token-secret', default=os.environ.get('API_TOKEN_SECRET'),
+                        help="signed 模式的签名密钥，多个节点需要相同 (默认启动时随机生成，也可用环境变量 API_TOKEN_SECRET 指定)")
+    parser.add_argument('--token-ttl', type=int, default=int(os.environ.get('API_TOKEN_TTL', DEFAULT_TTL)),
+                        help=f"登录 token 的有效期，秒 (默认 {DEFAULT_TTL})")
+    parser.add_argument('--max-tokens', type=int, default=int(os.environ.get('API_MAX_TOKENS', DEFAULT_MAX_TOKENS)),
+                        help=f"最多保存的登录 token 数，超出时挤掉最早签发的，0 表示不限 (默认 {DEFAULT_MAX_TOKENS})")
+    parser.add_argument('--workers', type=int,
+                        help="以生产模式运行：预先 fork 的工作进程数，共用监听端口，关闭 debug (不指定时运行开发服务器)")
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS,
+                        help=f"生产模式下每个工作进程处理请求的线程数 (默认 {DEFAULT_THREADS})")
+    parser.add_argument('--port', type=int, default=5001, help="监听端口 (默认 5001)")
+    args = parser.parse_args()
+    # 工作进程之间不共享内存，多进程时数据必须放在 sqlite 里
+    multiprocess = (args.workers or 1) > 1
+    args.storage = args.storage or ('sqlite' if multiprocess else 'memory')
+    if multiprocess and args.storage == 'memory':
+        parser.error("多个工作进程的内存数据互不相通，请使用 --storage sqlite")
+    if multiprocess and args.record:
+        parser.error("--record 只支持单进程运行")
+    if args.workers is not None and (args.workers < 1 or args.threads < 1):
+        parser.error("--workers 和 --threads 至少为 1")
+    app = create_app({"storage": args.storage, "db": args.db, "log_file": args.log_file, "record": args.record,
+                      "record_secrets": args.record_secrets, "token_mode": args.token_mode,
+                      "token_secret": args.token_secret, "token_ttl": args.token_ttl, "max_tokens": args.max_tokens,
+                      "profile": args.profile, "profile_dir": args.profile_dir,
+                      "compress_level": args.compress_level, "compress_min_size": args.compress_min_size})
+    state = app.extensions["api"]
+    
     print("=" * 50)
     print("API 测试服务器已启动!")
     print("=" * 50)
@@ -849,6 +1573,28 @@ if __name__ == '__main__':
     for username, info in test_accounts.items():
         print(f"  - {username} / {info['password']} ({info['name']})")
     print("=" * 50)
-    print("Swagger UI: http://localhost:5001/apidocs")
+    print(f"存储后端: {state.storage.backend}")
+    print(f"登录 token: {args.token_mode}")
+    if args.workers is not None:
+        print(f"生产模式: {args.workers} 个工作进程 x {args.threads} 个线程")
+    print(f"Swagger UI: http://localhost:{args.port}/apidocs")
     print("=" * 50)
-    app.run(debug=True, host='0.0.0.0', port=5001)
+    if args.workers is None:
+        app.run(debug=True, host='0.0.0.0', port=args.port)
+    else:
+        app.debug = False
+        metrics_dir = tempfile.mkdtemp(prefix='api-metrics-')
+
+        def init_worker(index):
+            """工作进程启动：fork 前启动的日志线程和 token 清理线程不会出现在子进程里，重新创建日志写出器、
+            重新启动清理；指标改为写入共享目录，/metrics 汇总所有工作进程"""
+            state.init_request_log(state.request_log.path)
+            state.storage.tokens.after_fork()
+            state.storage.revocations.after_fork()
+            state.metrics = Metrics(metrics_dir)
+
+        try:
+            serve(app, '0.0.0.0', args.port, workers=args.workers, threads=args.threads,
+                  on_worker_start=init_worker, on_worker_exit=lambda index: state.request_log.close())
+        finally:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
@@ -0,0 +1,359 @@
+"""ASGI 入口：在 asyncio 事件循环上提供与 api_server 完全相同的接口
+
+``app`` 是标准的 ASGI 3 应用，可以交给任何 ASGI 服务器(例如 ``uvicorn asgi:app --port 5001``)；
+不装额外依赖时用本模块自带的 asyncio HTTP/1.1 服务器运行::
+
+    python asgi.py --port 5001 --threads 8
+
+请求最终由同一个 Flask 应用处理，路由、数据层和响应格式与 api_server 相同：
+
+- 接受连接、保持 keep-alive、接收请求体、发送响应体都在事件循环里完成，
+  慢客户端和空闲连接只占一个协程和它的读写缓冲区，不占线程，上千个连接只需要几 MB 内存
+- 请求体收齐后，视图函数在 ``threads`` 个线程的线程池里执行(它们都是同步的、只做内存或
+  sqlite 上的短操作)；线程只在真正处理请求的那段时间被占用
+- 流式响应逐块从线程池里取出、逐块发送
+"""
+import argparse
+import asyncio
+import io
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from http import HTTPStatus
+from urllib.parse import unquote
+
+import api_server
+from prefork import DEFAULT_THREADS, KEEPALIVE_TIMEOUT, LISTEN_BACKLOG
+from store import BACKENDS
+
+# 请求行加请求头的最大字节数
+MAX_HEADER_BYTES = 64 * 1024
+# 停止时等待正在处理的请求的最长时间(秒)
+SHUTDOWN_TIMEOUT = 30
+_END = object()
+
+
+class WSGIAdapter:
+    """把 WSGI 应用包装成 ASGI 应用：I/O 在事件循环里，WSGI 调用在线程池里"""
+
+    def __init__(self, wsgi_app, threads=DEFAULT_THREADS):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="asgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError(f"不支持的 ASGI 连接类型: {scope['type']}")
+
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        loop = asyncio.get_running_loop()
+        status, headers, data, rest = await loop.run_in_executor(
+            self.executor, self._start, self._environ(scope, bytes(body)))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        if rest is None:
+            await send({'type': 'http.response.body', 'body': data})
+            return
+
+        iterator, app_iter = rest
+        try:
+            while data is not _END:
+                if data:
+                    await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+                data = await loop.run_in_executor(self.executor, next, iterator, _END)
+        finally:
+            if hasattr(app_iter, 'close'):
+                await loop.run_in_executor(self.executor, app_iter.close)
+        await send({'type': 'http.response.body', 'body': b''})
+
+    def _start(self, environ):
+        """(线程池中)调用 WSGI 应用，返回 (状态码, 响应头, 响应体, 剩余部分)
+
+        带 Content-Length 的响应已经完整生成，一次取完，剩余部分为 None；
+        否则只取第一块，剩余部分是 (迭代器, app_iter)，由调用方逐块取出。
+        """
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and started:
+                raise exc_info[1].with_traceback(exc_info[2])
+            started[:] = [status, headers]
+            return written.append
+
+        written = []
+        app_iter = self.wsgi_app(environ, start_response)
+        iterator = iter(app_iter)
+        first = next(iterator, _END)
+        status, headers = started
+        status = int(status.split(' ', 1)[0])
+        encoded = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+        if any(name == b'content-length' for name, _ in encoded):
+            try:
+                chunks = written + ([] if first is _END else [first]) + list(iterator)
+            finally:
+                if hasattr(app_iter, 'close'):
+                    app_iter.close()
+            return status, encoded, b''.join(chunks), None
+        return status, encoded, b''.join(written) + (b'' if first is _END else first), (iterator, app_iter)
+
+    @staticmethod
+    def _environ(scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope['headers']:
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+            # 请求体已经收齐(chunked 已解码)，长度以 CONTENT_LENGTH 为准
+            elif name not in ('CONTENT_LENGTH', 'TRANSFER_ENCODING'):
+                key = f'HTTP_{name}'
+                environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    @staticmethod
+    async def _lifespan(receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+class HTTPServer:
+    """运行一个 ASGI 应用的最小 asyncio HTTP/1.1 服务器(keep-alive、chunked、100-continue)"""
+
+    def __init__(self, app, host='0.0.0.0', port=5001, keepalive_timeout=KEEPALIVE_TIMEOUT):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.keepalive_timeout = keepalive_timeout
+        self._connections = {}  # writer -> 是否正在处理请求
+        self._tasks = set()
+        self._stopping = False
+        self._date_cache = (None, b'')
+
+    def _date(self):
+        """Date 响应头；同一秒内复用"""
+        now = int(time.time())
+        if self._date_cache[0] != now:
+            self._date_cache = (now, f"date: {formatdate(now, usegmt=True)}\r\n".encode('latin-1'))
+        return self._date_cache[1]
+
+    async def serve(self):
+        """一直运行到收到 SIGTERM / SIGINT；停止时不再接受连接，处理完正在进行的请求后返回"""
+        server = await asyncio.start_server(self._handle, self.host, self.port,
+                                            backlog=LISTEN_BACKLOG, limit=MAX_HEADER_BYTES)
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, stop.set)
+        await stop.wait()
+
+        self._stopping = True
+        server.close()
+        for writer, busy in list(self._connections.items()):
+            if not busy:
+                writer.close()
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=SHUTDOWN_TIMEOUT)
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        self._connections[writer] = False
+        try:
+            while not self._stopping:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.keepalive_timeout)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, TimeoutError, ConnectionError):
+                    break
+                self._connections[writer] = True
+                keep_alive = await self._request(head, reader, writer)
+                self._connections[writer] = False
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            del self._connections[writer]
+            self._tasks.discard(task)
+            writer.close()
+
+    async def _request(self, head, reader, writer):
+        """处理一个请求，返回连接是否保持"""
+        lines = head[:-4].split(b'\r\n')
+        try:
+            method, target, version = lines[0].decode('latin-1').split(' ')
+            headers = []
+            for line in lines[1:]:
+                name, sep, value = line.partition(b':')
+                if not sep:
+                    raise ValueError(line)
+                headers.append((name.strip().lower(), value.strip()))
+            fields = {}
+            for name, value in headers:
+                fields[name] = fields[name] + b',' + value if name in fields else value
+            chunked = b'chunked' in fields.get(b'transfer-encoding', b'').lower()
+            length = 0 if chunked else int(fields.get(b'content-length', 0))
+        except ValueError:
+            writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            return False
+
+        connection = fields.get(b'connection', b'').lower()
+        keep_alive = b'close' not in connection if version == 'HTTP/1.1' else b'keep-alive' in connection
+        path, _, query = target.partition('?')
+        peer, sock = writer.get_extra_info('peername'), writer.get_extra_info('sockname')
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0', 'spec_version': '2.3'},
+            'http_version': version[5:],
+            'method': method,
+            'scheme': 'http',
+            'path': unquote(path),
+            'raw_path': path.encode('latin-1'),
+            'query_string': query.encode('latin-1'),
+            'root_path': '',
+            'headers': headers,
+            'client': tuple(peer[:2]) if peer else None,
+            'server': tuple(sock[:2]) if sock else None,
+        }
+        state = {'received': False, 'started': False, 'chunked': False, 'keep_alive': keep_alive}
+
+        async def receive():
+            if state['received']:
+                return {'type': 'http.disconnect'}
+            state['received'] = True
+            if fields.get(b'expect', b'').lower() == b'100-continue':
+                writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+            body = await self._read_chunked(reader) if chunked else await reader.readexactly(length)
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                state['started'] = True
+                status = message['status']
+                try:
+                    reason = HTTPStatus(status).phrase
+                except ValueError:
+                    reason = ''
+                out = [f"HTTP/1.1 {status} {reason}\r\n".encode('latin-1'), self._date()]
+                out += [name + b': ' + value + b'\r\n' for name, value in message.get('headers', ())]
+                has_body = method != 'HEAD' and status >= 200 and status not in (204, 304)
+                if has_body and not any(name.lower() == b'content-length' for name, _ in message.get('headers', ())):
+                    if version == 'HTTP/1.1':
+                        state['chunked'] = True
+                        out.append(b'transfer-encoding: chunked\r\n')
+                    else:
+                        state['keep_alive'] = False
+                if not state['keep_alive'] or self._stopping:
+                    out.append(b'connection: close\r\n')
+                writer.write(b''.join(out) + b'\r\n')
+            elif message['type'] == 'http.response.body':
+                body = message.get('body', b'')
+                if state['chunked']:
+                    if body:
+                        writer.write(b'%x\r\n%s\r\n' % (len(body), body))
+                    if not message.get('more_body'):
+                        writer.write(b'0\r\n\r\n')
+                elif body:
+                    writer.write(body)
+                await writer.drain()
+
+        try:
+            await self.app(scope, receive, send)
+        except Exception:
+            if state['started']:
+                return False
+            writer.write(b'HTTP/1.1 500 Internal Server Error\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            return False
+        if not state['received'] and (chunked or length):
+            await receive()  # 应用没读请求体时读掉它，下一个请求才能正确分帧
+        await writer.drain()
+        return state['keep_alive'] and not self._stopping
+
+    @staticmethod
+    async def _read_chunked(reader):
+        body = bytearray()
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).split(b';', 1)[0], 16)
+            if not size:
+                # 跳过 trailer，直到空行
+                while await reader.readuntil(b'\r\n') != b'\r\n':
+                    pass
+                return bytes(body)
+            body += await reader.readexactly(size)
+            await reader.readexactly(2)
+
+
+def __getattr__(name):
+    """``app``：第一次用到时按环境变量创建(``uvicorn asgi:app``)，只导入模块时不创建"""
+    if name == 'app':
+        globals()['app'] = WSGIAdapter(api_server.create_app())
+        return globals()['app']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def main():
+    global app
+    parser = argparse.ArgumentParser(description="API 测试服务器(asyncio / ASGI)")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5001, help="监听端口 (默认 5001)")
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS,
+                        help=f"执行视图函数的线程数 (默认 {DEFAULT_THREADS})")
+    parser.add_argument('--storage', choices=BACKENDS, default=os.environ.get('API_STORAGE', 'memory'),
+                        help="存储后端 (默认 memory，也可用环境变量 API_STORAGE 指定)")
+    parser.add_argument('--db', default=os.environ.get('API_DB_PATH', 'api_server.db'),
+                        help="sqlite 后端的数据库文件 (默认 api_server.db)")
+    parser.add_argument('--log-file', default=os.environ.get('API_LOG_FILE'),
+                        help="请求日志追加写入的文件 (默认输出到 stdout)")
+    args = parser.parse_args()
+    if args.threads < 1:
+        parser.error("--threads 至少为 1")
+
+    flask_app = api_server.create_app({"storage": args.storage, "db": args.db, "log_file": args.log_file})
+    flask_app.debug = False
+    app = WSGIAdapter(flask_app, args.threads)
+
+    print("=" * 50)
+    print(f"API 测试服务器 (asyncio) 已启动: http://localhost:{args.port}")
+    print(f"存储后端: {flask_app.extensions['api'].storage.backend}  线程数: {args.threads}")
+    print("=" * 50)
+    asyncio.run(HTTPServer(app, args.host, args.port).serve())
+
+
+if __name__ == '__main__':
+    main()
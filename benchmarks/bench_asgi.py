@@ -0,0 +1,159 @@
+"""ASGI 与 WSGI 服务方式对比：1000 个并发 keep-alive 连接下的吞吐量、延迟、超时数和服务端内存
+
+运行: python benchmarks/bench_asgi.py [--connections 1000] [--duration 15] [--timeout 5]
+
+依次启动三种服务端(内存后端，日志写到 /dev/null)：
+
+- ``wsgi 1x8``：``api_server.py --workers 1 --threads 8``，每个 keep-alive 连接占住一个线程
+- ``wsgi 1xN``：线程数与连接数相同，每个连接一个线程
+- ``asgi 8``：``asgi.py --threads 8``，连接由事件循环保持，线程只用来执行视图函数
+
+客户端是一个 asyncio 进程，同时打开 ``--connections`` 个连接，每个连接循环发送列表/详情请求；
+单个请求超过 ``--timeout`` 秒没有响应计为超时并重连。内存是服务端进程组所有进程的 RSS 之和，
+在压测结束前测量。
+"""
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from traffic import percentile  # noqa: E402
+
+PATHS = [
+    "/products?limit=10",
+    "/users/1",
+    "/orders?limit=20",
+    "/products/3",
+]
+
+
+def start_server(command, port):
+    process = subprocess.Popen([sys.executable] + command + ["--port", str(port), "--log-file", os.devnull],
+                               cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                               start_new_session=True)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            asyncio.run(request_once(port))
+            return process
+        except OSError:
+            time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError("服务器没有启动")
+
+
+def stop_server(process):
+    os.killpg(process.pid, signal.SIGTERM)
+    try:
+        process.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+
+def group_rss_mb(pgid):
+    """进程组内所有进程的 RSS 之和(MB)"""
+    total = 0
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            if int(fields[2]) != pgid:
+                continue
+            with open(f'/proc/{pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+        except (FileNotFoundError, ProcessLookupError, IndexError):
+            continue
+    return total / 1024
+
+
+async def read_response(reader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    status = int(head[9:12])
+    length = 0
+    for line in head.split(b'\r\n'):
+        if line[:15].lower() == b'content-length:':
+            length = int(line[15:])
+    await reader.readexactly(length)
+    return status
+
+
+async def request_once(port):
+    reader, writer = await asyncio.open_connection("localhost", port)
+    writer.write(b"GET /products/1 HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+    await read_response(reader)
+    writer.close()
+
+
+async def connection(port, n, deadline, timeout, stats):
+    reader = writer = None
+    i = n
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection("localhost", port), timeout)
+            writer.write(f"GET {PATHS[i % len(PATHS)]} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+            status = await asyncio.wait_for(read_response(reader), timeout)
+        except (OSError, asyncio.IncompleteReadError, TimeoutError):
+            stats["timeouts"] += 1
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+            continue
+        if status != 200:
+            stats["errors"] += 1
+        stats["latencies"].append(time.perf_counter() - started)
+        i += 1
+    if writer is not None:
+        writer.close()
+
+
+async def load(port, connections, duration, timeout, pgid):
+    stats = {"latencies": [], "timeouts": 0, "errors": 0}
+    deadline = time.monotonic() + duration
+    tasks = [asyncio.create_task(connection(port, n, deadline, timeout, stats)) for n in range(connections)]
+    await asyncio.sleep(duration * 0.8)
+    rss = group_rss_mb(pgid)
+    await asyncio.gather(*tasks)
+    stats["latencies"].sort()
+    return stats, rss
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--connections', type=int, default=1000)
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--timeout', type=float, default=5)
+    parser.add_argument('--port', type=int, default=5056)
+    args = parser.parse_args()
+
+    servers = [
+        ("wsgi 1x8", ["api_server.py", "--workers", "1", "--threads", "8"]),
+        (f"wsgi 1x{args.connections}", ["api_server.py", "--workers", "1", "--threads", str(args.connections)]),
+        ("asgi 8", ["asgi.py", "--threads", "8"]),
+    ]
+    print(f"{'server':>12} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>9} {'timeouts':>9} {'errors':>7} {'RSS MB':>7}")
+    for name, command in servers:
+        process = start_server(command, args.port)
+        try:
+            stats, rss = asyncio.run(load(args.port, args.connections, args.duration, args.timeout, process.pid))
+        finally:
+            stop_server(process)
+        latencies = stats["latencies"]
+        print(f"{name:>12} {len(latencies) / args.duration:>8.0f} {percentile(latencies, 0.5) * 1e3:>8.1f} "
+              f"{percentile(latencies, 0.99) * 1e3:>9.1f} {stats['timeouts']:>9} {stats['errors']:>7} {rss:>7.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""批量接口基准：逐条 POST 与批量接口装载同样数量的用户/订单的耗时对比
+
+运行: python benchmarks/bench_batch.py [--count 100000] [--single 2000] [--base-url http://localhost:5001]
+
+需要先启动 api_server。逐条接口只实际发送 --single 条，按其吞吐量推算装载 --count 条的耗时；
+批量接口按 MAX_BATCH_SIZE 分批实际装载 --count 条用户和订单，最后按 ids 批量取回一批核对。
+测完调用 /test/reset 恢复数据。
+"""
+import argparse
+import time
+
+import requests
+
+BATCH_SIZE = 10000
+
+
+def users(start, n):
+    return [{"name": f"批量用户{i}", "email": f"bulk{i}@example.com"} for i in range(start, start + n)]
+
+
+def orders(start, n):
+    return [{"user_id": i % 1000 + 1, "product_id": i % 7 + 1, "quantity": i % 3 + 1}
+            for i in range(start, start + n)]
+
+
+def single(session, base_url, path, items):
+    start = time.perf_counter()
+    for item in items:
+        assert session.post(f"{base_url}{path}", json=item).status_code == 201
+    return time.perf_counter() - start
+
+
+def batched(session, base_url, path, make, count):
+    start = time.perf_counter()
+    created = []
+    for offset in range(0, count, BATCH_SIZE):
+        response = session.post(f"{base_url}{path}/batch", json=make(offset, min(BATCH_SIZE, count - offset)))
+        assert response.status_code == 201, response.text[:200]
+        created.extend(r["data"]["id"] for r in response.json()["results"])
+    return time.perf_counter() - start, created
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--single', type=int, default=2000)
+    parser.add_argument('--base-url', default='http://localhost:5001')
+    args = parser.parse_args()
+
+    session = requests.Session()
+    try:
+        print(f"{'':>8} {'single (est. s)':>16} {'batch (s)':>10} {'speedup':>8}")
+        for path, make in (("/users", users), ("/orders", orders)):
+            t_single = single(session, args.base_url, path, make(0, args.single)) * args.count / args.single
+            t_batch, created = batched(session, args.base_url, path, make, args.count)
+            print(f"{path:>8} {t_single:>16.1f} {t_batch:>10.2f} {t_single / t_batch:>7.0f}x")
+
+            sample = created[-100:]
+            fetched = session.get(f"{args.base_url}{path}",
+                                  params={"ids": ",".join(map(str, sample))}).json()
+            assert not fetched["missing"] and len(fetched["data"]) == len(sample)
+    finally:
+        session.post(f"{args.base_url}/test/reset")
+
+
+if __name__ == '__main__':
+    main()
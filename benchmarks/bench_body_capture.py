@@ -0,0 +1,80 @@
+"""响应体记录基准：解析再序列化响应体与直接截取原始字节的开销对比
+
+运行: python benchmarks/bench_body_capture.py [--number 200] [--body-max 4096]
+
+用 Flask test client 在进程内请求几个大小不同的列表接口，对每个响应测量：
+"reparse" 是改造前 after_request 的做法(get_data(as_text=True) -> json.loads -> json.dumps(indent=2))，
+"capture" 是现在的 RequestLog.capture_body 加上后台线程的格式化；
+另外给出关闭响应体记录 / 打开响应体记录时整个请求的 p50 延迟。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import api_server  # noqa: E402
+from request_log import RequestLog  # noqa: E402
+
+PATHS = ["/users/1", "/users?limit=100", "/orders?limit=1000"]
+
+
+def reparse(response):
+    return json.dumps(json.loads(response.get_data(as_text=True)), ensure_ascii=False, indent=2)
+
+
+def capture(log, endpoint, response):
+    body, size = log.capture_body(endpoint, response)
+    return log.format({"kind": "response", "time": 0, "status_code": 200, "status": "200 OK",
+                       "duration": 0.0, "content_type": response.content_type,
+                       "body": body, "body_size": size})
+
+
+def p50(client, path, number):
+    latencies = []
+    for _ in range(number):
+        start = time.perf_counter()
+        client.get(path)
+        latencies.append(time.perf_counter() - start)
+    return sorted(latencies)[number // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--number', type=int, default=200)
+    parser.add_argument('--body-max', type=int, default=4096)
+    args = parser.parse_args()
+
+    app = api_server.create_app({"log_file": os.devnull})
+    state = app.extensions["api"]
+    client = app.test_client()
+    client.post("/test/reset")
+    # 补足订单，让 /orders?limit=1000 返回满页
+    client.post("/orders/batch", json=[{"user_id": 1, "product_id": 1, "quantity": 1}] * 1000)
+
+    print(f"{'path':>20} {'bytes':>8} {'reparse (us)':>13} {'capture (us)':>13} "
+          f"{'req off (us)':>13} {'req on (us)':>12}")
+    for path in PATHS:
+        state.request_log.close()
+        log = state.request_log = RequestLog(os.devnull, body_max=args.body_max)
+        response = client.get(path)
+        endpoint = app.url_map.bind('localhost').match(path.split('?')[0])[0]
+
+        t_reparse = timeit.timeit(lambda: reparse(response), number=args.number) / args.number
+        t_capture = timeit.timeit(lambda: capture(log, endpoint, response), number=args.number) / args.number
+
+        log.default_body_rate = 0
+        t_off = p50(client, path, args.number)
+        log.default_body_rate = 1.0
+        t_on = p50(client, path, args.number)
+        log.close()
+        print(f"{path:>20} {len(response.get_data()):>8} {t_reparse * 1e6:>13.1f} {t_capture * 1e6:>13.1f} "
+              f"{t_off * 1e6:>13.0f} {t_on * 1e6:>12.0f}")
+    client.post("/test/reset")
+
+
+if __name__ == '__main__':
+    main()
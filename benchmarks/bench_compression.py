@@ -0,0 +1,79 @@
+"""响应压缩基准：各压缩级别下 gzip / deflate 节省的字节数与 CPU 耗时
+
+运行: python benchmarks/bench_compression.py [--rows 1000] [--repeat 20]
+
+响应体由 api_server 实际使用的 jsonify 生成：一页 ``rows`` 个用户(姓名含中文)和一页同样多的订单。
+对每个级别测量压缩一次的耗时(取最小值)、压缩后大小和压缩吞吐量；最后一列是同一响应
+从缓存返回已压缩结果的耗时，对应响应缓存命中时不必重新压缩的情形。
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from flask import Flask  # noqa: E402
+
+from compression import ENCODINGS, Compressor  # noqa: E402
+from json_provider import FastJSONProvider  # noqa: E402
+from response_cache import CachedResponse, ResponseCache  # noqa: E402
+
+STATUSES = ["pending", "paid", "shipped", "completed", "cancelled"]
+SURNAMES = "张王李赵刘陈杨黄周吴"
+
+
+def make_users(n, rnd):
+    return [{"id": i, "name": f"{rnd.choice(SURNAMES)}{rnd.choice(SURNAMES)}用户{i}",
+             "email": f"user{i}@example.com", "phone": f"138{rnd.randint(0, 99999999):08d}",
+             "status": rnd.choice(("active", "inactive", "pending"))} for i in range(1, n + 1)]
+
+
+def make_orders(n, rnd):
+    return [{"id": f"ORD{20231201000000000 + i}", "user_id": rnd.randint(1, 10000),
+             "product_id": rnd.randint(1, 8), "quantity": rnd.randint(1, 5),
+             "total": float(rnd.randint(99, 20000)), "status": rnd.choice(STATUSES),
+             "created_at": "2023-12-01 10:30:00"} for i in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    app = Flask(__name__)
+    app.json = FastJSONProvider(app)
+    with app.app_context():
+        bodies = {
+            "/users": app.json.response({"data": make_users(args.rows, rnd), "limit": args.rows}).get_data(),
+            "/orders": app.json.response({"data": make_orders(args.rows, rnd), "limit": args.rows}).get_data(),
+        }
+
+    print(f"{'path':>8} {'encoding':>8} {'level':>5} {'KB':>8} {'ratio':>6} {'saved KB':>9} "
+          f"{'ms':>7} {'MB/s':>7} {'cached us':>10}")
+    for path, body in bodies.items():
+        print(f"{path:>8} {'identity':>8} {'-':>5} {len(body) / 1024:>8.1f}")
+        for encoding in ENCODINGS:
+            for level in (1, 6, 9):
+                compressor = Compressor(level=level)
+                compressed = compressor.compress(body, encoding)
+                seconds = min(timeit.repeat(lambda: compressor.compress(body, encoding),
+                                            number=1, repeat=args.repeat))
+
+                cache = ResponseCache()
+                entry = CachedResponse((1,), body, 'application/json')
+                cache.put(path, entry)
+                cache.encoded(path, entry, encoding, compressor.compress)
+                hit = min(timeit.repeat(lambda: cache.encoded(path, entry, encoding, compressor.compress),
+                                        number=1000, repeat=5)) / 1000
+
+                print(f"{path:>8} {encoding:>8} {level:>5} {len(compressed) / 1024:>8.1f} "
+                      f"{len(body) / len(compressed):>5.1f}x {(len(body) - len(compressed)) / 1024:>9.1f} "
+                      f"{seconds * 1e3:>7.2f} {len(body) / seconds / 1e6:>7.0f} {hit * 1e6:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""二级索引过滤基准：Table.select/count 与原来的列表推导过滤对比
+
+运行: python benchmarks/bench_filters.py [--sizes 1000,100000,1000000]
+
+每个规模下固定 100 个商品属于 "测试" 分类，其余分布在常规分类中。
+索引查询的耗时只随结果集大小变化，列表过滤随商品总数线性增长。
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from store import Table  # noqa: E402
+
+CATEGORIES = ["手机", "电脑", "配件", "平板", "手表"]
+STATUSES = ["on_sale", "out_of_stock", "off_sale"]
+MATCHES = 100
+
+
+def make_products(n):
+    rows = []
+    for i in range(1, n + 1):
+        category = "测试" if i <= MATCHES else CATEGORIES[i % len(CATEGORIES)]
+        rows.append({"id": i, "name": f"商品{i}", "price": 99.0, "category": category,
+                     "stock": 10, "status": STATUSES[i % len(STATUSES)]})
+    return rows
+
+
+def bench(n, number):
+    rows = make_products(n)
+    table = Table(rows, indexes=("category", "status"))
+    filters = {"category": "测试", "status": "on_sale"}
+
+    def indexed():
+        table.select(filters, offset=0, limit=10)
+        table.count(filters)
+
+    def scan():
+        filtered = [p for p in rows if p['category'] == "测试"]
+        filtered = [p for p in filtered if p['status'] == "on_sale"]
+        filtered[0:10]
+        len(filtered)
+
+    t_indexed = min(timeit.repeat(indexed, number=number, repeat=5)) / number
+    scan_number = max(1, number * 1000 // n)
+    t_scan = min(timeit.repeat(scan, number=scan_number, repeat=3)) / scan_number
+    return t_indexed, t_scan
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,100000,1000000')
+    parser.add_argument('--number', type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'indexed (us)':>14} {'list filter (us)':>18}")
+    for n in (int(s) for s in args.sizes.split(',')):
+        t_indexed, t_scan = bench(n, args.number)
+        print(f"{n:>10} {t_indexed * 1e6:>14.1f} {t_scan * 1e6:>18.1f}")
+
+
+if __name__ == '__main__':
+    main()
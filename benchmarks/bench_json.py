@@ -0,0 +1,80 @@
+"""JSON 序列化基准：Flask 默认 provider 与 FastJSONProvider(标准库 / orjson)序列化整页商品、订单的耗时
+
+运行: python benchmarks/bench_json.py [--rows 100000] [--repeat 5]
+
+商品是按 dict 存放的 Table(名称、分类含中文)，订单是 orders 实际使用的 ColumnarTable。
+每种 provider 都从取一页开始计时(默认 provider 用 page 解码出 dict，FastJSONProvider 用
+page_compact)，到生成 jsonify 的响应体为止，分别在紧凑模式和 debug(缩进)模式下测量，
+并核对响应体与默认 provider 逐字节相同。
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from flask import Flask  # noqa: E402
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+
+from columnar import COLUMNAR_SCHEMA, ColumnarTable  # noqa: E402
+from json_provider import BACKENDS, FastJSONProvider  # noqa: E402
+from store import SCHEMA, Table  # noqa: E402
+
+STATUSES = ["pending", "paid", "shipped", "completed", "cancelled"]
+CATEGORIES = ["手机", "电脑", "配件", "平板", "手表"]
+
+
+def make_products(n, rnd):
+    return [{"id": i, "name": f"商品 {i} Pro", "price": float(rnd.randint(99, 20000)),
+             "category": rnd.choice(CATEGORIES), "stock": rnd.randint(0, 500),
+             "status": rnd.choice(("on_sale", "out_of_stock"))} for i in range(1, n + 1)]
+
+
+def make_orders(n, rnd):
+    return [{"id": f"ORD{20231201000000000 + i}", "user_id": rnd.randint(1, 10000),
+             "product_id": rnd.randint(1, 8), "quantity": rnd.randint(1, 5),
+             "total": float(rnd.randint(99, 20000)), "status": rnd.choice(STATUSES),
+             "created_at": "2023-12-01 10:30:00"} for i in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    tables = {
+        "/products": Table(make_products(args.rows, rnd)),
+        "/orders": ColumnarTable(make_orders(args.rows, rnd), columns=COLUMNAR_SCHEMA["orders"],
+                                 **SCHEMA["orders"]),
+    }
+    app = Flask(__name__)
+    providers = [("default", DefaultJSONProvider(app), "page")]
+    providers += [(f"fast/{backend}", FastJSONProvider(app, backend), "page_compact") for backend in BACKENDS]
+
+    print(f"{'path':>10} {'mode':>8} {'provider':>12} {'ms':>9} {'speedup':>8} {'MB':>6}")
+    for path, table in tables.items():
+        for debug in (False, True):
+            app.debug = debug
+            with app.app_context():
+                baseline = None
+                for name, provider, method in providers:
+                    def serialize():
+                        rows, _ = getattr(table, method)(limit=args.rows)
+                        return provider.response({"data": rows, "limit": args.rows, "next_cursor": None,
+                                                  "page": 1, "total": len(table)}).get_data()
+
+                    body = serialize()
+                    seconds = min(timeit.repeat(serialize, number=1, repeat=args.repeat))
+                    if baseline is None:
+                        baseline, expected = seconds, body
+                    assert body == expected, f"{name} 的输出与默认 provider 不同"
+                    print(f"{path:>10} {'debug' if debug else 'compact':>8} {name:>12} {seconds * 1e3:>9.1f} "
+                          f"{baseline / seconds:>7.1f}x {len(body) / 1e6:>6.1f}")
+
+
+if __name__ == '__main__':
+    main()
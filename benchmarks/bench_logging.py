@@ -0,0 +1,64 @@
+"""请求日志基准：在请求线程里同步格式化写出与放进队列由后台线程批量写出的延迟对比
+
+运行: python benchmarks/bench_logging.py [--requests 2000] [--log-file /tmp/bench_logging.log]
+
+用 Flask test client 在进程内发请求(不经过网络)，日志写入 --log-file。
+"sync" 相当于改造前的做法：每个请求在处理线程里格式化请求/响应体并写出；
+"async" 是现在的 RequestLog：请求线程只入队。两种模式都请求同样的列表/详情/创建接口，
+报告每个请求的 p50 / p99 延迟，以及 async 模式下写出和丢弃的记录数。
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import api_server  # noqa: E402
+from request_log import RequestLog  # noqa: E402
+
+REQUESTS = [
+    ("get", "/users?limit=100", None),
+    ("get", "/products", None),
+    ("get", "/orders?limit=100", None),
+    ("get", "/users/1", None),
+    ("post", "/users", {"name": "日志基准", "email": "bench@example.com"}),
+]
+
+
+def run(client, count):
+    latencies = []
+    for i in range(count):
+        method, path, body = REQUESTS[i % len(REQUESTS)]
+        start = time.perf_counter()
+        response = getattr(client, method)(path, json=body)
+        latencies.append(time.perf_counter() - start)
+        assert response.status_code < 400, response.status_code
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--log-file', default='/tmp/bench_logging.log')
+    args = parser.parse_args()
+
+    app = api_server.create_app({"log_file": os.devnull})
+    state = app.extensions["api"]
+    client = app.test_client()
+    print(f"{'mode':>6} {'p50 (us)':>10} {'p99 (us)':>10} {'written':>8} {'dropped':>8}")
+    for mode in ("sync", "async"):
+        state.request_log.close()
+        log = state.request_log = RequestLog(args.log_file, background=(mode == "async"))
+        client.post("/test/reset")
+        run(client, args.requests // 10)  # 预热
+        p50, p99 = run(client, args.requests)
+        log.close()
+        stats = log.stats()
+        print(f"{mode:>6} {p50 * 1e6:>10.0f} {p99 * 1e6:>10.0f} {stats['written']:>8} {stats['dropped']:>8}")
+    client.post("/test/reset")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""用户名子串搜索基准：n-gram 索引与原来的逐行 lower() 扫描对比
+
+运行: python benchmarks/bench_name_search.py [--sizes 10000,100000,1000000]
+
+用户名由常见中文姓名和英文名随机组合生成，查询覆盖 1~4 个字符的中英文子串。
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from store import Table  # noqa: E402
+
+SURNAMES = "张李王赵钱孙周吴郑冯陈褚卫蒋沈韩杨朱秦尤许何吕施"
+GIVEN = "伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂英华"
+LATIN = ["Alice", "Bob", "Carol", "Dave", "Erin", "Frank", "Grace", "Heidi", "Ivan", "Judy"]
+QUERIES = ["张", "张伟", "alice", "ob", "Grace H", "王芳娜"]
+
+
+def make_name(rnd):
+    if rnd.random() < 0.7:
+        return rnd.choice(SURNAMES) + ''.join(rnd.choice(GIVEN) for _ in range(rnd.randint(1, 2)))
+    return f"{rnd.choice(LATIN)} {rnd.choice(LATIN)[0]}{rnd.randint(1, 999)}"
+
+
+def bench(n, number):
+    rnd = random.Random(n)
+    rows = [{"id": i, "name": make_name(rnd)} for i in range(1, n + 1)]
+    start = time.perf_counter()
+    table = Table(rows, text_indexes=("name",))
+    build = time.perf_counter() - start
+
+    results = []
+    for q in QUERIES:
+        search = {"name": q}
+
+        def indexed():
+            table.select(search=search, offset=0, limit=10)
+            table.count(search=search)
+
+        def scan():
+            filtered = [u for u in rows if q.lower() in u['name'].lower()]
+            filtered[0:10]
+            len(filtered)
+
+        t_indexed = min(timeit.repeat(indexed, number=number, repeat=3)) / number
+        t_scan = min(timeit.repeat(scan, number=1, repeat=3))
+        results.append((q, table.count(search=search), t_indexed, t_scan))
+    return build, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--number', type=int, default=20)
+    args = parser.parse_args()
+
+    for n in (int(s) for s in args.sizes.split(',')):
+        build, results = bench(n, args.number)
+        print(f"\nusers={n}  index build {build:.2f}s")
+        print(f"{'query':>10} {'matches':>9} {'indexed (ms)':>14} {'scan (ms)':>11}")
+        for q, matches, t_indexed, t_scan in results:
+            print(f"{q:>10} {matches:>9} {t_indexed * 1e3:>14.3f} {t_scan * 1e3:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
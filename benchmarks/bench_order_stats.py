@@ -0,0 +1,67 @@
+"""订单汇总基准：增量维护的 rollups 与每次全表重算对比
+
+运行: python benchmarks/bench_order_stats.py [--sizes 10000,100000,1000000]
+
+每个规模下装载订单(与 orders 仓库相同的列存表和汇总配置)，测量：
+读取汇总、全表重算汇总(相当于客户端翻页求和)，以及维护汇总给单条写入带来的额外耗时。
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from columnar import COLUMNAR_SCHEMA, ColumnarTable  # noqa: E402
+from store import SCHEMA, compute_rollups  # noqa: E402
+
+STATUSES = ["pending", "paid", "shipped", "completed", "cancelled"]
+
+
+def make_orders(n, rnd):
+    return [{"id": f"ORD{20231201000000000 + i}", "user_id": rnd.randint(1, 10000),
+             "product_id": rnd.randint(1, 8), "quantity": 1, "total": float(rnd.randint(99, 20000)),
+             "status": rnd.choice(STATUSES), "created_at": "2023-12-01 10:30:00"} for i in range(n)]
+
+
+def bench(n, number):
+    rnd = random.Random(n)
+    spec = dict(SCHEMA["orders"])
+    orders = make_orders(n, rnd)
+    with_rollups = ColumnarTable(orders, columns=COLUMNAR_SCHEMA["orders"], **spec)
+    spec.pop("rollup_by")
+    plain = ColumnarTable(orders, columns=COLUMNAR_SCHEMA["orders"], **spec)
+
+    t_read = timeit.timeit(with_rollups.rollups, number=number) / number
+    scan_number = max(1, number * 1000 // n)
+    t_scan = timeit.timeit(lambda: compute_rollups(with_rollups, with_rollups.rollup_fields,
+                                                   with_rollups.rollup_sum),
+                           number=scan_number) / scan_number
+
+    def inserts(table):
+        ids = iter(range(n, n + number * 3))
+        return min(timeit.repeat(lambda: table.insert({
+            "id": f"ORD{20231201000000000 + next(ids)}", "user_id": 7, "product_id": 1,
+            "quantity": 1, "total": 99.0, "status": "pending", "created_at": "2023-12-01 10:30:00"}),
+            number=number, repeat=3)) / number
+
+    return t_read, t_scan, inserts(plain), inserts(with_rollups)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--number', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'rollups (ms)':>13} {'recompute (ms)':>15} "
+          f"{'insert (us)':>12} {'insert+rollups (us)':>20}")
+    for n in (int(s) for s in args.sizes.split(',')):
+        t_read, t_scan, t_plain, t_rollups = bench(n, args.number)
+        print(f"{n:>10} {t_read * 1e3:>13.3f} {t_scan * 1e3:>15.1f} "
+              f"{t_plain * 1e6:>12.1f} {t_rollups * 1e6:>20.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""订单内存基准：每个订单占用的字节数，dict 行与列存两种布局对比
+
+运行: python benchmarks/bench_orders_memory.py [--sizes 10000,100000,1000000] [--churn 2]
+
+用 tracemalloc 统计装载同样一批订单后新增的内存：
+"dict list" 是最初 api_server 里的订单列表，"Table" 是按 dict 存行的内存表，
+"ColumnarTable" 是 orders 实际使用的列存表(两种表都带 user_id / status 索引)。
+"+ churn" 两行在装载后再把每个订单更新 ``--churn`` 次、删除 10%，按剩下的订单数计算每个订单的字节数，
+列存表不回收旧 slot 时这个数会随更新次数增长。另外测量按主键读取一行(需要拼出 dict)的耗时。
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from columnar import COLUMNAR_SCHEMA, ColumnarTable  # noqa: E402
+from store import SCHEMA, Table  # noqa: E402
+
+STATUSES = ["pending", "paid", "shipped", "completed", "cancelled"]
+
+
+def make_orders(n, rnd):
+    # 每行都用新建的字符串，和逐个经 create_order 写入时一样不共享对象
+    return [{"id": f"ORD{20231201000000000 + i}", "user_id": rnd.randint(1, 10000),
+             "product_id": rnd.randint(1, 8), "quantity": rnd.randint(1, 5),
+             "total": float(rnd.randint(99, 20000)), "status": rnd.choice(STATUSES),
+             "created_at": f"2023-12-{rnd.randint(1, 28):02d} {rnd.randint(0, 23):02d}:"
+                           f"{rnd.randint(0, 59):02d}:{rnd.randint(0, 59):02d}"}
+            for i in range(n)]
+
+
+def churn(table, n, rounds, rnd):
+    """每个订单更新 rounds 次，再删除 10%，返回表"""
+    keys = [f"ORD{20231201000000000 + i}" for i in range(n)]
+    for _ in range(rounds):
+        for key in keys:
+            table.update(key, {"status": rnd.choice(STATUSES), "quantity": rnd.randint(1, 5)})
+    for key in rnd.sample(keys, n // 10):
+        table.delete(key)
+    return table
+
+
+def measure(build):
+    """返回 (build() 结果, 结果占用的字节数)"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return result, used
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--lookups', type=int, default=10000)
+    parser.add_argument('--churn', type=int, default=2)
+    args = parser.parse_args()
+
+    spec = SCHEMA["orders"]
+    layouts = {
+        "dict list": lambda n: make_orders(n, random.Random(n)),
+        "Table": lambda n: Table(make_orders(n, random.Random(n)), **spec),
+        "ColumnarTable": lambda n: ColumnarTable(make_orders(n, random.Random(n)),
+                                                 columns=COLUMNAR_SCHEMA["orders"], **spec),
+    }
+    layouts["Table + churn"] = lambda n: churn(layouts["Table"](n), n, args.churn, random.Random(n))
+    layouts["Columnar + churn"] = lambda n: churn(layouts["ColumnarTable"](n), n, args.churn, random.Random(n))
+
+    print(f"{'rows':>10} {'layout':>16} {'bytes/order':>13} {'get (us)':>10}")
+    for n in (int(s) for s in args.sizes.split(',')):
+        keys = [f"ORD{20231201000000000 + i}" for i in random.Random(0).choices(range(n), k=args.lookups)]
+        for name, build in layouts.items():
+            table, used = measure(lambda: build(n))
+            if isinstance(table, list):
+                get_us = float('nan')
+            else:
+                it = iter(keys)
+                get_us = timeit.timeit(lambda: table.get(next(it)), number=len(keys)) / len(keys) * 1e6
+            print(f"{n:>10} {name:>16} {used / len(table):>13.1f} {get_us:>10.2f}")
+            del table
+
+
+if __name__ == '__main__':
+    main()
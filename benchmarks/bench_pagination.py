@@ -0,0 +1,43 @@
+"""分页基准：offset 翻页与 keyset(游标) 翻页在不同页深的耗时对比
+
+运行: python benchmarks/bench_pagination.py [--rows 1000000]
+
+游标翻页的耗时应与页深无关；offset 翻页随页深线性增长。
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from store import Table  # noqa: E402
+
+LIMIT = 10
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--number', type=int, default=200)
+    args = parser.parse_args()
+
+    n = args.rows
+    table = Table(({"id": i, "user_id": i % 1000, "status": "pending"} for i in range(1, n + 1)),
+                  indexes=("user_id", "status"))
+
+    print(f"rows={n} limit={LIMIT}")
+    print(f"{'depth':>10} {'offset (us)':>13} {'cursor (us)':>13}")
+    for depth in (0, n // 100, n // 10, n // 2, n - 2 * LIMIT):
+        # 游标即上一页最后一行的 seq，这里 seq 与 depth 一一对应
+        after = depth if depth else None
+        t_offset = min(timeit.repeat(lambda: table.page(offset=depth, limit=LIMIT),
+                                     number=max(1, args.number * 1000 // (depth + 1000)), repeat=3))
+        t_offset /= max(1, args.number * 1000 // (depth + 1000))
+        t_cursor = min(timeit.repeat(lambda: table.page(after=after, limit=LIMIT),
+                                     number=args.number, repeat=3)) / args.number
+        print(f"{depth:>10} {t_offset * 1e6:>13.1f} {t_cursor * 1e6:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""token 校验基准：签名 token 与保存在服务器上的不透明 token 每核每秒的校验次数
+
+运行: python benchmarks/bench_signed_tokens.py [--seconds 2] [--revoked 100] [--processes 1]
+
+每种方式在一个进程里循环校验同一个有效 token ``--seconds`` 秒：
+
+- signed：只校验 HMAC 签名和过期时间(``TokenSigner.verify``)
+- signed+revocations：同上，另外查吊销列表(内存后端的 revocations 仓库里有 ``--revoked`` 条吊销记录)
+- opaque/memory、opaque/sqlite：原来的做法，按 token 查 tokens 仓库(``TokenStore.get``)
+
+``--processes`` 大于 1 时同时跑多个进程，输出总次数除以进程数(每核)；签名 token 不共享任何状态，
+理想情况下总吞吐量随核数线性增长。
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from signed_tokens import RevocationList, TokenSigner  # noqa: E402
+from store import SCHEMA, Table  # noqa: E402
+from token_store import TokenStore  # noqa: E402
+
+MODES = ("signed", "signed+revocations", "opaque/memory", "opaque/sqlite")
+
+
+def make_verifier(mode, revoked, workdir):
+    """返回 (校验函数, 有效 token)"""
+    if mode.startswith("signed"):
+        revocations = None
+        if mode == "signed+revocations":
+            revocations = RevocationList(TokenStore(Table(**SCHEMA["revocations"]), max_tokens=0,
+                                                    background=False))
+            for i in range(revoked):
+                revocations.revoke(f"revoked{i:015d}", time.time() + 3600)
+        signer = TokenSigner("bench-secret", revocations=revocations)
+        return signer.verify, signer.issue("user1", "user", "张三")
+
+    if mode == "opaque/memory":
+        repo = Table(**SCHEMA["tokens"])
+    else:
+        from sqlite_store import SQLiteDatabase, SQLiteTable
+        repo = SQLiteTable(SQLiteDatabase(os.path.join(workdir, f"tokens_{os.getpid()}.db")), "tokens",
+                           **SCHEMA["tokens"])
+    store = TokenStore(repo, background=False)
+    token = "token_user1_0123456789abcdef"
+    store.issue(token, {"username": "user1", "role": "user", "name": "张三"})
+    return store.get, token
+
+
+def run(mode, seconds, revoked, workdir, results=None):
+    verify, token = make_verifier(mode, revoked, workdir)
+    assert verify(token) is not None
+    count = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(1000):
+            verify(token)
+        count += 1000
+    if results is not None:
+        results.put(count)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=2.0)
+    parser.add_argument('--revoked', type=int, default=100)
+    parser.add_argument('--processes', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'mode':>20} {'verify/s/core':>14} {'us/verify':>10}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for mode in MODES:
+            if args.processes == 1:
+                total = run(mode, args.seconds, args.revoked, workdir)
+            else:
+                results = multiprocessing.Queue()
+                workers = [multiprocessing.Process(target=run, args=(mode, args.seconds, args.revoked, workdir, results))
+                           for _ in range(args.processes)]
+                for worker in workers:
+                    worker.start()
+                total = sum(results.get() for _ in workers)
+                for worker in workers:
+                    worker.join()
+            per_core = total / args.seconds / args.processes
+            print(f"{mode:>20} {per_core:>14,.0f} {1e6 / per_core:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""快照基准：保存/恢复快照的耗时，与原来重新装载数据的 /test/reset 对比
+
+运行: python benchmarks/bench_snapshot.py [--sizes 1000,100000,1000000]
+
+每个规模下装载用户和订单，保存快照后写入一批数据再恢复。
+内存后端的保存是一次引用赋值；恢复时订单列存表要复制快照用到的那段列数组(整块内存复制)，
+其余仓库仍是引用赋值；
+"reload" 一列是按原来的方式把同样的数据重新 load 一遍。
+"""
+import argparse
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from store import open_storage  # noqa: E402
+
+
+def bench(n, number):
+    storage = open_storage("memory")
+    users = [{"id": i, "name": f"用户{i}", "email": f"user{i}@example.com"} for i in range(1, n + 1)]
+    orders = [{"id": f"ORD{i:012d}", "user_id": i % 1000, "product_id": 1, "quantity": 1,
+               "total": 99.0, "status": "pending"} for i in range(1, n + 1)]
+    storage.users.load(users)
+    storage.orders.load(orders)
+
+    t_snapshot = timeit.timeit(storage.snapshot, number=number) / number
+    snap = storage.snapshot()
+
+    def dirty_and_restore():
+        storage.users.create({"name": "新用户", "email": "new@example.com"})
+        storage.orders.delete("ORD000000000001")
+        storage.restore(snap)
+
+    t_restore = min(timeit.repeat(dirty_and_restore, number=number, repeat=3)) / number
+
+    start = time.perf_counter()
+    storage.users.load(users)
+    storage.orders.load(orders)
+    t_reload = time.perf_counter() - start
+    return t_snapshot, t_restore, t_reload
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,100000,1000000')
+    parser.add_argument('--number', type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'snapshot (us)':>15} {'write+restore (us)':>20} {'reload (ms)':>13}")
+    for n in (int(s) for s in args.sizes.split(',')):
+        t_snapshot, t_restore, t_reload = bench(n, args.number)
+        print(f"{n:>10} {t_snapshot * 1e6:>15.2f} {t_restore * 1e6:>20.2f} {t_reload * 1e3:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""冷启动基准：从进程启动、导入 api_server 到第一个请求完成的耗时
+
+运行: python benchmarks/bench_startup.py [--repeat 5]
+
+每次测量都启动一个新的 Python 进程：导入 api_server，再用 Flask 的测试客户端发出第一个请求。
+分别测第一个请求是普通接口、Swagger 规范(文档缓存目录为空 / 已有缓存)和文档页的情形，
+取 ``--repeat`` 次的中位数；最后一列表示请求结束时 flasgger 是否已被导入。
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+CHILD = r"""
+import json, sys, time
+started = time.perf_counter()
+import api_server
+imported = time.perf_counter()
+api_server.app.test_client().get(sys.argv[1])
+done = time.perf_counter()
+print(json.dumps({"import": imported - started, "request": done - imported, "flasgger": "flasgger" in sys.modules}))
+"""
+
+CASES = [
+    ("GET /products/1", "/products/1", False),
+    ("spec, no cache", "/apispec_1.json", True),
+    ("spec, disk cache", "/apispec_1.json", False),
+    ("GET /apidocs/", "/apidocs/", False),
+]
+
+
+def run(path, cache_dir):
+    env = dict(os.environ, API_DOCS_CACHE=cache_dir, API_LOG_FILE=os.devnull)
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", CHILD, path], cwd=ROOT, env=env, check=True,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+    result = json.loads(output.splitlines()[-1])
+    result["total"] = time.perf_counter() - started
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'first request':>18} {'import ms':>10} {'request ms':>11} {'process ms':>11} {'flasgger':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_dir = os.path.join(tmp, "apidocs")
+        for name, path, cold in CASES:
+            results = []
+            for _ in range(args.repeat):
+                if cold:
+                    shutil.rmtree(cache_dir, ignore_errors=True)
+                results.append(run(path, cache_dir))
+            median = {key: statistics.median(r[key] for r in results) * 1e3
+                      for key in ("import", "request", "total")}
+            print(f"{name:>18} {median['import']:>10.1f} {median['request']:>11.1f} {median['total']:>11.1f} "
+                  f"{'yes' if results[-1]['flasgger'] else 'no':>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""存储后端基准：memory 与 sqlite 两种仓库实现的常用操作耗时对比
+
+运行: python benchmarks/bench_storage.py [--sizes 10000,100000,1000000] [--backends memory,sqlite]
+
+每个规模下装载同样的用户和订单数据，测量：按主键读取、按 user_id 过滤取第一页、
+游标翻到表尾附近的深页、中文姓名子串搜索、以及单条插入。
+sqlite 数据库建在临时目录中，测完即删。
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from store import open_storage  # noqa: E402
+
+SURNAMES = "张李王赵钱孙周吴郑冯陈褚卫蒋沈韩杨朱秦尤许何吕施"
+GIVEN = "伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂英华"
+STATUSES = ["pending", "paid", "shipped", "completed", "cancelled"]
+
+
+def make_rows(n, rnd):
+    users = [{"id": i, "name": rnd.choice(SURNAMES) + rnd.choice(GIVEN) + rnd.choice(GIVEN),
+              "email": f"user{i}@example.com"} for i in range(1, n + 1)]
+    orders = [{"id": f"ORD{i:012d}", "user_id": rnd.randint(1, max(1, n // 10)), "product_id": 1,
+               "quantity": 1, "total": 99.0, "status": rnd.choice(STATUSES),
+               "created_at": "2023-12-01 10:30:00"} for i in range(1, n + 1)]
+    return users, orders
+
+
+def timed(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=3)) / number
+
+
+def bench(backend, n, number, workdir):
+    rnd = random.Random(n)
+    users, orders = make_rows(n, rnd)
+    storage = open_storage(backend, os.path.join(workdir, f"bench_{n}.db"))
+
+    start = time.perf_counter()
+    storage.users.load(users)
+    storage.orders.load(orders)
+    load = time.perf_counter() - start
+
+    keys = [rnd.randint(1, n) for _ in range(number)]
+    it = iter(keys * 3)
+    _, deep_after = storage.orders.page(offset=n - 20, limit=1)
+    next_id = iter(range(n + 1, n + 1 + number * 3))
+
+    results = {
+        "load (s)": load,
+        "get (us)": timed(lambda: storage.users.get(next(it)), number) * 1e6,
+        "filter page (us)": timed(lambda: storage.orders.page({"user_id": 7, "status": "paid"},
+                                                              limit=10), number) * 1e6,
+        "deep cursor (us)": timed(lambda: storage.orders.page(after=deep_after, limit=10),
+                                  number) * 1e6,
+        "name search (us)": timed(lambda: storage.users.page(search={"name": "张伟"}, limit=10),
+                                  number) * 1e6,
+        "insert (us)": timed(lambda: storage.users.insert({"id": next(next_id), "name": "新用户",
+                                                           "email": "new@example.com"}),
+                             number) * 1e6,
+    }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--backends', default='memory,sqlite')
+    parser.add_argument('--number', type=int, default=200)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_storage_")
+    try:
+        for n in (int(s) for s in args.sizes.split(',')):
+            print(f"\nrows={n}")
+            table = {b: bench(b, n, args.number, workdir) for b in args.backends.split(',')}
+            metrics = next(iter(table.values())).keys()
+            print(f"{'':>18}" + ''.join(f"{b:>12}" for b in table))
+            for metric in metrics:
+                print(f"{metric:>18}" + ''.join(f"{table[b][metric]:>12.2f}" for b in table))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""主键查找基准：Table.get 与原来的列表扫描对比
+
+运行: python benchmarks/bench_store.py [--sizes 10,1000,100000,1000000]
+
+Table.get 的耗时应当与数据量无关，而列表扫描随数据量线性增长。
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from store import Table  # noqa: E402
+
+
+def make_users(n):
+    return [{"id": i, "name": f"用户{i}", "email": f"user{i}@example.com", "status": "active"}
+            for i in range(1, n + 1)]
+
+
+def bench(n, lookups):
+    rows = make_users(n)
+    table = Table(rows)
+    keys = [random.randint(1, n) for _ in range(lookups)]
+
+    def indexed():
+        for k in keys:
+            table.get(k)
+
+    def scan():
+        for k in keys:
+            next((u for u in rows if u['id'] == k), None)
+
+    t_indexed = min(timeit.repeat(indexed, number=1, repeat=5)) / lookups
+    # 线性扫描在大表上很慢，按数据量减少查找次数
+    scan_lookups = max(1, min(lookups, 10_000_000 // n // 10))
+    keys_scan = keys[:scan_lookups]
+
+    def scan_sample():
+        for k in keys_scan:
+            next((u for u in rows if u['id'] == k), None)
+
+    t_scan = min(timeit.repeat(scan_sample, number=1, repeat=3)) / scan_lookups
+    return t_indexed, t_scan
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10,1000,100000,1000000')
+    parser.add_argument('--lookups', type=int, default=10000)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'Table.get (ns)':>16} {'list scan (ns)':>16}")
+    for n in (int(s) for s in args.sizes.split(',')):
+        t_indexed, t_scan = bench(n, args.lookups)
+        print(f"{n:>10} {t_indexed * 1e9:>16.0f} {t_scan * 1e9:>16.0f}")
+
+
+if __name__ == '__main__':
+    main()
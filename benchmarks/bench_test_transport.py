@@ -0,0 +1,116 @@
+"""测试传输方式基准：test_api.py 走真实 HTTP 与在进程内调用 app 的耗时对比
+
+运行: python benchmarks/bench_test_transport.py [--repeat 3] [--requests 500] [--all]
+
+- suite：整个测试集的墙钟时间。http 从启动开发服务器(``python api_server.py``)算起，
+  到测试结束为止；wsgi 是 ``API_TEST_TARGET=wsgi`` 下直接运行 pytest。
+  默认排除自己启动服务器的几个用例(多进程、ASGI，它们与传输方式无关)，``--all`` 时包含
+- request：单个 ``GET /users/1`` 的平均耗时。原来的用例每次调用 ``requests.get``(每次新建连接)，
+  改为共用 Session 后走 HTTP 可以复用连接，wsgi 是进程内的 Session
+"""
+import argparse
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import requests  # noqa: E402
+
+PORT = 5057
+SERVER_TESTS = "not prefork and not asgi_server"
+
+
+def start_server():
+    process = subprocess.Popen([sys.executable, "api_server.py", "--port", str(PORT)], cwd=ROOT,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    while True:
+        try:
+            requests.get(f"http://localhost:{PORT}/products/1", timeout=1)
+            return process
+        except requests.ConnectionError:
+            if process.poll() is not None:
+                raise RuntimeError("服务器没有启动")
+            time.sleep(0.05)
+
+
+def stop_server(process):
+    os.killpg(process.pid, signal.SIGTERM)
+    process.wait()
+
+
+def run_suite(target, select):
+    env = dict(os.environ, API_TEST_TARGET=target)
+    command = [sys.executable, "-m", "pytest", "-q", "-p", "no:cacheprovider", "test_api.py"]
+    if select:
+        command += ["-k", select]
+    subprocess.run(command, cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL)
+
+
+def time_suite(mode, select):
+    started = time.perf_counter()
+    if mode == "http":
+        process = start_server()
+        try:
+            run_suite(f"http://localhost:{PORT}", select)
+        finally:
+            stop_server(process)
+    else:
+        run_suite("wsgi", select)
+    return time.perf_counter() - started
+
+
+def time_requests(n):
+    """各方式下单个请求的平均耗时(秒)"""
+    import api_server
+    from wsgi_transport import wsgi_session
+
+    process = start_server()
+    try:
+        url = f"http://localhost:{PORT}/users/1"
+        session = requests.Session()
+        in_process = wsgi_session(api_server.create_app({"log_file": os.devnull}), "http://testserver")
+        cases = {
+            "http, requests.get": lambda: requests.get(url),
+            "http, Session": lambda: session.get(url),
+            "wsgi, Session": lambda: in_process.get("http://testserver/users/1"),
+        }
+        results = {}
+        for name, call in cases.items():
+            call()
+            started = time.perf_counter()
+            for _ in range(n):
+                call()
+            results[name] = (time.perf_counter() - started) / n
+        return results
+    finally:
+        stop_server(process)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--all', action='store_true', help="包含自己启动服务器的用例")
+    args = parser.parse_args()
+    select = None if args.all else SERVER_TESTS
+
+    suite = {mode: statistics.median(time_suite(mode, select) for _ in range(args.repeat))
+             for mode in ("http", "wsgi")}
+    print(f"{'suite':>20} {'seconds':>9} {'speedup':>8}")
+    for mode, seconds in suite.items():
+        print(f"{mode:>20} {seconds:>9.2f} {suite['http'] / seconds:>7.1f}x")
+
+    per_request = time_requests(args.requests)
+    baseline = per_request["http, requests.get"]
+    print(f"\n{'request':>20} {'ms':>9} {'speedup':>8}")
+    for name, seconds in per_request.items():
+        print(f"{name:>20} {seconds * 1e3:>9.3f} {baseline / seconds:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""登录 token 基准：模拟持续登录，对比原来只增不减的 tokens 仓库与 TokenStore 的 token 数、内存和耗时
+
+运行: python benchmarks/bench_tokens.py [--logins 100000] [--rate 1000] [--ttl 60] [--max-tokens 100000] [--backend memory]
+
+用假时钟模拟每秒 ``--rate`` 次登录，共 ``--logins`` 次，每模拟 1 秒清理一次(代替后台线程)：
+
+- raw：原来的做法，每次登录插入一行，永不删除
+- ttl：TokenStore，有效期 ``--ttl`` 秒，上限 ``--max-tokens``
+
+输出结束时保存的 token 数、tracemalloc 统计的内存、每次签发(insert / issue)的耗时、
+每个过期 token 的清理耗时，以及带过期检查的 get 与原来 get 的耗时。
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from store import BACKENDS, SCHEMA, Table  # noqa: E402
+from token_store import TokenStore, expires_at  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+
+def make_repo(backend, workdir):
+    if backend == "memory":
+        return Table(**SCHEMA["tokens"])
+    from sqlite_store import SQLiteDatabase, SQLiteTable
+    path = os.path.join(workdir, f"tokens_{time.perf_counter_ns()}.db")
+    return SQLiteTable(SQLiteDatabase(path), "tokens", **SCHEMA["tokens"])
+
+
+def soak(args, workdir, mode):
+    clock = FakeClock()
+    repo = make_repo(args.backend, workdir)
+    store = TokenStore(repo, ttl=args.ttl, max_tokens=args.max_tokens, clock=clock, background=False)
+    fields = {"username": "user1", "role": "user", "name": "张三"}
+    issue_time = sweep_time = 0.0
+    swept = 0
+    tracemalloc.start()
+    for i in range(args.logins):
+        token = f"token_user1_{i:016x}"
+        started = time.perf_counter()
+        if mode == "raw":
+            repo.insert({"token": token, **fields, "expires": "2099-01-01T00:00:00"})
+        else:
+            store.issue(token, fields)
+        issue_time += time.perf_counter() - started
+        if (i + 1) % args.rate == 0:
+            clock.now += 1
+            if mode == "ttl":
+                started = time.perf_counter()
+                swept += store.sweep()
+                sweep_time += time.perf_counter() - started
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    token = next(iter(repo))["token"]
+    get = repo.get if mode == "raw" else store.get
+    get_time = min(timeit.repeat(lambda: get(token), number=10000, repeat=3)) / 10000
+    return {"tokens": len(repo), "memory": memory, "issue": issue_time / args.logins,
+            "sweep": sweep_time / swept if swept else 0.0, "get": get_time,
+            "evicted": store.evicted, "expired": store.expired}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--logins', type=int, default=100000)
+    parser.add_argument('--rate', type=int, default=1000, help="每模拟秒的登录次数")
+    parser.add_argument('--ttl', type=int, default=60)
+    parser.add_argument('--max-tokens', type=int, default=100000)
+    parser.add_argument('--backend', choices=BACKENDS, default="memory")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        print(f"{'mode':>5} {'tokens':>8} {'MB':>7} {'issue us':>9} {'sweep us':>9} {'get us':>7} "
+              f"{'expired':>8} {'evicted':>8}")
+        for mode in ("raw", "ttl"):
+            r = soak(args, workdir, mode)
+            print(f"{mode:>5} {r['tokens']:>8} {r['memory'] / 2 ** 20:>7.1f} {r['issue'] * 1e6:>9.2f} "
+                  f"{r['sweep'] * 1e6:>9.2f} {r['get'] * 1e6:>7.2f} {r['expired']:>8} {r['evicted']:>8}")
+
+    # 过期检查本身(解析 ISO 时间)的开销
+    row = {"expires": "2099-01-01T00:00:00.123456"}
+    print(f"\nexpires_at: {timeit.timeit(lambda: expires_at(row), number=100000) / 100000 * 1e9:.0f} ns")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""多进程服务基准：开发服务器与不同工作进程数的生产模式的吞吐量(请求/秒)和延迟
+
+运行: python benchmarks/bench_workers.py [--workers 1,2,4] [--threads 8] [--clients 4] [--connections 16] [--duration 10]
+
+对每种配置启动一个真实的 api_server.py 进程(sqlite 后端，日志写到 /dev/null)，
+用 ``--clients`` 个客户端进程、共 ``--connections`` 个 keep-alive 连接循环请求
+列表/详情接口 ``--duration`` 秒，统计每秒完成的请求数与 p50 / p99 延迟。
+"dev" 是原来的 ``app.run(debug=True)`` 开发服务器。吞吐量能随工作进程数增长多少取决于 CPU 核数，
+客户端进程也要占用 CPU，核数少时应减少 --clients。
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from traffic import percentile  # noqa: E402
+
+PATHS = [
+    "/products?limit=10",
+    "/users/1",
+    "/orders?limit=20",
+    "/users?limit=20&include_total=false",
+    "/products/3",
+]
+
+
+def start_server(port, db, workers, threads):
+    command = [sys.executable, "api_server.py", "--storage", "sqlite", "--db", db,
+               "--port", str(port), "--log-file", os.devnull]
+    if workers:
+        command += ["--workers", str(workers), "--threads", str(threads)]
+    # 单独的进程组：开发服务器的 reloader 子进程也能一起结束
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                               start_new_session=True)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("localhost", port, timeout=1)
+            conn.request("GET", "/products/1")
+            conn.getresponse().read()
+            conn.close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError("服务器没有启动")
+
+
+def stop_server(process):
+    os.killpg(process.pid, signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+
+def client(port, connections, duration, results):
+    """一个客户端进程：connections 个线程各开一个 keep-alive 连接"""
+    latencies, errors = [], [0]
+    deadline = time.monotonic() + duration
+
+    def loop(offset):
+        conn = http.client.HTTPConnection("localhost", port, timeout=30)
+        i = offset
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                conn.request("GET", PATHS[i % len(PATHS)])
+                response = conn.getresponse()
+                response.read()
+                if response.status != 200:
+                    errors[0] += 1
+            except (OSError, http.client.HTTPException):
+                errors[0] += 1
+                conn.close()
+                conn = http.client.HTTPConnection("localhost", port, timeout=30)
+                continue
+            latencies.append(time.perf_counter() - started)
+            i += 1
+        conn.close()
+
+    threads = [threading.Thread(target=loop, args=(n,)) for n in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put((latencies, errors[0]))
+
+
+def load(port, clients, connections, duration):
+    results = multiprocessing.Queue()
+    per_client = [connections // clients + (n < connections % clients) for n in range(clients)]
+    processes = [multiprocessing.Process(target=client, args=(port, n, duration, results))
+                 for n in per_client if n]
+    for process in processes:
+        process.start()
+    latencies, errors = [], 0
+    for _ in processes:
+        part, failed = results.get()
+        latencies += part
+        errors += failed
+    for process in processes:
+        process.join()
+    latencies.sort()
+    return len(latencies) / duration, errors, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', default="1,2,4", help="逗号分隔的工作进程数")
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--connections', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--no-dev', action='store_true', help="不测开发服务器")
+    args = parser.parse_args()
+
+    configs = [] if args.no_dev else [None]
+    configs += [int(n) for n in args.workers.split(',')]
+    print(f"{'server':>14} {'req/s':>9} {'speedup':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    baseline = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for workers in configs:
+            process = start_server(args.port, os.path.join(tmp, f"bench-{workers}.db"), workers, args.threads)
+            try:
+                throughput, errors, latencies = load(args.port, args.clients, args.connections, args.duration)
+            finally:
+                stop_server(process)
+            baseline = baseline or throughput
+            name = "dev" if workers is None else f"{workers}x{args.threads}"
+            print(f"{name:>14} {throughput:>9.0f} {throughput / baseline:>7.1f}x "
+                  f"{percentile(latencies, 0.5) * 1e3:>8.2f} {percentile(latencies, 0.99) * 1e3:>8.2f} {errors:>7}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""按 Accept-Encoding 协商的响应压缩(gzip / deflate)
+
+- 只压缩文本类响应(JSON、text/*)，且响应体不小于 ``min_size``：很小的响应压缩后省不了几个字节，
+  反而要多花 CPU、多加一个 gzip 头
+- ``level`` 是 zlib 的压缩级别(1 最快，9 最小)，0 表示不压缩
+- 流式响应逐块压缩：每块压缩后立即 ``Z_SYNC_FLUSH``，客户端收到一块就能解出一块，
+  不会因为压缩把整个响应攒在服务端
+- 压缩后的表示与原响应体不同，强 ETag 加上 ``-gzip`` / ``-deflate`` 后缀，
+  响应带 ``Vary: Accept-Encoding``
+
+HTTP 的 deflate 指 zlib 格式(RFC 1950)，不是裸的 deflate 流。
+"""
+import zlib
+
+ENCODINGS = ("gzip", "deflate")
+# zlib 的 wbits：16 + 15 写 gzip 头尾，15 写 zlib 头尾
+_WBITS = {"gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+
+DEFAULT_MIN_SIZE = 1024
+DEFAULT_LEVEL = 6
+COMPRESSIBLE_TYPES = ("application/json", "application/javascript", "application/xml", "text/")
+
+
+class Compressor:
+    """响应压缩的配置与实现"""
+
+    def __init__(self, min_size=DEFAULT_MIN_SIZE, level=DEFAULT_LEVEL):
+        if not 0 <= level <= 9:
+            raise ValueError(f"压缩级别应在 0-9 之间: {level}")
+        self.min_size = min_size
+        self.level = level
+
+    def negotiate(self, accept_encodings):
+        """按客户端的 Accept-Encoding(werkzeug 的 Accept 对象)选出压缩方式，不压缩时返回 None"""
+        if not self.level:
+            return None
+        return accept_encodings.best_match(ENCODINGS)
+
+    def compressible(self, response):
+        """响应的类型和状态是否允许压缩(不看大小)"""
+        if response.status_code < 200 or response.status_code in (204, 304):
+            return False
+        if response.direct_passthrough or 'Content-Encoding' in response.headers:
+            return False
+        return self.compressible_type(response.mimetype)
+
+    @staticmethod
+    def compressible_type(mimetype):
+        return bool(mimetype) and mimetype.startswith(COMPRESSIBLE_TYPES)
+
+    def compress(self, data, encoding):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, _WBITS[encoding])
+        return compressor.compress(data) + compressor.flush()
+
+    def compress_stream(self, chunks, encoding):
+        """逐块压缩一个响应体迭代器；关闭返回的生成器时也会关闭原迭代器"""
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, _WBITS[encoding])
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+                data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+                if data:
+                    yield data
+            yield compressor.flush()
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+    @staticmethod
+    def etag(etag, encoding):
+        """编码后的表示的强 ETag"""
+        return f"{etag}-{encoding}" if encoding else etag
+
+    def apply(self, response, encoding, data=None):
+        """把 response 改成 encoding 压缩后的表示；data 是已经压缩好的响应体(可选)"""
+        if data is None and response.is_streamed:
+            response.response = self.compress_stream(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            response.set_data(data if data is not None else self.compress(response.get_data(), encoding))
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(self.etag(etag, encoding))
+        response.vary.add('Accept-Encoding')
+        return response
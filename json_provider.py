@@ -0,0 +1,142 @@
+"""jsonify 使用的 JSON provider
+
+``FastJSONProvider`` 在装了 orjson 时用它序列化，没装时用标准库 json，输出与 Flask 默认的
+``DefaultJSONProvider`` 逐字节相同(键排序、非 ASCII 字符转义为 ``\\uXXXX``、``8999.0`` 这样的浮点数、
+debug 模式下两空格缩进)：
+
+- orjson 不转义非 ASCII 字符，输出含非 ASCII 字节时再按 json 的规则转义一遍
+- orjson 对 ``>= 1e16`` 或 ``< 1e-4`` 的浮点数写法与 json 不同，输出里出现可能是这类数字的片段
+  (``<数字>e`` 或 ``0.0000``)时改用标准库重新序列化；orjson 不支持的值(超过 64 位的整数、
+  非字符串的键等)同样回退到标准库
+- 例外：NaN / Infinity 不是合法 JSON，orjson 会写成 null
+
+紧凑模式(非 debug)下，``Table.page_compact`` 返回的 ``RowBatch`` 由表直接写出每行的 JSON，
+不构造每行的 dict；用 ``API_JSON=json`` 可以强制使用标准库。
+"""
+import codecs
+import json
+import os
+from json.encoder import encode_basestring, encode_basestring_ascii
+
+from flask.json.provider import DefaultJSONProvider
+
+from store import RowBatch
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 没装 orjson 时使用标准库
+    orjson = None
+
+BACKENDS = ("orjson", "json") if orjson is not None else ("json",)
+
+# 把数字都换成 0，便于用 bytes.find 查找 "<数字>e"
+_DIGITS_TO_ZERO = bytes.maketrans(b'123456789', b'000000000')
+
+
+def _float_may_differ(data):
+    """orjson 输出中是否可能有写法与 json 不同的浮点数(指数形式或 0.0000x)；可能误报，不会漏报"""
+    return data.find(b'0.0000') != -1 or data.translate(_DIGITS_TO_ZERO).find(b'0e') != -1
+
+
+def _escape_non_ascii(error):
+    """codecs 错误处理：把无法用 ASCII 编码的字符写成 json 的 \\uXXXX(代理对)转义"""
+    parts = []
+    for char in error.object[error.start:error.end]:
+        code = ord(char)
+        if code > 0xFFFF:
+            code -= 0x10000
+            parts.append('\\u%04x\\u%04x' % (0xD800 | (code >> 10), 0xDC00 | (code & 0x3FF)))
+        else:
+            parts.append('\\u%04x' % code)
+    return ''.join(parts), error.end
+
+
+codecs.register_error('json_escape', _escape_non_ascii)
+
+
+def _escape(text):
+    """把 JSON 文本中的非 ASCII 字符转义成与 json.dumps(ensure_ascii=True) 相同的形式"""
+    # raw_unicode_escape 在 C 里把 U+0100..U+FFFF 写成 \uXXXX(中文都在这个范围)，其余字符原样保留；
+    # 结果仍含非 ASCII 字节(U+0080..U+00FF)或 \U(BMP 以外的字符)时逐段转义
+    data = text.encode('raw_unicode_escape')
+    if data.isascii() and b'\\U' not in data:
+        return data
+    return text.encode('ascii', 'json_escape')
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """优先使用 orjson、输出与默认 provider 相同的 JSON provider"""
+
+    def __init__(self, app, backend=None):
+        super().__init__(app)
+        backend = backend or os.environ.get('API_JSON') or BACKENDS[0]
+        if backend not in BACKENDS:
+            raise ValueError(f"不支持的 JSON 后端: {backend}")
+        self.backend = backend
+
+    def _default(self, o):
+        if isinstance(o, RowBatch):
+            return list(o)
+        return self.default(o)
+
+    def _stdlib(self, obj, **kwargs):
+        kwargs.setdefault("default", self._default)
+        kwargs.setdefault("ensure_ascii", self.ensure_ascii)
+        kwargs.setdefault("sort_keys", self.sort_keys)
+        return json.dumps(obj, **kwargs).encode('utf-8')
+
+    def dump_bytes(self, obj, **kwargs):
+        """序列化为 UTF-8 bytes；参数与 ``dumps`` 相同"""
+        if self.backend == "orjson" and set(kwargs) <= {"indent", "separators"} \
+                and kwargs.get("indent") in (None, 2) and kwargs.get("separators") in (None, (",", ":")):
+            option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+            if self.sort_keys:
+                option |= orjson.OPT_SORT_KEYS
+            if kwargs.get("indent"):
+                option |= orjson.OPT_INDENT_2
+            try:
+                data = orjson.dumps(obj, default=self._default, option=option)
+            except TypeError:
+                return self._stdlib(obj, **kwargs)
+            if _float_may_differ(data):
+                return self._stdlib(obj, **kwargs)
+            if self.ensure_ascii and not data.isascii():
+                data = _escape(data.decode('utf-8'))
+            return data
+        return self._stdlib(obj, **kwargs)
+
+    def dumps(self, obj, **kwargs):
+        return self.dump_bytes(obj, **kwargs).decode('utf-8')
+
+    def _compact(self, obj):
+        """紧凑模式序列化；顶层 dict 中的 RowBatch 由表直接写出"""
+        if isinstance(obj, RowBatch):
+            return self._rows(obj)
+        if isinstance(obj, dict) and all(type(k) is str for k in obj) \
+                and any(isinstance(v, RowBatch) for v in obj.values()):
+            quote = encode_basestring_ascii if self.ensure_ascii else encode_basestring
+            items = sorted(obj.items()) if self.sort_keys else obj.items()
+            return b'{' + b','.join(quote(k).encode('utf-8') + b':' + self._compact(v)
+                                    for k, v in items) + b'}'
+        return self.dump_bytes(obj, separators=(",", ":"))
+
+    def _rows(self, batch):
+        quote = encode_basestring_ascii if self.ensure_ascii else encode_basestring
+        texts = batch.json_rows(quote)
+        if texts is None:
+            return self.dump_bytes(list(batch), separators=(",", ":"))
+        decode, columns = batch.table._decode, batch.columns
+        parts = [text if text is not None
+                 else self.dump_bytes(decode(columns, stored), separators=(",", ":")).decode('utf-8')
+                 for text, stored in zip(texts, batch.stored)]
+        return ('[' + ','.join(parts) + ']').encode('utf-8')
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            if isinstance(obj, dict):
+                obj = {k: list(v) if isinstance(v, RowBatch) else v for k, v in obj.items()}
+            data = self.dump_bytes(obj, indent=2)
+        else:
+            data = self._compact(obj)
+        return self._app.response_class(data + b'\n', mimetype=self.mimetype)
@@ -0,0 +1,295 @@
+"""请求指标：延迟/报文大小直方图、请求计数、在途请求数，以 Prometheus 文本格式导出
+
+直方图采用 HDR 风格的对数-线性分桶：小于 ``2 ** (SUB_BITS + 1)`` 的值每个整数一个桶，
+更大的值每个 2 的幂区间再均分成 ``2 ** SUB_BITS`` 个桶，因此任意分位数的相对误差
+不超过 ``1 / 2 ** (SUB_BITS + 1)``(取桶中点)。每个直方图是一块固定大小的 ``array``，
+记录一个样本只是算出桶下标再加一：常数时间，不分配新容器，内存不随样本数增长。
+超过 ``2 ** MAX_BITS - 1`` 的值计入最后一个桶。
+
+指标按 (方法, 路由规则, 状态码类别) 分组，某一组第一次出现时才创建它的直方图。
+
+多进程部署(见 prefork.py)时各进程把计数写在同一目录下各自的内存映射文件里，
+任何一个进程导出指标时汇总所有进程的文件，记录样本仍然只是改内存里的一个计数。
+"""
+import json
+import mmap
+import os
+import threading
+from array import array
+
+# 每个 2 的幂区间的子桶位数：2 ** 5 = 32 个子桶，分位数相对误差不超过 1/64
+SUB_BITS = 5
+# 可以区分的最大值位数：延迟以微秒计，2 ** 40 微秒约 12 天
+MAX_BITS = 40
+
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+# 多进程共享时每个进程的计数文件大小(稀疏文件，实际只占用已分配的部分)，约可容纳 2000 个分组
+SHARED_CAPACITY = 64 << 20
+
+
+def bucket_index(value):
+    """样本值(非负整数)所在的桶下标"""
+    if value < 2 << SUB_BITS:
+        return value if value > 0 else 0
+    if value >= 1 << MAX_BITS:
+        value = (1 << MAX_BITS) - 1
+    shift = value.bit_length() - SUB_BITS - 1
+    return (shift << SUB_BITS) + (value >> shift)
+
+
+def bucket_bounds(index):
+    """桶下标对应的取值区间 [low, high]"""
+    if index < 2 << SUB_BITS:
+        return index, index
+    shift = (index >> SUB_BITS) - 1
+    mantissa = index - (shift << SUB_BITS)
+    return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+
+BUCKETS = bucket_index((1 << MAX_BITS) - 1) + 1
+
+
+# 每个直方图是 BUCKETS 个桶计数，末尾两格是样本数和样本总和
+HISTOGRAM_SLOTS = BUCKETS + 2
+# 每组的各状态码计数：同一类别(如 2xx)内的状态码按个位和十位(status % 100)存放
+STATUS_SLOTS = 100
+GROUP_SLOTS = STATUS_SLOTS + 3 * HISTOGRAM_SLOTS
+
+
+class Histogram:
+    """固定内存的 HDR 风格直方图；counts 可以是 array 或共享内存上的 memoryview"""
+
+    __slots__ = ('counts',)
+
+    def __init__(self, counts=None):
+        self.counts = counts if counts is not None else array('q', bytes(8 * HISTOGRAM_SLOTS))
+
+    @property
+    def count(self):
+        return self.counts[BUCKETS]
+
+    @property
+    def total(self):
+        return self.counts[BUCKETS + 1]
+
+    def record(self, value):
+        counts = self.counts
+        counts[bucket_index(value)] += 1
+        counts[BUCKETS] += 1
+        counts[BUCKETS + 1] += value
+
+    def quantiles(self, qs=QUANTILES):
+        """按升序的 qs 返回各分位数(取所在桶的中点)"""
+        results = []
+        count = self.count
+        if not count:
+            return [0.0] * len(qs)
+        targets = [max(1, -(-q * count // 1)) for q in qs]
+        seen = 0
+        t = 0
+        for index, n in enumerate(self.counts[:BUCKETS]):
+            if not n:
+                continue
+            seen += n
+            while t < len(targets) and seen >= targets[t]:
+                low, high = bucket_bounds(index)
+                results.append((low + high) / 2)
+                t += 1
+            if t == len(targets):
+                break
+        return results
+
+
+def status_class(status):
+    return f"{status // 100}xx"
+
+
+class _PrivateSlots:
+    """本进程内存中的计数槽"""
+
+    def allocate(self, key, n):
+        return memoryview(array('q', bytes(8 * n)))
+
+
+class _SharedSlots:
+    """写在 ``directory/<pid>.bin`` 里的计数槽，其他进程可以读取
+
+    数据文件是预先截断到 ``capacity`` 字节的稀疏文件，映射到内存后按需分配；
+    每分配一段就向 ``<pid>.keys`` 追加一行 ``[键, 偏移, 长度]``。超出容量的分组退回到私有内存，
+    只在本进程可见。
+    """
+
+    def __init__(self, directory, capacity):
+        pid = os.getpid()
+        fd = os.open(os.path.join(directory, f"{pid}.bin"), os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.ftruncate(fd, capacity)
+            self._mmap = mmap.mmap(fd, capacity)
+        finally:
+            os.close(fd)
+        self._view = memoryview(self._mmap).cast('q')
+        self._used = 0
+        self._keys = os.open(os.path.join(directory, f"{pid}.keys"),
+                             os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o600)
+
+    def allocate(self, key, n):
+        if self._used + n > len(self._view):
+            return _PrivateSlots().allocate(key, n)
+        offset, self._used = self._used, self._used + n
+        # 一行一次 write，读者不会读到写了一半的行
+        os.write(self._keys, (json.dumps([list(key), offset, n], ensure_ascii=False) + '\n').encode('utf-8'))
+        return self._view[offset:offset + n]
+
+
+def read_shared(directory):
+    """读出 directory 下所有进程的计数槽，逐个返回 (pid, 键, 计数列表)"""
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.keys'):
+            continue
+        pid = int(name[:-5])
+        try:
+            with open(os.path.join(directory, name), encoding='utf-8') as f:
+                lines = f.read().split('\n')[:-1]  # 最后一段不以换行结尾(或为空)，忽略
+            with open(os.path.join(directory, f"{pid}.bin"), 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            continue
+        with data:
+            view = memoryview(data).cast('q')
+            try:
+                for line in lines:
+                    key, offset, n = json.loads(line)
+                    yield pid, tuple(key), view[offset:offset + n].tolist()
+            finally:
+                view.release()
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Metrics:
+    """按路由汇总的请求指标，所有方法线程安全
+
+    给出 ``directory`` 时计数写在该目录下本进程的文件里(见 ``_SharedSlots``)，``render`` 汇总
+    目录下所有进程的数据：多进程部署时从任何一个进程都能看到全部请求的指标。
+    已退出进程的计数照常计入，在途请求数只算仍在运行的进程。
+    """
+
+    def __init__(self, directory=None, capacity=SHARED_CAPACITY):
+        self.directory = directory
+        self._slots = _SharedSlots(directory, capacity) if directory else _PrivateSlots()
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._groups = {}
+
+    def begin(self, method, route):
+        key = (method, route)
+        with self._lock:
+            slot = self._in_flight.get(key)
+            if slot is None:
+                slot = self._in_flight[key] = self._slots.allocate(("in_flight",) + key, 1)
+            slot[0] += 1
+
+    def end(self, method, route):
+        with self._lock:
+            self._in_flight[(method, route)][0] -= 1
+
+    def observe(self, method, route, status, duration_us, request_bytes, response_bytes):
+        """记录一个完成的请求；response_bytes 为 None 表示大小未知(流式响应)"""
+        key = (method, route, status_class(status))
+        with self._lock:
+            group = self._groups.get(key)
+            if group is None:
+                slots = self._slots.allocate(("requests",) + key, GROUP_SLOTS)
+                group = self._groups[key] = (slots[:STATUS_SLOTS], *(
+                    Histogram(slots[STATUS_SLOTS + i * HISTOGRAM_SLOTS:STATUS_SLOTS + (i + 1) * HISTOGRAM_SLOTS])
+                    for i in range(3)))
+            statuses, latency, request_size, response_size = group
+            statuses[status % 100] += 1
+            latency.record(duration_us)
+            request_size.record(request_bytes)
+            if response_bytes is not None:
+                response_size.record(response_bytes)
+
+    def _collect(self):
+        """{(方法, 路由): 在途请求数} 和 {(方法, 路由, 状态码类别): 分组的全部计数}"""
+        if self.directory is None:
+            with self._lock:
+                return ({key: slot[0] for key, slot in self._in_flight.items()},
+                        {key: (statuses.tolist() + latency.counts.tolist() + req.counts.tolist()
+                               + resp.counts.tolist())
+                         for key, (statuses, latency, req, resp) in self._groups.items()})
+        in_flight, groups = {}, {}
+        alive = {}
+        for pid, (kind, *key), values in read_shared(self.directory):
+            key = tuple(key)
+            if kind == "in_flight":
+                if pid not in alive:
+                    alive[pid] = _alive(pid)
+                if alive[pid]:
+                    in_flight[key] = in_flight.get(key, 0) + values[0]
+            elif key in groups:
+                groups[key] = [a + b for a, b in zip(groups[key], values)]
+            else:
+                groups[key] = values
+        return in_flight, groups
+
+    def render(self):
+        """Prometheus 文本格式(0.0.4)"""
+        in_flight, collected = self._collect()
+        in_flight = sorted(in_flight.items())
+        groups = []
+        for key, values in sorted(collected.items()):
+            hundreds = int(key[2][:-2]) * 100
+            statuses = {hundreds + i: n for i, n in enumerate(values[:STATUS_SLOTS]) if n}
+            groups.append((key, (statuses, *(
+                Histogram(array('q', values[STATUS_SLOTS + i * HISTOGRAM_SLOTS:
+                                            STATUS_SLOTS + (i + 1) * HISTOGRAM_SLOTS]))
+                for i in range(3)))))
+
+        lines = [
+            "# HELP api_requests_total 已完成的请求数",
+            "# TYPE api_requests_total counter",
+        ]
+        for (method, route, _), (statuses, *_) in groups:
+            for status, n in sorted(statuses.items()):
+                lines.append(f'api_requests_total{{{_labels(method, route)},status="{status}"}} {n}')
+
+        lines += [
+            "# HELP api_requests_in_flight 正在处理的请求数",
+            "# TYPE api_requests_in_flight gauge",
+        ]
+        for (method, route), n in in_flight:
+            lines.append(f'api_requests_in_flight{{{_labels(method, route)}}} {n}')
+
+        for name, help_text, position, scale in (
+                ("api_request_duration_seconds", "请求处理耗时", 1, 1e-6),
+                ("api_request_size_bytes", "请求体大小", 2, 1),
+                ("api_response_size_bytes", "响应体大小", 3, 1)):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} summary")
+            for (method, route, cls), group in groups:
+                histogram = group[position]
+                labels = f'{_labels(method, route)},status_class="{cls}"'
+                for q, value in zip(QUANTILES, histogram.quantiles()):
+                    lines.append(f'{name}{{{labels},quantile="{q}"}} {_number(value * scale)}')
+                lines.append(f'{name}_sum{{{labels}}} {_number(histogram.total * scale)}')
+                lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(method, route):
+    route = route.replace('\\', '\\\\').replace('"', '\\"')
+    return f'method="{method}",route="{route}"'
+
+
+def _number(value):
+    return f"{value:.9g}" if value != int(value) else str(int(value))
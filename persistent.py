@@ -0,0 +1,279 @@
+"""持久化(不可变)有序映射
+
+``PSortedMap`` 是一棵路径复制的 B+ 树：每次 set/delete 只复制从根到叶子的
+一条路径(每层一个不超过 ``MAX_NODE`` 项的元组)，返回新的映射，旧版本保持不变、
+与新版本共享其余所有节点。因此：
+
+- 任意版本都可以被多个线程无锁地并发读取
+- 保存一个版本(快照)和切换回某个版本都是 O(1) 的引用赋值
+- 读写都是 O(log n)，n = 10^6 时树高为 4
+
+键必须能相互比较；节点里记录子树大小，按位置跳过(offset 分页)也是 O(log n)。
+"""
+from bisect import bisect_left, bisect_right
+from itertools import islice
+
+# 叶子最多存放的键数，以及分支节点最多的子节点数
+MAX_NODE = 64
+# merge 时新增项数超过现有项数的 1/该值 就整体重建
+MERGE_REBUILD_RATIO = 8
+
+
+class _Leaf:
+    __slots__ = ('keys', 'values', 'size')
+
+    def __init__(self, keys, values):
+        self.keys = keys
+        self.values = values
+        self.size = len(keys)
+
+
+class _Branch:
+    # seps[i] 是 children[i + 1] 中最小键的下界
+    __slots__ = ('seps', 'children', 'size')
+
+    def __init__(self, seps, children, size):
+        self.seps = seps
+        self.children = children
+        self.size = size
+
+
+class PSortedMap:
+    """不可变有序映射；set/delete 返回新映射"""
+
+    __slots__ = ('_root',)
+
+    def __init__(self, root=None):
+        self._root = root
+
+    @classmethod
+    def from_sorted(cls, items):
+        """由按键升序、键不重复的 ``(key, value)`` 序列批量构建，O(n)"""
+        items = list(items)
+        if not items:
+            return EMPTY
+        level = []
+        for i in range(0, len(items), MAX_NODE):
+            chunk = items[i:i + MAX_NODE]
+            level.append((chunk[0][0], _Leaf(tuple(k for k, _ in chunk),
+                                             tuple(v for _, v in chunk))))
+        while len(level) > 1:
+            parents = []
+            for i in range(0, len(level), MAX_NODE):
+                chunk = level[i:i + MAX_NODE]
+                children = tuple(node for _, node in chunk)
+                parents.append((chunk[0][0], _Branch(tuple(k for k, _ in chunk[1:]), children,
+                                                     sum(c.size for c in children))))
+            level = parents
+        return cls(level[0][1])
+
+    def __len__(self):
+        return self._root.size if self._root is not None else 0
+
+    def __bool__(self):
+        return self._root is not None
+
+    def get(self, key, default=None):
+        node = self._root
+        if node is None:
+            return default
+        while node.__class__ is _Branch:
+            node = node.children[bisect_right(node.seps, key)]
+        keys = node.keys
+        i = bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            return node.values[i]
+        return default
+
+    def __contains__(self, key):
+        # 与 get 相同的查找，内联以省掉一次函数调用(集合求交时是热点)
+        node = self._root
+        if node is None:
+            return False
+        while node.__class__ is _Branch:
+            node = node.children[bisect_right(node.seps, key)]
+        keys = node.keys
+        i = bisect_left(keys, key)
+        return i < len(keys) and keys[i] == key
+
+    def set(self, key, value):
+        root = self._root
+        if root is None:
+            return PSortedMap(_Leaf((key,), (value,)))
+        left, right, sep, _ = _set(root, key, value)
+        if right is not None:
+            left = _Branch((sep,), (left, right), left.size + right.size)
+        return PSortedMap(left)
+
+    def merge(self, items):
+        """合并一批按键升序、键不重复的 ``(key, value)``，已有的键取新值
+
+        批量较小时逐个 set；较大时与现有内容顺序归并后整体重建，O(n + m)。
+        """
+        items = list(items)
+        if len(items) * MERGE_REBUILD_RATIO < len(self):
+            merged = self
+            for key, value in items:
+                merged = merged.set(key, value)
+            return merged
+        return PSortedMap.from_sorted(_merge_sorted(self.items(), items))
+
+    def delete(self, key):
+        """删除键，不存在时返回自身"""
+        root = self._root
+        if root is None:
+            return self
+        root, removed = _delete(root, key)
+        if not removed:
+            return self
+        while root is not None and root.__class__ is _Branch and len(root.children) == 1:
+            root = root.children[0]
+        return PSortedMap(root) if root is not None else EMPTY
+
+    def items(self, after=None, skip=0):
+        """按键升序遍历 ``(key, value)``
+
+        ``after`` 不为 None 时只返回大于它的键(用二分定位)；
+        ``skip`` 跳过开头若干项，未给 ``after`` 时借助子树大小 O(log n) 跳过。
+        """
+        root = self._root
+        if root is None:
+            return iter(())
+        if after is not None:
+            it = _iter_from(root, after, 0)
+            return islice(it, skip, None) if skip else it
+        if skip >= root.size:
+            return iter(())
+        return _iter_from(root, None, skip)
+
+    def keys(self, after=None, skip=0):
+        return (k for k, _ in self.items(after, skip))
+
+    def values(self, after=None, skip=0):
+        return (v for _, v in self.items(after, skip))
+
+    def __iter__(self):
+        return self.keys()
+
+
+_MISSING = object()
+EMPTY = PSortedMap()
+
+
+def _merge_sorted(old, new):
+    """归并两个按键升序的 (key, value) 序列，键相同时取 new 中的值"""
+    new = iter(new)
+    pending = next(new, None)
+    for item in old:
+        while pending is not None and pending[0] < item[0]:
+            yield pending
+            pending = next(new, None)
+        if pending is not None and pending[0] == item[0]:
+            yield pending
+            pending = next(new, None)
+        else:
+            yield item
+    if pending is not None:
+        yield pending
+        yield from new
+
+
+def _set(node, key, value):
+    """返回 (新节点, 分裂出的右节点或 None, 右节点的分隔键, 是否新增了键)"""
+    if node.__class__ is _Leaf:
+        keys, values = node.keys, node.values
+        i = bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            if values[i] is value:
+                return node, None, None, False
+            return _Leaf(keys, values[:i] + (value,) + values[i + 1:]), None, None, False
+        keys = keys[:i] + (key,) + keys[i:]
+        values = values[:i] + (value,) + values[i:]
+        if len(keys) <= MAX_NODE:
+            return _Leaf(keys, values), None, None, True
+        # 追加到末尾时让左边保持满：按递增序号插入时不会留下半空的叶子
+        mid = MAX_NODE if i == len(keys) - 1 else len(keys) // 2
+        return _Leaf(keys[:mid], values[:mid]), _Leaf(keys[mid:], values[mid:]), keys[mid], True
+
+    seps, children = node.seps, node.children
+    ci = bisect_right(seps, key)
+    child, split, sep, added = _set(children[ci], key, value)
+    size = node.size + 1 if added else node.size
+    if split is None:
+        if child is children[ci]:
+            return node, None, None, False
+        return _Branch(seps, children[:ci] + (child,) + children[ci + 1:], size), None, None, added
+
+    children = children[:ci] + (child, split) + children[ci + 1:]
+    seps = seps[:ci] + (sep,) + seps[ci:]
+    if len(children) <= MAX_NODE:
+        return _Branch(seps, children, size), None, None, added
+    mid = MAX_NODE if ci == len(children) - 2 else len(children) // 2
+    left_children = children[:mid]
+    left_size = sum(c.size for c in left_children)
+    return (_Branch(seps[:mid - 1], left_children, left_size),
+            _Branch(seps[mid:], children[mid:], size - left_size), seps[mid - 1], added)
+
+
+def _delete(node, key):
+    """返回 (新节点或 None(节点已空), 是否删除了键)
+
+    删除不做节点合并，只移除变空的节点；分隔键仍是各子树的有效下界。
+    """
+    if node.__class__ is _Leaf:
+        keys = node.keys
+        i = bisect_left(keys, key)
+        if i == len(keys) or keys[i] != key:
+            return node, False
+        if len(keys) == 1:
+            return None, True
+        values = node.values
+        return _Leaf(keys[:i] + keys[i + 1:], values[:i] + values[i + 1:]), True
+
+    seps, children = node.seps, node.children
+    ci = bisect_right(seps, key)
+    child, removed = _delete(children[ci], key)
+    if not removed:
+        return node, False
+    if child is None:
+        if len(children) == 1:
+            return None, True
+        children = children[:ci] + children[ci + 1:]
+        seps = seps[1:] if ci == 0 else seps[:ci - 1] + seps[ci:]
+        return _Branch(seps, children, node.size - 1), True
+    return _Branch(seps, children[:ci] + (child,) + children[ci + 1:], node.size - 1), True
+
+
+def _iter_from(root, after, skip):
+    stack = []
+    node = root
+    while node.__class__ is _Branch:
+        children = node.children
+        if after is not None:
+            ci = bisect_right(node.seps, after)
+        else:
+            ci = 0
+            while children[ci].size <= skip:
+                skip -= children[ci].size
+                ci += 1
+        stack.append((children, ci))
+        node = children[ci]
+    i = bisect_right(node.keys, after) if after is not None else skip
+
+    while True:
+        keys, values = node.keys, node.values
+        for j in range(i, len(keys)):
+            yield keys[j], values[j]
+        i = 0
+        # 回溯到下一个未访问的兄弟子树，再下降到它最左边的叶子
+        while stack:
+            children, ci = stack.pop()
+            if ci + 1 < len(children):
+                stack.append((children, ci + 1))
+                node = children[ci + 1]
+                while node.__class__ is _Branch:
+                    stack.append((node.children, 0))
+                    node = node.children[0]
+                break
+        else:
+            return
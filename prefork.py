@@ -0,0 +1,172 @@
+"""生产模式的多进程 WSGI 服务器(pre-fork)
+
+主进程创建监听 socket 后 fork 出 ``workers`` 个工作进程，它们共用这一个 socket，
+由内核把新连接分给正在 accept 的进程；每个工作进程用 ``threads`` 个线程的线程池处理请求。
+
+- 工作进程只在线程池有空闲线程时才 accept，忙的进程不会抢走连接让它排队
+- 监听 socket 设为非阻塞：多个进程同时被唤醒时没抢到连接的进程立即返回，不会卡在 accept 里
+- 主进程收到 SIGTERM / SIGINT 后转发给工作进程；工作进程停止接受新连接，处理完正在进行的请求
+  (空闲的 keep-alive 连接最多再等 ``KEEPALIVE_TIMEOUT`` 秒)后退出，主进程等它们全部退出再返回
+- 工作进程意外退出时主进程重新 fork 一个补上；主进程被强行杀掉时工作进程发现后自行退出
+
+进程之间不共享内存，需要共享的状态(数据、登录 token、快照)必须放在 sqlite 这样的外部存储里；
+fork 之前启动的线程不会出现在工作进程中，需要后台线程的组件由 ``on_worker_start`` 重新创建。
+"""
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+DEFAULT_THREADS = 8
+KEEPALIVE_TIMEOUT = 5
+LISTEN_BACKLOG = 2048
+# 工作进程启动后这么短的时间内就退出，视为启动失败，不再重新 fork
+MIN_WORKER_UPTIME = 1.0
+
+
+class _RequestHandler(WSGIRequestHandler):
+    """空闲连接超时后关闭；服务器停止时处理完当前请求就关闭连接。不写访问日志(api_server 自己记录)"""
+
+    timeout = KEEPALIVE_TIMEOUT
+
+    def handle_one_request(self):
+        super().handle_one_request()
+        if self.server.stopping:
+            self.close_connection = True
+
+    def log_request(self, code="-", size="-"):
+        pass
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """用固定大小的线程池处理请求的 WSGI 服务器"""
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads=DEFAULT_THREADS, fd=None):
+        super().__init__(host, port, app, handler=_RequestHandler, fd=fd)
+        self.stopping = False
+        self._slots = threading.BoundedSemaphore(threads)
+        self._pool = ThreadPoolExecutor(threads, thread_name_prefix="worker")
+
+    def get_request(self):
+        # 先占一个线程再 accept；线程都在忙时不 accept，连接留给其他进程
+        self._slots.acquire()
+        try:
+            return super().get_request()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def process_request(self, request, client_address):
+        try:
+            self._pool.submit(self._process, request, client_address)
+        except BaseException:
+            self._slots.release()
+            self.shutdown_request(request)
+            raise
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def drain(self):
+        """停止接受新连接，等正在处理的请求结束后关闭"""
+        self.stopping = True
+        self.shutdown()
+        self._pool.shutdown(wait=True)
+        self.server_close()
+
+
+def serve(app, host, port, workers=1, threads=DEFAULT_THREADS, on_worker_start=None, on_worker_exit=None):
+    """启动主进程和工作进程，直到收到 SIGTERM / SIGINT 且所有工作进程退出后返回"""
+    sock = socket.create_server((host, port), backlog=LISTEN_BACKLOG)
+    sock.setblocking(False)
+    children = {}  # pid -> (序号, 启动时间)
+    stopping = False
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                _run_worker(app, host, port, sock, threads, index, on_worker_start, on_worker_exit)
+                status = 0
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                os._exit(status)
+        children[pid] = (index, time.monotonic())
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    for index in range(workers):
+        spawn(index)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        while children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            index, started = children.pop(pid)
+            if stopping:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            if time.monotonic() - started < MIN_WORKER_UPTIME:
+                print(f"工作进程 {index} (pid {pid}) 启动后立即退出 ({code})，停止服务器", file=sys.stderr)
+                stop(signal.SIGTERM, None)
+                continue
+            print(f"工作进程 {index} (pid {pid}) 意外退出 ({code})，重新启动", file=sys.stderr)
+            spawn(index)
+    finally:
+        sock.close()
+
+
+def _run_worker(app, host, port, sock, threads, index, on_worker_start, on_worker_exit):
+    parent = os.getppid()
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    # Ctrl-C 同时发给整个进程组，工作进程忽略它，等主进程转发 SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    if on_worker_start is not None:
+        on_worker_start(index)
+    server = PooledWSGIServer(host, port, app, threads, fd=sock.fileno())
+    sock.close()
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.5},
+                              name="accept", daemon=True)
+    thread.start()
+    try:
+        while not stop.wait(1):
+            if not thread.is_alive():
+                raise RuntimeError("accept 线程意外退出")
+            if os.getppid() != parent:
+                break
+    finally:
+        server.drain()
+        if on_worker_exit is not None:
+            on_worker_exit(index)
@@ -0,0 +1,195 @@
+"""按请求开启的性能剖析
+
+请求带上 ``X-Profile`` 请求头或 ``__profile`` 查询参数时，只剖析这一个请求：
+
+- ``X-Profile: 1`` / ``?__profile`` / ``?__profile=json``：用 cProfile 剖析，响应体换成 JSON 报告，
+  列出累计耗时最多的函数，原响应的状态码和大小记在报告里
+- ``X-Profile: collapsed`` / ``?__profile=collapsed``：记录完整调用栈，把各调用栈的自身耗时(微秒)
+  按 flamegraph.pl / speedscope 能读取的 collapsed stack 格式写入 ``directory`` 目录(默认 ``profiles/``)，
+  原响应不变，文件路径放在 ``X-Profile-File`` 响应头里；目录里只保留最新的 ``keep`` 个文件
+
+剖析在 WSGI 层完成，覆盖请求钩子、视图函数和响应体生成。只接受受信任的客户端：默认只有本机，
+``allow="any"`` 接受任意客户端，``allow="off"`` 关闭。不带标记的请求只多一次请求头查找和一次
+查询串子串判断。
+"""
+import cProfile
+import json
+import os
+import pstats
+import sys
+import time
+from urllib.parse import parse_qsl, urlencode
+
+PROFILE_PARAM = "__profile"
+LOCAL_ADDRS = frozenset(("127.0.0.1", "::1", "localhost"))
+DEFAULT_TOP = 30
+DEFAULT_PROFILE_DIR = "profiles"
+# 调用栈文件最多保留的个数，写入新文件时删除最旧的
+DEFAULT_KEEP = 100
+
+
+class ProfilingMiddleware:
+    """包装 WSGI 应用，剖析带标记的请求"""
+
+    def __init__(self, app, allow="local", directory=DEFAULT_PROFILE_DIR, top=DEFAULT_TOP, keep=DEFAULT_KEEP):
+        self.app = app
+        self.allow = allow
+        self.directory = directory
+        self.top = top
+        self.keep = keep
+
+    def __call__(self, environ, start_response):
+        mode = environ.get('HTTP_X_PROFILE')
+        if mode is None and PROFILE_PARAM in environ.get('QUERY_STRING', ''):
+            mode = self._pop_query_flag(environ)
+        if mode is None or mode in ('', '0') or not self._trusted(environ):
+            return self.app(environ, start_response)
+        if mode == 'collapsed':
+            return self._collapsed(environ, start_response)
+        return self._json(environ, start_response)
+
+    def _trusted(self, environ):
+        if self.allow == 'any':
+            return True
+        return self.allow == 'local' and environ.get('REMOTE_ADDR') in LOCAL_ADDRS
+
+    @staticmethod
+    def _pop_query_flag(environ):
+        """从查询串里去掉 __profile，视图函数看到的参数与不剖析时相同"""
+        params = parse_qsl(environ['QUERY_STRING'], keep_blank_values=True)
+        rest = [(k, v) for k, v in params if k != PROFILE_PARAM]
+        if len(rest) == len(params):
+            return None
+        environ['QUERY_STRING'] = urlencode(rest)
+        return next(v for k, v in params if k == PROFILE_PARAM) or 'json'
+
+    def _run(self, environ):
+        """执行请求并读完响应体，返回 (status, headers, body)"""
+        captured = {}
+
+        def capture(status, headers, exc_info=None):
+            captured['status'], captured['headers'] = status, headers
+            return lambda data: None
+
+        app_iter = self.app(environ, capture)
+        try:
+            body = b''.join(app_iter)
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+        return captured['status'], captured['headers'], body
+
+    def _json(self, environ, start_response):
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            status, _, body = self._run(environ)
+        finally:
+            profiler.disable()
+        elapsed = time.perf_counter() - started
+
+        report = {
+            "method": environ.get('REQUEST_METHOD'),
+            "path": environ.get('PATH_INFO'),
+            "status": int(status.split(' ', 1)[0]),
+            "response_bytes": len(body),
+            "total_ms": round(elapsed * 1000, 3),
+            "functions": hot_functions(profiler, self.top),
+        }
+        data = json.dumps(report, ensure_ascii=False).encode('utf-8')
+        start_response('200 OK', [('Content-Type', 'application/json; charset=utf-8'),
+                                  ('Content-Length', str(len(data)))])
+        return [data]
+
+    def _collapsed(self, environ, start_response):
+        stacks = StackProfiler()
+        stacks.start()
+        try:
+            status, headers, body = self._run(environ)
+        finally:
+            stacks.stop()
+
+        os.makedirs(self.directory, exist_ok=True)
+        name = environ.get('PATH_INFO', '/').strip('/').replace('/', '_') or 'root'
+        path = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-"
+                                            f"{environ.get('REQUEST_METHOD', 'GET')}-{name}.folded")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(stacks.collapsed())
+        self._prune()
+        start_response(status, list(headers) + [('X-Profile-File', path)])
+        return [body]
+
+    def _prune(self):
+        """只保留最新的 keep 个调用栈文件；并发删除同一个文件的进程互不影响"""
+        try:
+            files = [(entry.stat().st_mtime, entry.name, entry.path) for entry in os.scandir(self.directory)
+                     if entry.name.endswith('.folded') and entry.is_file()]
+        except OSError:
+            return
+        files.sort()
+        for _, _, path in files[:max(0, len(files) - self.keep)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def hot_functions(profiler, top=DEFAULT_TOP):
+    """cProfile 结果中累计耗时最多的 top 个函数"""
+    stats = pstats.Stats(profiler).stats
+    rows = []
+    for (filename, line, func), (primitive, calls, tottime, cumtime, _) in stats.items():
+        rows.append({
+            "function": func if filename == '~' else f"{os.path.basename(filename)}:{line}({func})",
+            "calls": calls,
+            "primitive_calls": primitive,
+            "tottime_ms": round(tottime * 1000, 3),
+            "cumtime_ms": round(cumtime * 1000, 3),
+        })
+    rows.sort(key=lambda r: (-r["cumtime_ms"], -r["tottime_ms"]))
+    return rows[:top]
+
+
+class StackProfiler:
+    """用 sys.setprofile 记录当前线程的完整调用栈，统计每个调用栈的自身耗时"""
+
+    def __init__(self):
+        self.totals = {}
+        self._stack = []  # [帧名, 开始时间, 子调用耗时]
+
+    def start(self):
+        sys.setprofile(self._event)
+
+    def stop(self):
+        sys.setprofile(None)
+        # 剖析结束时还没返回的调用(包括 start 所在的函数)按已经过的时间计入
+        now = time.perf_counter_ns()
+        while self._stack:
+            self._pop(now)
+
+    def _event(self, frame, event, arg):
+        now = time.perf_counter_ns()
+        if event == 'call':
+            code = frame.f_code
+            self._stack.append([f"{os.path.basename(code.co_filename)}:{code.co_qualname}", now, 0])
+        elif event == 'c_call':
+            # 内置函数带模块名(builtins.len)，内置方法的 __qualname__ 已含类名(str.join)
+            module = getattr(arg, '__module__', None)
+            name = f"{module}.{arg.__qualname__}" if module else arg.__qualname__
+            self._stack.append([name, now, 0])
+        elif self._stack:
+            self._pop(now)
+
+    def _pop(self, now):
+        key = ';'.join(entry[0] for entry in self._stack)
+        _, started, children = self._stack.pop()
+        elapsed = now - started
+        self.totals[key] = self.totals.get(key, 0) + elapsed - children
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    def collapsed(self):
+        """collapsed stack 文本：每行 "调用栈 自身耗时(微秒)"，按调用栈排序"""
+        return ''.join(f"{stack} {ns // 1000}\n"
+                       for stack, ns in sorted(self.totals.items()) if ns >= 1000)
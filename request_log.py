@@ -0,0 +1,228 @@
+"""异步请求日志
+
+请求处理线程只把结构化的日志记录放进有界队列(``RequestLog.submit``)，不做格式化，
+也不写 stdout。后台线程批量取出记录，格式化成与原来相同的彩色多行日志，一次写入、一次 flush：
+
+- 队列满时丢弃新记录并计数(``dropped``)，日志永远不会拖慢请求
+- 输出到 stdout 或追加到文件；输出目标不是终端时自动关闭 ANSI 颜色
+- 进程退出时把队列中剩余的记录写完
+
+响应体记录的是已经生成好的原始字节(``capture_body``)，不再解析、重新序列化：
+最多保留 ``body_max`` 字节，每个路由可以单独设置采样率(0 表示不记录)，
+流式响应永远不读取响应体，避免把整个流缓冲进内存。
+"""
+import atexit
+import json
+import queue
+import random
+import sys
+import threading
+import time
+
+# 队列最多缓存的记录数，以及后台线程一次最多写出的记录数
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_BATCH_SIZE = 256
+# 每条响应日志最多保留的响应体字节数
+DEFAULT_BODY_MAX = 4096
+
+
+# 日志颜色 (终端支持)
+class Colors:
+    GREEN = '\033[92m'
+    YELLOW = '\033[93m'
+    BLUE = '\033[94m'
+    CYAN = '\033[96m'
+    RED = '\033[91m'
+    RESET = '\033[0m'
+    BOLD = '\033[1m'
+
+
+class _NoColors:
+    GREEN = YELLOW = BLUE = CYAN = RED = RESET = BOLD = ''
+
+
+_STOP = object()
+
+# 还没有关闭的后台写出器；进程退出时由同一个 atexit 处理函数写完它们的队列，
+# 关闭后即移出，替换日志不会让已关闭的写出器一直被 atexit 引用
+_open_logs = set()
+
+
+@atexit.register
+def _close_open_logs():
+    for log in list(_open_logs):
+        log.close()
+
+
+class RequestLog:
+    """有界队列 + 后台批量写出的请求日志
+
+    ``path`` 为 None 时写 stdout；``color`` 为 None 时按输出目标是否为终端决定。
+    ``background=False`` 时在调用线程里同步格式化并写出(基准对比用)。
+    ``body_rates`` 是 ``{endpoint: 采样率}``，未列出的路由使用 ``default_body_rate``。
+    """
+
+    def __init__(self, path=None, queue_size=DEFAULT_QUEUE_SIZE, batch_size=DEFAULT_BATCH_SIZE,
+                 color=None, background=True, body_max=DEFAULT_BODY_MAX, body_rates=None,
+                 default_body_rate=1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.body_max = body_max
+        self.body_rates = dict(body_rates or {})
+        self.default_body_rate = default_body_rate
+        self._file = open(path, 'a', encoding='utf-8') if path else None
+        if color is None:
+            color = self._stream().isatty()
+        self.colors = Colors if color else _NoColors
+        self.submitted = 0
+        self.dropped = 0
+        self.written = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        if background:
+            self._thread = threading.Thread(target=self._run, name="request-log", daemon=True)
+            self._thread.start()
+            _open_logs.add(self)
+
+    def _stream(self):
+        return self._file if self._file is not None else sys.stdout
+
+    # ---------- 请求线程 ----------
+
+    def submit(self, record):
+        """放入一条记录；队列满时丢弃并计数，不阻塞"""
+        self.submitted += 1
+        if self._closed:
+            self.dropped += 1
+            return
+        if self._thread is None:
+            self._write([record])
+            return
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def capture_body(self, endpoint, response):
+        """按路由采样率截取响应体原始字节，返回 (截取的字节, 总字节数)
+
+        不记录时返回 (None, None)；流式响应不读取响应体，返回 (None, -1)。
+        """
+        rate = self.body_rates.get(endpoint, self.default_body_rate)
+        if rate <= 0 or self.body_max <= 0 or (rate < 1 and random.random() >= rate):
+            return None, None
+        if response.is_streamed:
+            return None, -1
+        # 非流式响应的 get_data() 直接返回已生成的 bytes，只复制截取的前 body_max 字节
+        data = response.get_data()
+        return data[:self.body_max], len(data)
+
+    def stats(self):
+        return {"submitted": self.submitted, "written": self.written, "dropped": self.dropped,
+                "queued": self._queue.qsize()}
+
+    # ---------- 后台线程 ----------
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            batch = [record]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(r is _STOP for r in batch)
+            self._write([r for r in batch if r is not _STOP])
+            if stop:
+                return
+
+    def _write(self, records):
+        if not records:
+            return
+        parts = []
+        for record in records:
+            parts.append(self.format(record))
+            if self._thread is not None:
+                # 每格式化一条就让出 GIL，请求线程不必等满一个切换间隔
+                time.sleep(0)
+        text = ''.join(parts)
+        with self._write_lock:
+            stream = self._stream()
+            try:
+                stream.write(text)
+                stream.flush()
+            except (OSError, ValueError):
+                # 输出已关闭(例如进程退出时)，丢弃
+                return
+            self.written += len(records)
+
+    def close(self):
+        """写完队列中剩余的记录并停止后台线程；之后提交的记录计为丢弃"""
+        if self._closed:
+            return
+        self._closed = True
+        _open_logs.discard(self)
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join(timeout=5)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # ---------- 格式化 ----------
+
+    def format(self, record):
+        if record["kind"] == "request":
+            return self._format_request(record)
+        return self._format_response(record)
+
+    def _format_request(self, r):
+        c = self.colors
+        lines = [
+            f"\n{c.GREEN}{'=' * 60}{c.RESET}",
+            f"{c.BOLD}{c.CYAN}>>> REQUEST{c.RESET}",
+            f"{c.GREEN}{'=' * 60}{c.RESET}",
+            f"{c.YELLOW}Method:{c.RESET} {r['method']}",
+            f"{c.YELLOW}URL:{c.RESET} {r['url']}",
+            f"{c.YELLOW}Path:{c.RESET} {r['path']}",
+        ]
+        if r.get('args'):
+            lines.append(f"{c.YELLOW}Query Params:{c.RESET} {r['args']}")
+        if r.get('authorization'):
+            lines.append(f"{c.YELLOW}Authorization:{c.RESET} {r['authorization']}")
+        if r.get('body'):
+            lines.append(f"{c.YELLOW}Body:{c.RESET}")
+            lines.append(json.dumps(r['body'], ensure_ascii=False, indent=2))
+        lines.append(f"{_timestamp(r['time'])} - INFO - REQUEST: {r['method']} {r['path']}")
+        return '\n'.join(lines) + '\n'
+
+    def _format_response(self, r):
+        c = self.colors
+        status_color = c.GREEN if r['status_code'] < 400 else c.RED
+        lines = [
+            f"\n{c.BLUE}{'=' * 60}{c.RESET}",
+            f"{c.BOLD}{c.CYAN}<<< RESPONSE{c.RESET}",
+            f"{c.BLUE}{'=' * 60}{c.RESET}",
+            f"{c.YELLOW}Status:{c.RESET} {status_color}{r['status_code']} {r['status']}{c.RESET}",
+            f"{c.YELLOW}Duration:{c.RESET} {r['duration']:.2f}ms",
+            f"{c.YELLOW}Content-Type:{c.RESET} {r['content_type']}",
+        ]
+        size = r.get('body_size')
+        if size == -1:
+            lines.append(f"{c.YELLOW}Body:{c.RESET} (流式响应，未记录)")
+        elif r.get('body'):
+            lines.append(f"{c.YELLOW}Body:{c.RESET}")
+            lines.append(r['body'].decode('utf-8', errors='replace').rstrip('\n'))
+            if size > len(r['body']):
+                lines.append(f"... (共 {size} 字节，只记录了前 {len(r['body'])} 字节)")
+        lines.append(f"{c.BLUE}{'=' * 60}{c.RESET}\n")
+        lines.append(f"{_timestamp(r['time'])} - INFO - RESPONSE: {r['status_code']} - {r['duration']:.2f}ms")
+        return '\n'.join(lines) + '\n'
+
+
+def _timestamp(seconds):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(seconds))
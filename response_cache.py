@@ -0,0 +1,116 @@
+"""GET 响应缓存与条件请求(ETag / If-None-Match)
+
+客户端会反复轮询商品、用户列表，数据没变时每次都重新查询、序列化出同样的响应体。
+``ResponseCache`` 按 (路由, 路径参数, 规范化后的查询参数) 缓存整个响应体，
+每条缓存记下生成时各相关仓库的 ``version``：
+
+- 版本号没变时直接返回缓存的 bytes，不查询、不序列化
+- 任何写操作(包括批量接口、/test/reset 和恢复快照)都会增大仓库的版本号，
+  下次读取时旧缓存被丢弃、重新生成
+- 每条缓存带一个强 ETag(响应体的哈希)，请求的 ``If-None-Match`` 命中时返回 304，
+  连缓存的响应体也不用发送
+- 压缩后的响应体(见 compression.py)在第一次用到时生成并存进同一条缓存，之后不再重复压缩
+
+缓存按响应体总字节数限制大小，超出时淘汰最久没被用到的条目(LRU)。
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAX_BYTES = 32 << 20
+# 每条缓存除响应体之外的大致开销(键、ETag、OrderedDict 节点)
+ENTRY_OVERHEAD = 256
+
+
+def make_etag(body):
+    """响应体的强 ETag(不带引号)"""
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+class CachedResponse:
+    """一条缓存：生成时的版本号、响应体、它的 ETag，以及各压缩方式下的响应体"""
+
+    __slots__ = ('version', 'body', 'content_type', 'etag', 'encoded', 'size')
+
+    def __init__(self, version, body, content_type):
+        self.version = version
+        self.body = body
+        self.content_type = content_type
+        self.etag = make_etag(body)
+        self.encoded = {}
+        self.size = len(body) + ENTRY_OVERHEAD
+
+
+class ResponseCache:
+    """按总字节数限制大小的 LRU 响应缓存，所有方法线程安全"""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, version):
+        """版本号相同的缓存条目，没有或已过期时返回 None(过期的条目顺便删除)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.version == version:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry
+                del self._entries[key]
+                self._bytes -= entry.size
+            self.misses += 1
+            return None
+
+    def put(self, key, entry):
+        """加入一条缓存；单条超过总大小上限的不缓存"""
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            self._entries[key] = entry
+            self._bytes += entry.size
+            self._evict()
+
+    def encoded(self, key, entry, encoding, compress):
+        """entry 用 ``compress(body, encoding)`` 压缩后的响应体
+
+        第一次压缩后存进条目并计入缓存大小；并发的请求可能各压缩一次，只保存先完成的那份。
+        """
+        data = entry.encoded.get(encoding)
+        if data is not None:
+            return data
+        data = compress(entry.body, encoding)
+        with self._lock:
+            if encoding in entry.encoded:
+                return entry.encoded[encoding]
+            entry.encoded[encoding] = data
+            entry.size += len(data)
+            # 条目可能已被淘汰或替换，只有还在缓存里时才计入总大小
+            if self._entries.get(key) is entry:
+                self._bytes += len(data)
+                self._evict()
+        return data
+
+    def _evict(self):
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
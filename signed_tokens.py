@@ -0,0 +1,122 @@
+"""无状态的签名 token：HMAC-SHA256 签名的用户名、角色和过期时间
+
+token 形如 ``<payload>.<signature>``，两段都是去掉填充的 base64url：payload 是紧凑的 JSON
+``{"sub": 用户名, "role": 角色, "name": 姓名, "exp": 过期时间戳}``，signature 是用密钥对 payload 段
+计算的 HMAC-SHA256。校验只需要密钥，不查存储，任何持有同一密钥的进程或节点签发的 token 都能互相校验。
+
+吊销列表(``RevocationList``)是少量例外：被吊销的 token 以 token id 为键保存在单独的 revocations 仓库里，
+过期时间就是 token 本身的过期时间，到期由 ``TokenStore`` 清理；这个仓库不限数量，
+吊销记录不会像登录 token 那样因为超出上限被挤掉。共用 sqlite 库的工作进程看到的是同一份。
+每个进程在内存里缓存吊销集合，仓库的版本号变化时才重新读取，校验时只是一次集合查找。
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import secrets
+import time
+from datetime import datetime
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:  # pragma: no cover - 没装 orjson 时使用标准库
+    _loads = json.loads
+
+# token id 取签名段的前 22 个字符(132 位)，用作吊销列表的键
+TOKEN_ID_LENGTH = 22
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+class TokenSigner:
+    """签发和校验签名 token
+
+    ``secret`` 为 None 时随机生成，只有本进程(以及之后 fork 出的工作进程)能校验；
+    多个节点共用时必须给出同一个密钥。
+    """
+
+    def __init__(self, secret=None, ttl=24 * 3600, clock=time.time, revocations=None):
+        if secret is None:
+            secret = secrets.token_bytes(32)
+        self.key = secret.encode('utf-8') if isinstance(secret, str) else secret
+        # 密钥处理好的 HMAC 状态，每次签名复制一份，省去重复的密钥填充和两次压缩
+        self._hmac = hmac.new(self.key, digestmod=hashlib.sha256)
+        self.ttl = ttl
+        self.clock = clock
+        self.revocations = revocations
+
+    def _sign(self, payload):
+        mac = self._hmac.copy()
+        mac.update(payload.encode('ascii'))
+        return _b64encode(mac.digest())
+
+    def issue(self, username, role, name):
+        """签发 token，过期时间为当前时间加 ttl"""
+        claims = {"sub": username, "role": role, "name": name, "exp": int(self.clock() + self.ttl)}
+        payload = _b64encode(json.dumps(claims, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+        return f"{payload}.{self._sign(payload)}"
+
+    def verify(self, token):
+        """校验签名、过期时间和吊销列表，通过时返回 claims，否则返回 None"""
+        payload, _, signature = token.rpartition('.')
+        if not payload:
+            return None
+        try:
+            if not hmac.compare_digest(self._sign(payload), signature):
+                return None
+        except (UnicodeEncodeError, TypeError):
+            # 非 ASCII 字符不可能是合法的 token
+            return None
+        try:
+            claims = _loads(_b64decode(payload))
+        except (binascii.Error, ValueError):
+            return None
+        if claims["exp"] <= self.clock():
+            return None
+        if self.revocations is not None and self.revocations.is_revoked(signature[:TOKEN_ID_LENGTH]):
+            return None
+        return claims
+
+    def revoke(self, token):
+        """吊销一个已经校验通过的 token，吊销记录保留到 token 过期"""
+        payload, _, signature = token.rpartition('.')
+        self.revocations.revoke(signature[:TOKEN_ID_LENGTH], _loads(_b64decode(payload))["exp"])
+
+    @staticmethod
+    def user_info(claims):
+        """与不透明 token 在 /protected 返回的用户信息形状相同"""
+        return {"username": claims["sub"], "role": claims["role"], "name": claims["name"],
+                "expires": datetime.fromtimestamp(claims["exp"]).isoformat()}
+
+
+class RevocationList:
+    """保存在 revocations 仓库(不限数量的 ``TokenStore``)里的吊销列表，每个进程按仓库版本号缓存"""
+
+    def __init__(self, store):
+        self.store = store
+        self._version = None
+        self._revoked = frozenset()
+
+    def revoke(self, token_id, expires):
+        """记下吊销的 token id，expires(时间戳)之后由仓库清理"""
+        try:
+            self.store.issue(token_id, {"revoked": True}, expires=expires)
+        except KeyError:
+            pass
+
+    def is_revoked(self, token_id):
+        version = self.store.version
+        if version != self._version:
+            # 只有退出登录且未过期的 token 在这里，重新读取的量很小；过期的记录由 TokenStore 清理
+            pk = self.store.repo.pk
+            self._revoked = frozenset(row[pk] for row in self.store)
+            self._version = version
+        return token_id in self._revoked
@@ -0,0 +1,544 @@
+"""SQLite 存储后端
+
+每个仓库对应一张表：``seq`` 为自增行序号(keyset 分页游标)，``pk`` 为业务主键，
+``doc`` 保存整行 JSON；声明了索引的字段额外展开成列并建 ``(列, seq)`` 联合索引，
+文本索引字段把 n-gram 写入单独的 gram 表，查询方式与内存实现的 ``NgramIndex`` 相同。
+
+数据库以 WAL 模式打开，读写互不阻塞；连接按线程(并按进程，fork 后重新建立)缓存，
+SQL 文本按查询形状缓存复用，命中 sqlite3 连接内的预编译语句缓存。
+
+快照把表(及 gram 表)复制到以 ``<表名>__snap_`` 开头的副本表中，
+保存和恢复都是库内的整表复制，耗时与行数成正比。命名快照表 ``SQLiteSnapshots``
+也保存在库里。
+
+各表的版本号保存在 ``_versions`` 表里，与数据在同一个写事务中加一，
+共用一个数据库文件的多个进程看到的是同一个版本号。
+"""
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+
+from fractions import Fraction
+
+from store import Repository, Rollups, active_conditions, char_ngrams
+
+# 每个连接缓存的预编译语句数量
+STATEMENT_CACHE_SIZE = 256
+NGRAM_SIZE = 3
+# 单条 SQL 中绑定参数的上限(低于 SQLite 的默认限制)
+MAX_SQL_PARAMS = 500
+
+
+class SQLiteDatabase:
+    """按线程复用连接的 SQLite 数据库"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def connection(self):
+        local = self._local
+        conn = getattr(local, 'conn', None)
+        if conn is None or local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, isolation_level=None,
+                                   cached_statements=STATEMENT_CACHE_SIZE)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=5000')
+            local.conn = conn
+            local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """写事务；BEGIN IMMEDIATE 在事务开始时就拿到写锁，避免升级锁时死锁"""
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+
+def _dumps(row):
+    return json.dumps(row, ensure_ascii=False, separators=(',', ':'))
+
+
+def _bindable(value):
+    return isinstance(value, (int, float, str))
+
+
+def _column_value(value):
+    # 列表/字典等值无法被等值查询命中，不写入索引列
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return None
+
+
+class SQLiteTable(Repository):
+    """SQLite 实现的实体仓库"""
+
+    def __init__(self, db, name, pk='id', indexes=(), text_indexes=(), rollup_by=(),
+                 rollup_sum=None):
+        self.db = db
+        self.name = name
+        self.pk = pk
+        self.indexed_fields = tuple(indexes)
+        self.text_fields = tuple(text_indexes)
+        self.rollup_fields = tuple(rollup_by)
+        self.rollup_sum = rollup_sum
+        self._sql_cache = {}
+        self._expr_indexes = set()
+        self._create_schema()
+
+    # ---------- 表结构 ----------
+
+    def _grams_table(self, field):
+        return f"{self.name}_{field}_grams"
+
+    def _rollups_table(self):
+        return f"{self.name}_rollups"
+
+    def _create_schema(self):
+        columns = ''.join(f', "c_{f}"' for f in self.indexed_fields)
+        columns += ''.join(f', "t_{f}" TEXT' for f in self.text_fields)
+        with self.db.transaction() as conn:
+            conn.execute(f'CREATE TABLE IF NOT EXISTS "{self.name}" ('
+                         f'seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                         f'pk UNIQUE NOT NULL, doc TEXT NOT NULL{columns})')
+            for field in self.indexed_fields:
+                conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{self.name}_{field}" '
+                             f'ON "{self.name}" ("c_{field}", seq)')
+            for field in self.text_fields:
+                conn.execute(f'CREATE TABLE IF NOT EXISTS "{self._grams_table(field)}" ('
+                             f'gram TEXT NOT NULL, seq INTEGER NOT NULL, '
+                             f'PRIMARY KEY (gram, seq)) WITHOUT ROWID')
+            if self.rollup_fields:
+                # field 为 '*' 的一行是全表总数；total 以 Fraction 文本保存，累加不丢精度
+                conn.execute(f'CREATE TABLE IF NOT EXISTS "{self._rollups_table()}" ('
+                             f'field TEXT NOT NULL, value NOT NULL, count INTEGER NOT NULL, '
+                             f'total TEXT NOT NULL, PRIMARY KEY (field, value))')
+            conn.execute('CREATE TABLE IF NOT EXISTS "_meta" ('
+                         'name TEXT PRIMARY KEY, max_id INTEGER NOT NULL)')
+            conn.execute('INSERT OR IGNORE INTO "_meta" (name, max_id) VALUES (?, 0)',
+                         (self.name,))
+            conn.execute('CREATE TABLE IF NOT EXISTS "_versions" ('
+                         'name TEXT PRIMARY KEY, version INTEGER NOT NULL)')
+            conn.execute('INSERT OR IGNORE INTO "_versions" (name, version) VALUES (?, 0)',
+                         (self.name,))
+
+    @contextmanager
+    def _writing(self):
+        """修改本表数据的写事务，提交前把版本号加一"""
+        with self.db.transaction() as conn:
+            yield conn
+            conn.execute('UPDATE "_versions" SET version = version + 1 WHERE name = ?',
+                         (self.name,))
+
+    @property
+    def version(self):
+        return self.db.connection().execute('SELECT version FROM "_versions" WHERE name = ?',
+                                            (self.name,)).fetchone()[0]
+
+    # ---------- 读 ----------
+
+    def get(self, key):
+        try:
+            row = self.db.connection().execute(
+                f'SELECT doc FROM "{self.name}" WHERE pk = ?', (key,)).fetchone()
+        except (sqlite3.InterfaceError, sqlite3.ProgrammingError):
+            # 主键类型无法绑定(例如请求体里传了列表)时视为不存在
+            return None
+        return json.loads(row[0]) if row else None
+
+    def get_many(self, keys):
+        keys = list(keys)
+        # 无法绑定的主键(例如请求体里传了列表)不可能存在，直接跳过
+        bindable = list(dict.fromkeys(k for k in keys if _bindable(k)))
+        docs = {}
+        conn = self.db.connection()
+        for i in range(0, len(bindable), MAX_SQL_PARAMS):
+            chunk = bindable[i:i + MAX_SQL_PARAMS]
+            docs.update(conn.execute(f'SELECT pk, doc FROM "{self.name}" '
+                                     f'WHERE pk IN ({", ".join("?" * len(chunk))})', chunk))
+        return [json.loads(docs[k]) if _bindable(k) and k in docs else None for k in keys]
+
+    def __len__(self):
+        return self.db.connection().execute(f'SELECT COUNT(*) FROM "{self.name}"').fetchone()[0]
+
+    def rollups(self):
+        if not self.rollup_fields:
+            return None
+        # 与内存实现的排序一致：数值在前，字符串在后
+        cursor = self.db.connection().execute(
+            f'SELECT field, value, count, total FROM "{self._rollups_table()}" '
+            f'ORDER BY field, typeof(value) = \'text\', value')
+        overall = (0, Fraction(0))
+        groups = {field: [] for field in self.rollup_fields}
+        for field, value, count, total in cursor:
+            if field == '*':
+                overall = (count, Fraction(total))
+            elif field in groups:
+                groups[field].append((value, count, Fraction(total)))
+        return overall, groups
+
+    def __iter__(self):
+        cursor = self.db.connection().execute(f'SELECT doc FROM "{self.name}" ORDER BY seq')
+        return (json.loads(doc) for doc, in cursor)
+
+    def next_id(self):
+        return self.db.connection().execute(
+            'SELECT max_id FROM "_meta" WHERE name = ?', (self.name,)).fetchone()[0] + 1
+
+    def _where(self, filters, search):
+        """拼出 WHERE 子句；同样形状的查询得到同样的 SQL 文本，复用预编译语句"""
+        clauses, params = [], []
+        for field, value in filters.items():
+            if field in self.indexed_fields:
+                clauses.append(f'"c_{field}" = ?')
+            else:
+                clauses.append(f"json_extract(doc, '$.{field}') = ?")
+            params.append(value)
+        for field, needle in search.items():
+            needle = needle.lower()
+            grams = self._grams_table(field)
+            if len(needle) <= NGRAM_SIZE:
+                clauses.append(f'seq IN (SELECT seq FROM "{grams}" WHERE gram = ?)')
+                params.append(needle)
+            else:
+                trigrams = sorted({needle[i:i + NGRAM_SIZE]
+                                   for i in range(len(needle) - NGRAM_SIZE + 1)})
+                subquery = ' INTERSECT '.join(
+                    f'SELECT seq FROM "{grams}" WHERE gram = ?' for _ in trigrams)
+                clauses.append(f'seq IN ({subquery}) AND instr("t_{field}", ?) > 0')
+                params.extend(trigrams)
+                params.append(needle)
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def page(self, filters=None, search=None, after=None, offset=0, limit=None):
+        filters = active_conditions(filters)
+        search = active_conditions(search)
+        where, params = self._where(filters, search)
+        want = -1 if limit is None else limit + 1
+
+        if after is not None:
+            where += ' AND seq > ?' if where else ' WHERE seq > ?'
+            params.append(after)
+            offset = 0
+        sql = f'SELECT seq, doc FROM "{self.name}"{where} ORDER BY seq LIMIT ? OFFSET ?'
+        params.extend((want, offset))
+        fetched = self.db.connection().execute(sql, params).fetchall()
+
+        next_after = None
+        if limit is not None and len(fetched) == want:
+            fetched.pop()
+            next_after = fetched[-1][0] if fetched else None
+        return [json.loads(doc) for _, doc in fetched], next_after
+
+    def count(self, filters=None, search=None):
+        filters = active_conditions(filters)
+        search = active_conditions(search)
+        where, params = self._where(filters, search)
+        return self.db.connection().execute(
+            f'SELECT COUNT(*) FROM "{self.name}"{where}', params).fetchone()[0]
+
+    # ---------- 写 ----------
+
+    def _insert_sql(self):
+        sql = self._sql_cache.get('insert')
+        if sql is None:
+            columns = ['seq', 'pk', 'doc']
+            columns += [f'"c_{f}"' for f in self.indexed_fields]
+            columns += [f'"t_{f}"' for f in self.text_fields]
+            sql = (f'INSERT INTO "{self.name}" ({", ".join(columns)}) '
+                   f'VALUES ({", ".join("?" * len(columns))})')
+            self._sql_cache['insert'] = sql
+        return sql
+
+    def _insert_params(self, seq, row):
+        params = [seq, row[self.pk], _dumps(row)]
+        params += [_column_value(row.get(f)) for f in self.indexed_fields]
+        params += [self._folded(row.get(f)) for f in self.text_fields]
+        return params
+
+    @staticmethod
+    def _folded(text):
+        return text.lower() if isinstance(text, str) else None
+
+    def _write_grams(self, conn, seq, field, folded):
+        if folded is None:
+            return
+        conn.executemany(f'INSERT INTO "{self._grams_table(field)}" (gram, seq) VALUES (?, ?)',
+                         [(gram, seq) for gram in char_ngrams(folded, NGRAM_SIZE)])
+
+    def _bump_max_id(self, conn, key):
+        if isinstance(key, int) and not isinstance(key, bool):
+            conn.execute('UPDATE "_meta" SET max_id = max(max_id, ?) WHERE name = ?',
+                         (key, self.name))
+
+    def _rollup_entries(self, rows):
+        """把若干行的汇总展开成 (field, value, count, total) 列表"""
+        (count, total), groups = Rollups(self.rollup_fields, self.rollup_sum).add_many(rows).result()
+        entries = [('*', '', count, total)]
+        for field, group in groups.items():
+            entries.extend((field, value, n, amount) for value, n, amount in group)
+        return entries
+
+    def _apply_rollups(self, conn, row, sign):
+        """在当前事务中把一行计入(sign=1)或移出(sign=-1)汇总表"""
+        if not self.rollup_fields:
+            return
+        table = self._rollups_table()
+        for field, value, _, amount in self._rollup_entries([row]):
+            found = conn.execute(f'SELECT count, total FROM "{table}" WHERE field = ? AND value = ?',
+                                 (field, value)).fetchone()
+            count, total = (found[0], Fraction(found[1])) if found else (0, Fraction(0))
+            count += sign
+            if count:
+                conn.execute(f'INSERT OR REPLACE INTO "{table}" (field, value, count, total) '
+                             f'VALUES (?, ?, ?, ?)', (field, value, count, str(total + sign * amount)))
+            else:
+                conn.execute(f'DELETE FROM "{table}" WHERE field = ? AND value = ?', (field, value))
+
+    def _insert_row(self, conn, row):
+        try:
+            seq = conn.execute(self._insert_sql(), self._insert_params(None, row)).lastrowid
+        except sqlite3.IntegrityError:
+            raise KeyError(row[self.pk]) from None
+        for field in self.text_fields:
+            self._write_grams(conn, seq, field, self._folded(row.get(field)))
+        self._apply_rollups(conn, row, 1)
+        self._bump_max_id(conn, row[self.pk])
+
+    def insert(self, row):
+        with self._writing() as conn:
+            self._insert_row(conn, row)
+        return row
+
+    def insert_many(self, rows):
+        inserted = []
+        with self._writing() as conn:
+            for row in rows:
+                try:
+                    self._insert_row(conn, row)
+                except KeyError:
+                    # 唯一约束冲突只回滚这一条语句，事务继续
+                    inserted.append(False)
+                else:
+                    inserted.append(True)
+        return inserted
+
+    def create(self, fields):
+        # 读 max_id 和插入在同一个 IMMEDIATE 事务里，多线程/多进程下也不会分到相同的主键
+        with self._writing() as conn:
+            max_id = conn.execute('SELECT max_id FROM "_meta" WHERE name = ?',
+                                  (self.name,)).fetchone()[0]
+            row = {self.pk: max_id + 1, **fields}
+            self._insert_row(conn, row)
+        return row
+
+    def create_many(self, fields_list):
+        rows = []
+        with self._writing() as conn:
+            max_id = conn.execute('SELECT max_id FROM "_meta" WHERE name = ?',
+                                  (self.name,)).fetchone()[0]
+            for fields in fields_list:
+                max_id += 1
+                row = {self.pk: max_id, **fields}
+                self._insert_row(conn, row)
+                rows.append(row)
+        return rows
+
+    def update(self, key, changes):
+        changes = {k: v for k, v in changes.items() if k != self.pk}
+        with self._writing() as conn:
+            try:
+                found = conn.execute(f'SELECT seq, doc FROM "{self.name}" WHERE pk = ?',
+                                     (key,)).fetchone()
+            except (sqlite3.InterfaceError, sqlite3.ProgrammingError):
+                return None
+            if found is None:
+                return None
+            seq, doc = found
+            row = json.loads(doc)
+            old = dict(row)
+            row.update(changes)
+
+            sets, params = ['doc = ?'], [_dumps(row)]
+            for field in self.indexed_fields:
+                if field in changes:
+                    sets.append(f'"c_{field}" = ?')
+                    params.append(_column_value(row.get(field)))
+            for field in self.text_fields:
+                if field in changes and changes[field] != old.get(field):
+                    folded = self._folded(row.get(field))
+                    sets.append(f'"t_{field}" = ?')
+                    params.append(folded)
+                    conn.execute(f'DELETE FROM "{self._grams_table(field)}" WHERE seq = ?', (seq,))
+                    self._write_grams(conn, seq, field, folded)
+            params.append(seq)
+            conn.execute(f'UPDATE "{self.name}" SET {", ".join(sets)} WHERE seq = ?', params)
+            if any(field in changes for field in self.rollup_fields + (self.rollup_sum,)):
+                self._apply_rollups(conn, old, -1)
+                self._apply_rollups(conn, row, 1)
+        return row
+
+    def delete(self, key):
+        with self._writing() as conn:
+            try:
+                found = conn.execute(f'SELECT seq, doc FROM "{self.name}" WHERE pk = ?',
+                                     (key,)).fetchone()
+            except (sqlite3.InterfaceError, sqlite3.ProgrammingError):
+                return False
+            if found is None:
+                return False
+            seq, doc = found
+            conn.execute(f'DELETE FROM "{self.name}" WHERE seq = ?', (seq,))
+            for field in self.text_fields:
+                conn.execute(f'DELETE FROM "{self._grams_table(field)}" WHERE seq = ?', (seq,))
+            self._apply_rollups(conn, json.loads(doc), -1)
+        return True
+
+    # ---------- 按字段批量删除(token 过期清理和数量上限) ----------
+    # 只用于没有文本索引和汇总的表(tokens、revocations)；删除在一条 SQL 里完成，
+    # 共用数据库的多个进程看到的是同一份结果
+
+    def _ordered_by(self, field):
+        """按 field 排序和比较用的表达式；第一次用到时建表达式索引，已有的库也能用上"""
+        expr = f"json_extract(doc, '$.{field}')"
+        if field not in self._expr_indexes:
+            with self.db.transaction() as conn:
+                conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{self.name}_{field}_doc" '
+                             f'ON "{self.name}" ({expr})')
+            self._expr_indexes.add(field)
+        return expr
+
+    def _delete_selected(self, select, params):
+        """删除 select 选出的 seq，返回删除的行数；真的删了才把版本号加一"""
+        with self.db.transaction() as conn:
+            deleted = conn.execute(f'DELETE FROM "{self.name}" WHERE seq IN ({select})', params).rowcount
+            if deleted:
+                conn.execute('UPDATE "_versions" SET version = version + 1 WHERE name = ?',
+                             (self.name,))
+        return deleted
+
+    def delete_expired(self, field, cutoff):
+        """删除 field 不大于 cutoff 或缺失的行，返回删除的行数"""
+        expr = self._ordered_by(field)
+        return self._delete_selected(
+            f'SELECT seq FROM "{self.name}" WHERE {expr} <= ? OR {expr} IS NULL', (cutoff,))
+
+    def delete_oldest(self, field, keep):
+        """按 field(相同时按写入顺序)从小到大删除，只留下 keep 行，返回删除的行数"""
+        expr = self._ordered_by(field)
+        return self._delete_selected(
+            f'SELECT seq FROM "{self.name}" ORDER BY {expr}, seq '
+            f'LIMIT max(0, (SELECT COUNT(*) FROM "{self.name}") - ?)', (keep,))
+
+    def load(self, rows):
+        rows = list(rows)
+        with self._writing() as conn:
+            conn.execute(f'DELETE FROM "{self.name}"')
+            conn.execute('DELETE FROM sqlite_sequence WHERE name = ?', (self.name,))
+            conn.execute('UPDATE "_meta" SET max_id = 0 WHERE name = ?', (self.name,))
+            for field in self.text_fields:
+                conn.execute(f'DELETE FROM "{self._grams_table(field)}"')
+
+            batch = []
+            grams = {field: [] for field in self.text_fields}
+            max_id = 0
+            for seq, row in enumerate(rows, 1):
+                batch.append(self._insert_params(seq, row))
+                key = row[self.pk]
+                if isinstance(key, int) and not isinstance(key, bool):
+                    max_id = max(max_id, key)
+                for field in self.text_fields:
+                    folded = self._folded(row.get(field))
+                    if folded is not None:
+                        grams[field].extend((g, seq) for g in char_ngrams(folded, NGRAM_SIZE))
+            conn.executemany(self._insert_sql(), batch)
+            for field, pairs in grams.items():
+                conn.executemany(f'INSERT INTO "{self._grams_table(field)}" (gram, seq) VALUES (?, ?)',
+                                 pairs)
+            conn.execute('UPDATE "_meta" SET max_id = ? WHERE name = ?', (max_id, self.name))
+            if self.rollup_fields:
+                conn.execute(f'DELETE FROM "{self._rollups_table()}"')
+                conn.executemany(f'INSERT INTO "{self._rollups_table()}" (field, value, count, total) '
+                                 f'VALUES (?, ?, ?, ?)',
+                                 [(field, value, count, str(total)) for field, value, count, total
+                                  in self._rollup_entries(rows)])
+            # 批量装载后刷新统计信息，多条件过滤时查询规划器才会选最窄的索引
+            conn.execute(f'ANALYZE "{self.name}"')
+
+    # ---------- 快照 ----------
+
+    def _snapshot_tables(self, snap):
+        """(源表, 副本表) 列表"""
+        pairs = [(self.name, snap)]
+        pairs += [(self._grams_table(f), f'{snap}_{f}') for f in self.text_fields]
+        if self.rollup_fields:
+            pairs.append((self._rollups_table(), f'{snap}_rollups'))
+        return pairs
+
+    def snapshot(self):
+        snap = f'{self.name}__snap_{uuid.uuid4().hex[:12]}'
+        with self.db.transaction() as conn:
+            for source, copy in self._snapshot_tables(snap):
+                conn.execute(f'CREATE TABLE "{copy}" AS SELECT * FROM "{source}"')
+            max_id = conn.execute('SELECT max_id FROM "_meta" WHERE name = ?',
+                                  (self.name,)).fetchone()[0]
+        return snap, max_id
+
+    def restore(self, snap):
+        snap, max_id = snap
+        with self._writing() as conn:
+            for source, copy in self._snapshot_tables(snap):
+                conn.execute(f'DELETE FROM "{source}"')
+                conn.execute(f'INSERT INTO "{source}" SELECT * FROM "{copy}"')
+            conn.execute('UPDATE "_meta" SET max_id = ? WHERE name = ?', (max_id, self.name))
+
+    def drop_snapshot(self, snap):
+        snap, _ = snap
+        with self.db.transaction() as conn:
+            for _, copy in self._snapshot_tables(snap):
+                conn.execute(f'DROP TABLE IF EXISTS "{copy}"')
+
+
+class SQLiteSnapshots(MutableMapping):
+    """保存在数据库里的命名快照表：名称 -> 各仓库快照句柄(以 JSON 保存)"""
+
+    def __init__(self, db):
+        self.db = db
+        with db.transaction() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS "_snapshots" ('
+                         'name TEXT PRIMARY KEY, handle TEXT NOT NULL)')
+
+    def __getitem__(self, name):
+        row = self.db.connection().execute('SELECT handle FROM "_snapshots" WHERE name = ?',
+                                           (name,)).fetchone()
+        if row is None:
+            raise KeyError(name)
+        return json.loads(row[0])
+
+    def __setitem__(self, name, snap):
+        with self.db.transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO "_snapshots" (name, handle) VALUES (?, ?)',
+                         (name, json.dumps(snap)))
+
+    def __delitem__(self, name):
+        with self.db.transaction() as conn:
+            if not conn.execute('DELETE FROM "_snapshots" WHERE name = ?', (name,)).rowcount:
+                raise KeyError(name)
+
+    def __iter__(self):
+        names = self.db.connection().execute('SELECT name FROM "_snapshots" ORDER BY name').fetchall()
+        return iter([name for name, in names])
+
+    def __len__(self):
+        return self.db.connection().execute('SELECT count(*) FROM "_snapshots"').fetchone()[0]
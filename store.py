@@ -0,0 +1,894 @@
+"""数据存储层
+
+``Repository`` 是路由处理函数访问数据的唯一接口，有两种实现：
+本模块的内存实现 ``Table``，以及 ``sqlite_store.SQLiteTable``。
+``open_storage`` 在启动时按配置创建整套仓库。
+
+``Table`` 是 api_server 中 users / products / orders 背后的内存实体表。
+表的全部内容(行、二级索引、文本索引)是一个不可变的 ``_State``，由
+``persistent.PSortedMap`` 组成：
+
+- 主键 -> 行 的映射，按主键读取为 O(log n)，n = 10^6 时只有 4 层
+- 每行插入时分配单调递增的序号(seq)，seq -> 行 的映射保持插入顺序，
+  也是列表接口 keyset 分页的游标：``page(after=seq)`` 二分定位，深页与第一页代价相同
+- 声明了二级索引的字段维护 ``值 -> seq 集合``；多个条件按集合大小从小到大驱动，
+  计数直接取集合大小，过滤查询的耗时只取决于结果集大小
+- 声明了文本索引的字段由 ``NgramIndex`` 维护子串索引，用于用户名模糊搜索
+
+写操作持有每张表自己的写锁，在旧状态上路径复制出新状态后一次性发布；
+读操作不加锁，只取一次当前状态的引用，始终看到某个完整一致的版本，
+列表接口永远不会被写操作阻塞。同理，保存快照和恢复快照都只是一次引用赋值，
+与数据量无关。每次发布新状态时表的 ``version`` 加一，响应缓存据此判断缓存是否过期。
+"""
+import itertools
+import math
+import threading
+from abc import ABC, abstractmethod
+from fractions import Fraction
+from itertools import islice
+
+from persistent import EMPTY, PSortedMap
+
+
+class Repository(ABC):
+    """实体仓库接口
+
+    行是普通 dict，主键字段名为 ``pk``。``filters`` 为 ``{字段: 值}`` 的等值条件，
+    ``search`` 为 ``{文本索引字段: 子串}``，值为 None 或空的条件被忽略。
+    返回的行不能被调用方修改。
+    """
+
+    pk = 'id'
+
+    @property
+    @abstractmethod
+    def version(self):
+        """数据版本号：每次写操作(包括 load / restore)提交后增大，数据不变时保持不变；
+        同一进程内可以据此判断按旧版本缓存的结果是否过期"""
+
+    @abstractmethod
+    def get(self, key):
+        """按主键取一行，不存在时返回 None"""
+
+    @abstractmethod
+    def get_many(self, keys):
+        """按主键批量取行，结果与 ``keys`` 一一对应，不存在的为 None"""
+
+    @abstractmethod
+    def insert(self, row):
+        """插入一行，主键已存在时抛出 KeyError"""
+
+    @abstractmethod
+    def insert_many(self, rows):
+        """在一次加锁(一个事务)内逐行插入，返回每行是否插入成功(主键已存在为 False)"""
+
+    @abstractmethod
+    def create(self, fields):
+        """原子地分配下一个整数主键并插入一行，返回插入的行"""
+
+    @abstractmethod
+    def create_many(self, fields_list):
+        """在一次加锁(一个事务)内为每组字段分配连续的主键并插入，返回插入的行"""
+
+    @abstractmethod
+    def update(self, key, changes):
+        """原子地把 ``changes`` 合并进一行并返回更新后的行；
+        主键字段不允许修改，行不存在时返回 None"""
+
+    @abstractmethod
+    def delete(self, key):
+        """删除一行，返回是否真的删除了"""
+
+    @abstractmethod
+    def load(self, rows):
+        """清空并批量装载数据（用于初始化和 /test/reset）"""
+
+    @abstractmethod
+    def snapshot(self):
+        """保存当前全部数据，返回只能交给 ``restore`` 使用的快照句柄"""
+
+    @abstractmethod
+    def restore(self, snap):
+        """把数据恢复到快照时的状态；快照可以被恢复任意多次"""
+
+    def drop_snapshot(self, snap):
+        """释放快照占用的资源"""
+
+    @abstractmethod
+    def page(self, filters=None, search=None, after=None, offset=0, limit=None):
+        """取一页数据，返回 ``(rows, next_after)``
+
+        给出 ``after`` (上一页最后一行的 seq) 时按 keyset 翻页，忽略 ``offset``；
+        还有下一页时 ``next_after`` 为本页最后一行的 seq，否则为 None。
+        """
+
+    @abstractmethod
+    def count(self, filters=None, search=None):
+        """满足过滤条件的行数"""
+
+    @abstractmethod
+    def next_id(self):
+        """下一个可用的整数主键，删除过的主键不会被复用"""
+
+    @abstractmethod
+    def __len__(self):
+        pass
+
+    @abstractmethod
+    def __iter__(self):
+        pass
+
+    @abstractmethod
+    def rollups(self):
+        """按 ``rollup_by`` 中各字段分组的行数与 ``rollup_sum`` 之和，未配置时为 None
+
+        返回 ``((总行数, 总和), {字段: [(取值, 行数, 和), ...]})``，和为精确的 Fraction，
+        各组按取值排序；与 ``compute_rollups`` 对全表重算的结果应当完全相等。
+        """
+
+    def page_compact(self, filters=None, search=None, after=None, offset=0, limit=None):
+        """与 ``page`` 相同，但 rows 可以是 ``RowBatch``：行保持仓库内存放的形式，
+        序列化时直接写出 JSON，不必先拼出每行的 dict。默认就是 ``page``"""
+        return self.page(filters, search, after, offset, limit)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def select(self, filters=None, offset=0, limit=None, search=None):
+        """按过滤条件取行，结果保持插入顺序"""
+        rows, _ = self.page(filters, search, offset=offset, limit=limit)
+        return rows
+
+
+class _State:
+    """某一时刻整张表的不可变内容"""
+
+    __slots__ = ('by_key', 'by_seq', 'indexes', 'texts', 'next_seq', 'max_id', 'columns',
+                 'rollups')
+
+    def __init__(self, by_key, by_seq, indexes, texts, next_seq, max_id, columns=None,
+                 rollups=None):
+        self.by_key = by_key        # 编码后的主键 -> (seq, 存放的行)
+        self.by_seq = by_seq        # seq -> 存放的行
+        self.indexes = indexes      # 字段 -> PSortedMap(索引值 -> seq 集合)
+        self.texts = texts          # 字段 -> NgramIndex
+        self.next_seq = next_seq
+        self.max_id = max_id
+        self.columns = columns      # 列存表的列数组，普通表为 None
+        self.rollups = rollups      # Rollups，未配置汇总时为 None
+
+
+class Table(Repository):
+    """按主键索引、可选二级索引的内存实体表"""
+
+    def __init__(self, rows=(), pk='id', indexes=(), text_indexes=(), rollup_by=(),
+                 rollup_sum=None):
+        self.pk = pk
+        self.indexed_fields = tuple(indexes)
+        self.text_fields = tuple(text_indexes)
+        self.rollup_fields = tuple(rollup_by)
+        self.rollup_sum = rollup_sum
+        self._lock = threading.Lock()
+        self._state = None
+        self._version = 0
+        self.load(rows)
+
+    @property
+    def version(self):
+        return self._version
+
+    def _publish(self, state):
+        """发布新状态(调用方持有写锁)；先换状态再增加版本号，
+        读到新版本号的读者一定也能读到新状态"""
+        self._state = state
+        self._version += 1
+
+    # ---------- 行的存放形式 ----------
+    # 普通表直接存放 dict；columnar.ColumnarTable 覆盖这几个方法，把行编码进列数组
+
+    def _new_columns(self):
+        return None
+
+    def _encode(self, columns, seq, row):
+        return row
+
+    def _decode(self, columns, stored):
+        return stored
+
+    def _pack(self, seq, stored):
+        """by_key 中存放的值"""
+        return (seq, stored)
+
+    def _unpack(self, columns, packed):
+        """by_key 中的值 -> (seq, 存放的行)"""
+        return packed
+
+    def _encode_key(self, columns, key, add=False):
+        """主键在 by_key 中的形式；``add`` 为 False 且无法编码时返回 None"""
+        return key
+
+    def _rows_json(self, columns, stored, quote):
+        """直接从存放形式写出各行的紧凑 JSON(键排序)
+
+        返回与 stored 一一对应的列表，其中 None 表示该行需要解码后按 dict 序列化；
+        整体返回 None 表示不支持(普通表存的就是 dict，没有可省的中间结果)。
+        """
+        return None
+
+    def _entry(self, state, key):
+        """按主键取 (seq, 存放的行)；主键类型无法比较(例如请求体里传了列表)时视为不存在"""
+        ekey = self._encode_key(state.columns, key)
+        if ekey is None:
+            return None
+        try:
+            packed = state.by_key.get(ekey)
+        except TypeError:
+            return None
+        return self._unpack(state.columns, packed) if packed is not None else None
+
+    # ---------- 读 ----------
+
+    def get(self, key):
+        state = self._state
+        entry = self._entry(state, key)
+        return self._decode(state.columns, entry[1]) if entry is not None else None
+
+    def get_many(self, keys):
+        state = self._state
+        columns, decode = state.columns, self._decode
+        rows = []
+        for key in keys:
+            entry = self._entry(state, key)
+            rows.append(decode(columns, entry[1]) if entry is not None else None)
+        return rows
+
+    def __len__(self):
+        return len(self._state.by_seq)
+
+    def __iter__(self):
+        state = self._state
+        return (self._decode(state.columns, stored) for stored in state.by_seq.values())
+
+    def next_id(self):
+        return self._state.max_id + 1
+
+    def _plan(self, state, filters, search):
+        """把过滤条件变成 (seq 集合列表, 逐行判断的谓词列表)；确定无结果时返回 None"""
+        sets, predicates = [], []
+        for field, value in filters.items():
+            index = state.indexes.get(field)
+            if index is None:
+                predicates.append(lambda row, f=field, v=value: row.get(f) == v)
+                continue
+            ikey = _index_key(value)
+            bucket = index.get(ikey) if ikey is not None else None
+            if bucket is None:
+                return None
+            sets.append(bucket)
+        for field, needle in search.items():
+            needle = needle.lower()
+            buckets, exact = state.texts[field].lookup(needle)
+            if buckets is None:
+                return None
+            sets.extend(buckets)
+            if not exact:
+                predicates.append(lambda row, f=field, q=needle:
+                                  isinstance(row.get(f), str) and q in row[f].lower())
+        sets.sort(key=len)
+        return sets, predicates
+
+    def _matches(self, state, plan, after):
+        """按 seq 升序产出满足条件的 (seq, 行)：以最小的集合驱动，其余集合做成员判断"""
+        sets, predicates = plan
+        if sets:
+            by_seq = state.by_seq
+            matches = ((s, by_seq.get(s)) for s in self._intersect(sets, after))
+        else:
+            matches = state.by_seq.items(after)
+        if predicates:
+            columns, decode = state.columns, self._decode
+            matches = ((s, r) for s, r in matches
+                       if all(p(decode(columns, r)) for p in predicates))
+        return matches
+
+    @staticmethod
+    def _intersect(sets, after):
+        """按升序产出同时属于 ``sets`` 中所有集合的 seq (sets 已按大小排序)"""
+        driver = sets[0].keys(after)
+        for other in sets[1:]:
+            if len(other) <= MERGE_RATIO * len(sets[0]):
+                # 大小相近时顺序归并两个有序序列，比逐个 O(log n) 查找快
+                driver = _merge_intersect(driver, other.keys(after))
+            else:
+                driver = (s for s in driver if s in other)
+        return driver
+
+    def page(self, filters=None, search=None, after=None, offset=0, limit=None):
+        columns, stored, next_after = self._page(filters, search, after, offset, limit)
+        decode = self._decode
+        return [decode(columns, s) for s in stored], next_after
+
+    def page_compact(self, filters=None, search=None, after=None, offset=0, limit=None):
+        columns, stored, next_after = self._page(filters, search, after, offset, limit)
+        return RowBatch(self, columns, stored), next_after
+
+    def _page(self, filters, search, after, offset, limit):
+        """返回 (列数组, 本页各行的存放形式, next_after)"""
+        state = self._state
+        plan = self._plan(state, active_conditions(filters), active_conditions(search))
+        if plan is None:
+            return state.columns, [], None
+        sets, predicates = plan
+        want = None if limit is None else limit + 1
+
+        if after is None and offset and len(sets) <= 1 and not predicates:
+            # 单个集合(或全表)时借助子树大小直接跳到 offset
+            if sets:
+                by_seq = state.by_seq
+                matches = ((s, by_seq.get(s)) for s in sets[0].keys(skip=offset))
+            else:
+                matches = state.by_seq.items(skip=offset)
+        else:
+            matches = self._matches(state, plan, after)
+            if after is None and offset:
+                matches = islice(matches, offset, None)
+
+        taken = list(islice(matches, want))
+        next_after = None
+        if want is not None and len(taken) == want:
+            taken.pop()
+            next_after = taken[-1][0] if taken else None
+        return state.columns, [stored for _, stored in taken], next_after
+
+    def count(self, filters=None, search=None):
+        state = self._state
+        plan = self._plan(state, active_conditions(filters), active_conditions(search))
+        if plan is None:
+            return 0
+        sets, predicates = plan
+        if not predicates:
+            if len(sets) <= 1:
+                return len(sets[0]) if sets else len(state.by_seq)
+            # 只需计数时不取行
+            return sum(1 for _ in self._intersect(sets, None))
+        return sum(1 for _ in self._matches(state, plan, None))
+
+    # ---------- 写 ----------
+
+    def _with_row(self, state, key, seq, old, new):
+        """在 state 上把 seq 对应的行从 ``old`` 换成 ``new`` (None 表示不存在)，返回新状态
+
+        ``old``/``new`` 是 dict 形式的行，``key`` 是原始主键。
+        """
+        indexes = state.indexes
+        if self.indexed_fields:
+            indexes = dict(indexes)
+            for field in self.indexed_fields:
+                before = _index_key(old.get(field)) if old is not None else None
+                after = _index_key(new.get(field)) if new is not None else None
+                if before == after:
+                    continue
+                index = indexes[field]
+                if before is not None:
+                    index = _bucket_remove(index, before, seq)
+                if after is not None:
+                    index = _bucket_add(index, after, seq)
+                indexes[field] = index
+
+        texts = state.texts
+        if self.text_fields:
+            texts = dict(texts)
+            for field in self.text_fields:
+                before = old.get(field) if old is not None else None
+                after = new.get(field) if new is not None else None
+                if before == after:
+                    continue
+                texts[field] = texts[field].remove(seq, before).add(seq, after)
+
+        columns = state.columns
+        ekey = self._encode_key(columns, key, add=True)
+        if new is None:
+            by_key = state.by_key.delete(ekey)
+            by_seq = state.by_seq.delete(seq)
+        else:
+            stored = self._encode(columns, seq, new)
+            by_key = state.by_key.set(ekey, self._pack(seq, stored))
+            by_seq = state.by_seq.set(seq, stored)
+        rollups = state.rollups
+        if rollups is not None and not rollups.same_group(old, new):
+            if old is not None:
+                rollups = rollups.remove(old)
+            if new is not None:
+                rollups = rollups.add(new)
+        max_id = state.max_id
+        if new is not None and isinstance(key, int) and key > max_id:
+            max_id = key
+        next_seq = max(state.next_seq, seq + 1)
+        return _State(by_key, by_seq, indexes, texts, next_seq, max_id, columns, rollups)
+
+    def _with_inserts(self, state, rows):
+        """在 state 上追加一批新行 ``[(原始主键, 行)]`` (主键均不存在且互不相同)，返回新状态
+
+        各索引先按索引键分组，再与现有结构批量归并，避免每行每个索引键各做一次路径复制。
+        """
+        columns = state.columns
+        seq = state.next_seq
+        max_id = state.max_id
+        by_key_items, by_seq_items = [], []
+        index_adds = {field: {} for field in self.indexed_fields}
+        text_adds = {field: [] for field in self.text_fields}
+        for key, row in rows:
+            stored = self._encode(columns, seq, row)
+            by_key_items.append((self._encode_key(columns, key, add=True), self._pack(seq, stored)))
+            by_seq_items.append((seq, stored))
+            for field, adds in index_adds.items():
+                ikey = _index_key(row.get(field))
+                if ikey is not None:
+                    adds.setdefault(ikey, []).append(seq)
+            for field, adds in text_adds.items():
+                adds.append((seq, row.get(field)))
+            if isinstance(key, int) and key > max_id:
+                max_id = key
+            seq += 1
+
+        indexes = dict(state.indexes)
+        for field, adds in index_adds.items():
+            indexes[field] = _buckets_merge(indexes[field], adds)
+        texts = dict(state.texts)
+        for field, adds in text_adds.items():
+            texts[field] = texts[field].add_many(adds)
+        rollups = state.rollups
+        if rollups is not None:
+            rollups = rollups.add_many(row for _, row in rows)
+        by_key_items.sort(key=lambda item: item[0])
+        return _State(state.by_key.merge(by_key_items), state.by_seq.merge(by_seq_items),
+                      indexes, texts, seq, max_id, columns, rollups)
+
+    def insert(self, row):
+        key = row[self.pk]
+        with self._lock:
+            state = self._state
+            if self._entry(state, key) is not None:
+                raise KeyError(key)
+            self._publish(self._with_row(state, key, state.next_seq, None, row))
+        return row
+
+    def insert_many(self, rows):
+        inserted, accepted = [], []
+        with self._lock:
+            state = self._state
+            seen = set()
+            for row in rows:
+                key = row[self.pk]
+                ok = key not in seen and self._entry(state, key) is None
+                if ok:
+                    seen.add(key)
+                    accepted.append((key, row))
+                inserted.append(ok)
+            # 整批只发布一次，读者不会看到插入了一半的批次
+            self._publish(self._with_inserts(state, accepted))
+        return inserted
+
+    def create(self, fields):
+        with self._lock:
+            state = self._state
+            key = state.max_id + 1
+            row = {self.pk: key, **fields}
+            self._publish(self._with_row(state, key, state.next_seq, None, row))
+        return row
+
+    def create_many(self, fields_list):
+        with self._lock:
+            state = self._state
+            keys = itertools.count(state.max_id + 1)
+            rows = [{self.pk: key, **fields} for key, fields in zip(keys, fields_list)]
+            self._publish(self._with_inserts(state, [(row[self.pk], row) for row in rows]))
+        return rows
+
+    def update(self, key, changes):
+        changes = {k: v for k, v in changes.items() if k != self.pk}
+        with self._lock:
+            state = self._state
+            entry = self._entry(state, key)
+            if entry is None:
+                return None
+            seq, old = entry[0], self._decode(state.columns, entry[1])
+            new = {**old, **changes}
+            self._publish(self._with_row(state, key, seq, old, new))
+        return new
+
+    def delete(self, key):
+        with self._lock:
+            state = self._state
+            entry = self._entry(state, key)
+            if entry is None:
+                return False
+            seq, old = entry[0], self._decode(state.columns, entry[1])
+            self._publish(self._with_row(state, key, seq, old, None))
+        return True
+
+    def snapshot(self):
+        # 状态不可变，保存引用即是快照
+        return self._state
+
+    def restore(self, snap):
+        with self._lock:
+            self._publish(snap)
+
+    def load(self, rows):
+        # 批量构建全部结构，不逐行路径复制
+        rows = list(rows)
+        # 各结构共用同一批 seq 整数对象，大表时能省下可观的内存
+        seqs = list(range(1, len(rows) + 1))
+        pk = self.pk
+        columns = self._new_columns()
+        stored = [self._encode(columns, seq, row) for seq, row in zip(seqs, rows)]
+
+        keyed = sorted(((self._encode_key(columns, row[pk], add=True), seq)
+                        for seq, row in zip(seqs, rows)), key=lambda item: item[0])
+        for a, b in zip(keyed, keyed[1:]):
+            if a[0] == b[0]:
+                raise KeyError(rows[a[1] - 1][pk])
+        by_key = PSortedMap.from_sorted((ekey, self._pack(seq, stored[seq - 1]))
+                                        for ekey, seq in keyed)
+        by_seq = PSortedMap.from_sorted(zip(seqs, stored))
+
+        indexes = {}
+        for field in self.indexed_fields:
+            groups = {}
+            for seq, row in zip(seqs, rows):
+                ikey = _index_key(row.get(field))
+                if ikey is not None:
+                    groups.setdefault(ikey, []).append(seq)
+            indexes[field] = PSortedMap.from_sorted(
+                (ikey, PSortedMap.from_sorted((s, None) for s in groups[ikey]))
+                for ikey in sorted(groups))
+        texts = {field: NgramIndex.build((seq, row.get(field)) for seq, row in zip(seqs, rows))
+                 for field in self.text_fields}
+
+        rollups = None
+        if self.rollup_fields:
+            rollups = Rollups(self.rollup_fields, self.rollup_sum).add_many(rows)
+
+        max_id = max((row[pk] for row in rows if isinstance(row[pk], int)), default=0)
+        with self._lock:
+            self._publish(_State(by_key, by_seq, indexes, texts, len(rows) + 1, max_id, columns,
+                                 rollups))
+
+    def rollups(self):
+        rollups = self._state.rollups
+        return rollups.result() if rollups is not None else None
+
+
+class RowBatch:
+    """``Table.page_compact`` 返回的一页行
+
+    保存表内的存放形式，迭代时才逐行拼出 dict；json_provider 序列化时调用 ``json_rows``
+    让表直接写出每行的 JSON。
+    """
+
+    __slots__ = ('table', 'columns', 'stored')
+
+    def __init__(self, table, columns, stored):
+        self.table = table
+        self.columns = columns
+        self.stored = stored
+
+    def __len__(self):
+        return len(self.stored)
+
+    def __iter__(self):
+        decode, columns = self.table._decode, self.columns
+        return (decode(columns, s) for s in self.stored)
+
+    def json_rows(self, quote):
+        """各行的紧凑 JSON，含义见 ``Table._rows_json``"""
+        return self.table._rows_json(self.columns, self.stored, quote)
+
+
+class NgramIndex:
+    """不可变的字符 n-gram 子串索引，大小写折叠，中英文通用
+
+    每个文本按字符(而非字节)切出长度 1..n 的所有子串作为 gram，维护 ``gram -> seq 集合``。
+    长度不超过 n 的查询词本身就是一个 gram，直接查表即为精确结果；更长的查询词
+    对其所有 n-gram 的集合求交得到候选，再用子串匹配确认。
+    折叠方式与原来的 ``str.lower()`` 比较保持一致。
+    """
+
+    __slots__ = ('n', 'postings')
+
+    def __init__(self, postings=EMPTY, n=3):
+        self.n = n
+        self.postings = postings
+
+    @classmethod
+    def build(cls, texts, n=3):
+        """由按 seq 升序的 ``(seq, text)`` 批量构建"""
+        groups = {}
+        for seq, text in texts:
+            if isinstance(text, str):
+                for gram in char_ngrams(text.lower(), n):
+                    groups.setdefault(gram, []).append(seq)
+        return cls(PSortedMap.from_sorted(
+            (gram, PSortedMap.from_sorted((s, None) for s in groups[gram]))
+            for gram in sorted(groups)), n)
+
+    def add_many(self, texts):
+        """批量加入按 seq 升序的 ``(seq, text)``"""
+        groups = {}
+        for seq, text in texts:
+            if isinstance(text, str):
+                for gram in char_ngrams(text.lower(), self.n):
+                    groups.setdefault(gram, []).append(seq)
+        return NgramIndex(_buckets_merge(self.postings, groups), self.n)
+
+    def add(self, seq, text):
+        # 非字符串的值不可能匹配子串查询，不建索引
+        if not isinstance(text, str):
+            return self
+        postings = self.postings
+        for gram in char_ngrams(text.lower(), self.n):
+            postings = _bucket_add(postings, gram, seq)
+        return NgramIndex(postings, self.n)
+
+    def remove(self, seq, text):
+        if not isinstance(text, str):
+            return self
+        postings = self.postings
+        for gram in char_ngrams(text.lower(), self.n):
+            postings = _bucket_remove(postings, gram, seq)
+        return NgramIndex(postings, self.n)
+
+    def lookup(self, folded):
+        """返回 ``(seq 集合列表, 是否精确)``；有 gram 不存在(必然无结果)时集合列表为 None"""
+        n = self.n
+        if len(folded) <= n:
+            grams, exact = (folded,), True
+        else:
+            grams, exact = {folded[i:i + n] for i in range(len(folded) - n + 1)}, False
+        buckets = []
+        for gram in grams:
+            bucket = self.postings.get(gram)
+            if bucket is None:
+                return None, exact
+            buckets.append(bucket)
+        return buckets, exact
+
+
+class Rollups:
+    """不可变的分组汇总：每个分组字段维护 ``取值 -> (取值, 行数, 和)``
+
+    每加入/移除一行只改动各分组字段中的一个组，O(log 组数)。和用 Fraction 精确累加，
+    增量维护的结果与任意顺序的全表重算完全相等；非数值的 ``sum_field`` 只计行数。
+    无法分组的取值(列表、null 等)不计入该字段的分组，但计入总数。
+    """
+
+    __slots__ = ('fields', 'sum_field', 'groups', 'overall')
+
+    def __init__(self, fields, sum_field, groups=None, overall=(0, Fraction(0))):
+        self.fields = fields
+        self.sum_field = sum_field
+        self.groups = groups if groups is not None else {field: EMPTY for field in fields}
+        self.overall = overall
+
+    def _amount(self, row):
+        value = row.get(self.sum_field) if self.sum_field else None
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+            return Fraction(value)
+        return Fraction(0)
+
+    def _apply(self, row, sign):
+        amount = self._amount(row) * sign
+        groups = dict(self.groups)
+        for field in self.fields:
+            value = row.get(field)
+            ikey = _index_key(value)
+            if ikey is None:
+                continue
+            group = groups[field]
+            _, count, total = group.get(ikey, (value, 0, 0))
+            count += sign
+            groups[field] = (group.set(ikey, (value, count, total + amount)) if count
+                             else group.delete(ikey))
+        count, total = self.overall
+        return Rollups(self.fields, self.sum_field, groups, (count + sign, total + amount))
+
+    def same_group(self, old, new):
+        """两行的分组字段和求和字段都相同(更新不影响汇总)"""
+        if old is None or new is None:
+            return old is new
+        return all(old.get(f) == new.get(f) for f in self.fields) and \
+            self._amount(old) == self._amount(new)
+
+    def add(self, row):
+        return self._apply(row, 1)
+
+    def remove(self, row):
+        return self._apply(row, -1)
+
+    def add_many(self, rows):
+        """批量加入：先在本地按组累加，再与现有分组批量归并"""
+        adds = {field: {} for field in self.fields}
+        count, total = self.overall
+        for row in rows:
+            amount = self._amount(row)
+            for field, acc in adds.items():
+                value = row.get(field)
+                ikey = _index_key(value)
+                if ikey is None:
+                    continue
+                entry = acc.get(ikey)
+                acc[ikey] = (value, 1, amount) if entry is None else \
+                    (entry[0], entry[1] + 1, entry[2] + amount)
+            count += 1
+            total += amount
+        groups = {}
+        for field, acc in adds.items():
+            group = self.groups[field]
+            merged = []
+            for ikey in sorted(acc):
+                value, n, amount = acc[ikey]
+                old = group.get(ikey)
+                merged.append((ikey, (value, n, amount) if old is None
+                               else (old[0], old[1] + n, old[2] + amount)))
+            groups[field] = group.merge(merged)
+        return Rollups(self.fields, self.sum_field, groups, (count, total))
+
+    def result(self):
+        return self.overall, {field: list(group.values()) for field, group in self.groups.items()}
+
+
+def compute_rollups(rows, fields, sum_field):
+    """对全部行重新计算汇总，结果格式与 ``Repository.rollups`` 相同，用于一致性校验"""
+    return Rollups(tuple(fields), sum_field).add_many(rows).result()
+
+
+def char_ngrams(text, n=3):
+    """文本中长度 1..n 的所有字符子串"""
+    grams = set()
+    for size in range(1, n + 1):
+        for i in range(len(text) - size + 1):
+            grams.add(text[i:i + size])
+    return grams
+
+
+# 两个集合大小之比不超过该值时用归并求交，否则逐个查找
+MERGE_RATIO = 8
+
+
+def _merge_intersect(left, right):
+    """两个升序迭代器的交集"""
+    right = iter(right)
+    for b in right:
+        break
+    else:
+        return
+    for a in left:
+        while b < a:
+            for b in right:
+                break
+            else:
+                return
+        if a == b:
+            yield a
+
+
+def _index_key(value):
+    """把字段值变成可以相互比较的索引键
+
+    数值的相等语义与 dict 一致(1 == 1.0 == True)；列表/字典等无法被等值查询命中的值
+    返回 None，不建索引。
+    """
+    if isinstance(value, str):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (0, value)
+    return None
+
+
+def _bucket_add(index, ikey, seq):
+    return index.set(ikey, index.get(ikey, EMPTY).set(seq, None))
+
+
+def _buckets_merge(index, adds):
+    """把 ``{索引键: 升序的新 seq 列表}`` 批量并入 index"""
+    return index.merge(
+        (ikey, index.get(ikey, EMPTY).merge((seq, None) for seq in adds[ikey]))
+        for ikey in sorted(adds))
+
+
+def _bucket_remove(index, ikey, seq):
+    bucket = index.get(ikey)
+    if bucket is None:
+        return index
+    bucket = bucket.delete(seq)
+    return index.set(ikey, bucket) if bucket else index.delete(ikey)
+
+
+def active_conditions(filters):
+    """去掉值为 None 的过滤条件"""
+    if not filters:
+        return {}
+    return {k: v for k, v in filters.items() if v is not None}
+
+
+class Storage:
+    """一个后端上的整套仓库
+
+    ``snapshots`` 是命名快照表(名称 -> ``snapshot()`` 的返回值)；sqlite 后端把它保存在数据库里，
+    共用一个数据库文件的多个进程看到的是同一份。``revocations`` 是签名 token 的吊销记录，
+    与 ``tokens`` 一样是 ``TokenStore``，但不受 token 数量上限约束。
+    """
+
+    def __init__(self, backend, users, products, orders, tokens, revocations, snapshots=None):
+        self.backend = backend
+        self.users = users
+        self.products = products
+        self.orders = orders
+        self.tokens = tokens
+        self.revocations = revocations
+        self.snapshots = {} if snapshots is None else snapshots
+
+    def repositories(self):
+        return {"users": self.users, "products": self.products,
+                "orders": self.orders, "tokens": self.tokens, "revocations": self.revocations}
+
+    def is_empty(self):
+        return not (len(self.users) or len(self.products) or len(self.orders))
+
+    def snapshot(self):
+        """所有仓库的快照"""
+        return {name: repo.snapshot() for name, repo in self.repositories().items()}
+
+    def restore(self, snap):
+        for name, repo in self.repositories().items():
+            repo.restore(snap[name])
+
+    def drop_snapshot(self, snap):
+        # 旧版本保存的快照可能缺少后来新增的仓库
+        for name, repo in self.repositories().items():
+            if name in snap:
+                repo.drop_snapshot(snap[name])
+
+    def close(self):
+        """停止 token 仓库的后台清理线程"""
+        self.tokens.close()
+        self.revocations.close()
+
+
+# 各仓库的主键与索引声明，两种后端共用
+SCHEMA = {
+    "users": {"pk": "id", "text_indexes": ("name",)},
+    "products": {"pk": "id", "indexes": ("category", "status")},
+    "orders": {"pk": "id", "indexes": ("user_id", "status"),
+               "rollup_by": ("status", "user_id", "product_id"), "rollup_sum": "total"},
+    "tokens": {"pk": "token"},
+    "revocations": {"pk": "token"},
+}
+
+BACKENDS = ("memory", "sqlite")
+
+
+def open_storage(backend="memory", path=None, **token_options):
+    """按后端名创建整套仓库；sqlite 后端的数据保存在 ``path`` 指向的文件中
+
+    tokens 仓库包装成 ``TokenStore``，``token_options`` (ttl、max_tokens 等)原样传给它；
+    revocations 仓库同样包装，但不限数量：吊销记录被挤掉会让已吊销的 token 重新生效。
+    """
+    from token_store import TokenStore
+    snapshots = None
+    if backend == "memory":
+        from columnar import COLUMNAR_SCHEMA, ColumnarTable
+        repos = {name: ColumnarTable(columns=COLUMNAR_SCHEMA[name], **spec)
+                 if name in COLUMNAR_SCHEMA else Table(**spec)
+                 for name, spec in SCHEMA.items()}
+    elif backend == "sqlite":
+        from sqlite_store import SQLiteDatabase, SQLiteSnapshots, SQLiteTable
+        db = SQLiteDatabase(path or "api_server.db")
+        repos = {name: SQLiteTable(db, name, **spec) for name, spec in SCHEMA.items()}
+        snapshots = SQLiteSnapshots(db)
+    else:
+        raise ValueError(f"unknown storage backend: {backend!r}")
+    repos["tokens"] = TokenStore(repos["tokens"], **token_options)
+    repos["revocations"] = TokenStore(repos["revocations"], **{**token_options, "max_tokens": 0})
+    return Storage(backend, snapshots=snapshots, **repos)
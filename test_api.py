@@ -1,8 +1,92 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import gzip
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
 import requests
 import pytest
 import allure
 
-BASE_URL = "http://localhost:5001"
+import api_server
+from wsgi_transport import wsgi_session
+
+# API_TEST_TARGET 选择被测的服务：默认是单独启动、监听 http://localhost:5001 的服务器，也可以是其他 URL；
+# 设为 wsgi 时不用启动服务器，请求在进程内直接交给 api_server.create_app 创建的 app 处理(见 wsgi_transport.py)
+TARGET = os.environ.get("API_TEST_TARGET", "http://localhost:5001")
+if TARGET == "wsgi":
+    BASE_URL = "http://testserver"
+    app = api_server.create_app({"log_file": os.devnull})
+else:
+    BASE_URL = TARGET.rstrip("/")
+    app = None
+
+
+def new_session():
+    """发往被测服务的 Session；进程内运行时 BASE_URL 下的请求直接交给 app 处理"""
+    return requests.Session() if app is None else wsgi_session(app, BASE_URL)
+
+
+client = new_session()
+
+
+@contextmanager
+def in_process_app(config):
+    """按 config 在进程内另建一个 app(与被测服务互不影响)，返回发往它的 Session；退出时关闭它的日志和清理线程"""
+    extra = api_server.create_app({"log_file": os.devnull, **config})
+    try:
+        yield wsgi_session(extra, "http://testserver")
+    finally:
+        extra.extensions["api"].close()
+
+
+@contextmanager
+def running_server(*args, script="api_server.py", timeout=10):
+    """在空闲端口上单独启动一个服务进程(script 加上 args)，返回 (url, 进程)
+
+    超时仍未就绪或进程提前退出时用例失败；退出时进程还在运行就发 SIGTERM，15 秒内没退出再强制杀掉整个进程组
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    url = f"http://localhost:{port}"
+    server = subprocess.Popen(
+        [sys.executable, script, "--port", str(port), "--log-file", os.devnull, *args],
+        cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True)
+    try:
+        with allure.step("等待服务启动"):
+            deadline = time.monotonic() + timeout
+            while True:
+                if server.poll() is not None:
+                    pytest.fail(f"{script} {' '.join(args)} 启动失败，退出码 {server.returncode}")
+                try:
+                    requests.get(f"{url}/products/1", timeout=1)
+                    break
+                except requests.ConnectionError:
+                    if time.monotonic() > deadline:
+                        pytest.fail(f"{script} {' '.join(args)} 在 {timeout} 秒内没有就绪")
+                    time.sleep(0.1)
+        yield url, server
+    finally:
+        if server.poll() is None:
+            server.send_signal(signal.SIGTERM)
+            try:
+                server.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                os.killpg(server.pid, signal.SIGKILL)
+                server.wait()
+
+
+@pytest.fixture(autouse=True)
+def reset_before_test():
+    """每个用例开始前把服务端数据恢复到启动时的状态，用例之间互不影响"""
+    client.post(f"{BASE_URL}/test/reset")
 
 # ==================== 用户管理测试 ====================
 
@@ -12,7 +96,7 @@ BASE_URL = "http://localhost:5001"
 def test_get_users_pagination():
     """测试用户列表分页功能"""
     with allure.step("请求第1页，每页2条"):
-        response = requests.get(f"{BASE_URL}/users", params={"page": 1, "limit": 2})
+        response = client.get(f"{BASE_URL}/users", params={"page": 1, "limit": 2})
     
     with allure.step("验证响应"):
         assert response.status_code == 200
@@ -22,12 +106,34 @@ def test_get_users_pagination():
         assert data["limit"] == 2
         assert "total" in data
 
+@allure.feature("用户管理")
+@allure.story("获取用户列表")
+def test_get_users_cursor_pagination():
+    """测试游标翻页与 page 翻页结果一致"""
+    with allure.step("按 page 获取前 4 个用户"):
+        expected = client.get(f"{BASE_URL}/users", params={"page": 1, "limit": 4}).json()["data"]
+
+    with allure.step("每页 2 条，按 next_cursor 翻两页"):
+        first = client.get(f"{BASE_URL}/users", params={"limit": 2}).json()
+        assert first["next_cursor"]
+        second = client.get(f"{BASE_URL}/users", params={"limit": 2, "cursor": first["next_cursor"]}).json()
+        assert "page" not in second
+        assert first["data"] + second["data"] == expected
+
+    with allure.step("include_total=false 时不返回 total"):
+        data = client.get(f"{BASE_URL}/users", params={"include_total": "false"}).json()
+        assert "total" not in data
+
+    with allure.step("非法 cursor 返回 400"):
+        response = client.get(f"{BASE_URL}/users", params={"cursor": "!!!"})
+        assert response.status_code == 400
+
 @allure.feature("用户管理")
 @allure.story("获取用户列表")
 def test_get_users_filtering():
     """测试按姓名过滤用户"""
     with allure.step("按姓名过滤 'Alice'"):
-        response = requests.get(f"{BASE_URL}/users", params={"name": "Alice"})
+        response = client.get(f"{BASE_URL}/users", params={"name": "Alice"})
     
     with allure.step("验证找到 Alice"):
         assert response.status_code == 200
@@ -40,7 +146,7 @@ def test_get_users_filtering():
 def test_get_users_filtering_chinese():
     """测试按中文姓名过滤用户"""
     with allure.step("按姓名过滤 '张三'"):
-        response = requests.get(f"{BASE_URL}/users", params={"name": "张三"})
+        response = client.get(f"{BASE_URL}/users", params={"name": "张三"})
     
     with allure.step("验证找到张三"):
         assert response.status_code == 200
@@ -48,6 +154,25 @@ def test_get_users_filtering_chinese():
         assert len(data["data"]) >= 1
         assert data["data"][0]["name"] == "张三"
 
+@allure.feature("用户管理")
+@allure.story("获取用户列表")
+def test_get_users_filtering_follows_updates():
+    """测试姓名过滤不区分大小写，并随用户创建/更新同步"""
+    with allure.step("创建用户 'Zoe 测试'"):
+        create_resp = client.post(f"{BASE_URL}/users", json={"name": "Zoe 测试", "email": "zoe@example.com"})
+        user_id = create_resp.json()["id"]
+
+    with allure.step("按小写 'zoe' 过滤"):
+        data = client.get(f"{BASE_URL}/users", params={"name": "zoe"}).json()
+        assert user_id in [u["id"] for u in data["data"]]
+
+    with allure.step("改名后旧名字不再命中"):
+        client.put(f"{BASE_URL}/users/{user_id}", json={"name": "Yuki 测试"})
+        data = client.get(f"{BASE_URL}/users", params={"name": "zoe"}).json()
+        assert user_id not in [u["id"] for u in data["data"]]
+        data = client.get(f"{BASE_URL}/users", params={"name": "YUKI"}).json()
+        assert user_id in [u["id"] for u in data["data"]]
+
 @allure.feature("用户管理")
 @allure.story("创建用户")
 @allure.severity(allure.severity_level.CRITICAL)
@@ -58,7 +183,7 @@ def test_create_user():
         "email": "newuser@example.com"
     }
     with allure.step("发送 POST 请求创建用户"):
-        response = requests.post(f"{BASE_URL}/users", json=new_user)
+        response = client.post(f"{BASE_URL}/users", json=new_user)
     
     with allure.step("验证创建成功"):
         assert response.status_code == 201
@@ -66,13 +191,42 @@ def test_create_user():
         assert data["name"] == "新测试用户"
         assert "id" in data
 
+@allure.feature("用户管理")
+@allure.story("批量创建用户")
+def test_create_users_batch():
+    """测试批量创建用户：逐条返回结果，非法条目不影响其他条目"""
+    items = [
+        {"name": "批量用户1", "email": "b1@test.com"},
+        {"name": "缺少邮箱"},
+        {"name": "批量用户2", "email": "b2@test.com"},
+    ]
+    with allure.step("提交 3 条，其中 1 条缺少 email"):
+        response = client.post(f"{BASE_URL}/users/batch", json=items)
+
+    with allure.step("验证部分成功与逐条结果"):
+        assert response.status_code == 207
+        data = response.json()
+        assert data["created"] == 2 and data["failed"] == 1
+        assert [r["status"] for r in data["results"]] == [201, 400, 201]
+        first, third = data["results"][0]["data"], data["results"][2]["data"]
+        assert third["id"] == first["id"] + 1
+
+    with allure.step("按 ids 批量查询新用户"):
+        response = client.get(f"{BASE_URL}/users", params={"ids": f"{first['id']},{third['id']},99999"})
+        assert response.status_code == 200
+        assert [u["name"] for u in response.json()["data"]] == ["批量用户1", "批量用户2"]
+        assert response.json()["missing"] == [99999]
+
+    with allure.step("非数组请求体返回 400"):
+        assert client.post(f"{BASE_URL}/users/batch", json={"name": "x"}).status_code == 400
+
 @allure.feature("用户管理")
 @allure.story("获取用户")
 def test_get_single_user():
     """测试获取单个用户"""
     user_id = 1
     with allure.step(f"获取用户 ID {user_id}"):
-        response = requests.get(f"{BASE_URL}/users/{user_id}")
+        response = client.get(f"{BASE_URL}/users/{user_id}")
     
     with allure.step("验证用户信息"):
         assert response.status_code == 200
@@ -88,7 +242,7 @@ def test_update_user():
     user_id = 2
     update_data = {"name": "李四(已更新)"}
     with allure.step(f"更新用户 {user_id}"):
-        response = requests.put(f"{BASE_URL}/users/{user_id}", json=update_data)
+        response = client.put(f"{BASE_URL}/users/{user_id}", json=update_data)
     
     with allure.step("验证更新成功"):
         assert response.status_code == 200
@@ -101,15 +255,15 @@ def test_delete_user():
     """测试删除用户"""
     with allure.step("创建临时用户"):
         new_user = {"name": "待删除用户", "email": "delete@example.com"}
-        create_resp = requests.post(f"{BASE_URL}/users", json=new_user)
+        create_resp = client.post(f"{BASE_URL}/users", json=new_user)
         user_id = create_resp.json()["id"]
     
     with allure.step(f"删除用户 {user_id}"):
-        delete_resp = requests.delete(f"{BASE_URL}/users/{user_id}")
+        delete_resp = client.delete(f"{BASE_URL}/users/{user_id}")
         assert delete_resp.status_code == 200
     
     with allure.step("验证用户已删除"):
-        get_resp = requests.get(f"{BASE_URL}/users/{user_id}")
+        get_resp = client.get(f"{BASE_URL}/users/{user_id}")
         assert get_resp.status_code == 404
 
 @allure.feature("用户管理")
@@ -118,9 +272,26 @@ def test_create_user_invalid_data():
     """测试缺少必填字段创建用户"""
     invalid_data = {"name": "缺少邮箱"}
     with allure.step("发送不完整数据"):
-        response = requests.post(f"{BASE_URL}/users", json=invalid_data)
+        response = client.post(f"{BASE_URL}/users", json=invalid_data)
     assert response.status_code == 400
 
+@allure.feature("用户管理")
+@allure.story("删除用户")
+def test_deleted_user_not_updatable():
+    """测试删除后的用户不能再被更新，新用户 ID 不复用"""
+    with allure.step("创建并删除临时用户"):
+        create_resp = client.post(f"{BASE_URL}/users", json={"name": "临时用户", "email": "tmp@example.com"})
+        user_id = create_resp.json()["id"]
+        client.delete(f"{BASE_URL}/users/{user_id}")
+
+    with allure.step("更新已删除的用户"):
+        response = client.put(f"{BASE_URL}/users/{user_id}", json={"name": "不应存在"})
+        assert response.status_code == 404
+
+    with allure.step("再次创建用户"):
+        create_resp = client.post(f"{BASE_URL}/users", json={"name": "临时用户2", "email": "tmp2@example.com"})
+        assert create_resp.json()["id"] > user_id
+
 # ==================== 认证测试 ====================
 
 @allure.feature("认证")
@@ -130,7 +301,7 @@ def test_login_admin_success():
     """测试管理员账号登录成功"""
     credentials = {"username": "admin", "password": "admin123"}
     with allure.step("使用 admin/admin123 登录"):
-        response = requests.post(f"{BASE_URL}/login", json=credentials)
+        response = client.post(f"{BASE_URL}/login", json=credentials)
     
     with allure.step("验证登录成功"):
         assert response.status_code == 200
@@ -146,7 +317,7 @@ def test_login_test_user_success():
     """测试普通用户账号登录成功"""
     credentials = {"username": "test", "password": "test123"}
     with allure.step("使用 test/test123 登录"):
-        response = requests.post(f"{BASE_URL}/login", json=credentials)
+        response = client.post(f"{BASE_URL}/login", json=credentials)
     
     with allure.step("验证登录成功"):
         assert response.status_code == 200
@@ -160,7 +331,7 @@ def test_login_vip_user_success():
     """测试VIP用户账号登录成功"""
     credentials = {"username": "vip", "password": "vip888"}
     with allure.step("使用 vip/vip888 登录"):
-        response = requests.post(f"{BASE_URL}/login", json=credentials)
+        response = client.post(f"{BASE_URL}/login", json=credentials)
     
     with allure.step("验证登录成功"):
         assert response.status_code == 200
@@ -175,7 +346,7 @@ def test_login_params_order_reversed():
     # {"password": "vip888","username": "vip"}
     credentials = {"password": "vip888", "username": "vip"}
     with allure.step("参数顺序颠倒"):
-        response = requests.post(f"{BASE_URL}/login", json=credentials)
+        response = client.post(f"{BASE_URL}/login", json=credentials)
     
     with allure.step("验证登录成功"):
         assert response.status_code == 200
@@ -188,7 +359,7 @@ def test_login_with_extra_params():
     # {"username": "vip", "password": "vip888","id":""}
     credentials = {"username": "vip", "password": "vip888", "id": ""}
     with allure.step("包含额外参数 id"):
-        response = requests.post(f"{BASE_URL}/login", json=credentials)
+        response = client.post(f"{BASE_URL}/login", json=credentials)
     
     with allure.step("验证登录成功"):
         assert response.status_code == 200
@@ -203,7 +374,7 @@ def test_login_wrong_password():
     # {"username": "vip", "password": "vip123"}
     credentials = {"username": "vip", "password": "vip123"}
     with allure.step("使用错误密码登录"):
-        response = requests.post(f"{BASE_URL}/login", json=credentials)
+        response = client.post(f"{BASE_URL}/login", json=credentials)
     
     with allure.step("验证登录失败"):
         assert response.status_code == 401
@@ -218,7 +389,7 @@ def test_login_special_chars_password():
     # {"username": "vip", "password": "!@#$"}
     credentials = {"username": "vip", "password": "!@#$"}
     with allure.step("使用特殊字符密码登录"):
-        response = requests.post(f"{BASE_URL}/login", json=credentials)
+        response = client.post(f"{BASE_URL}/login", json=credentials)
     
     with allure.step("验证登录失败"):
         assert response.status_code == 401
@@ -233,7 +404,7 @@ def test_login_short_password():
     # {"username": "vip", "password": "1"}
     credentials = {"username": "vip", "password": "1"}
     with allure.step("使用单字符密码登录"):
-        response = requests.post(f"{BASE_URL}/login", json=credentials)
+        response = client.post(f"{BASE_URL}/login", json=credentials)
     
     with allure.step("验证登录失败"):
         assert response.status_code == 401
@@ -248,7 +419,7 @@ def test_login_mixed_password():
     # {"username": "vip", "password": "123456dsfgsdfgsrt345ert3456ert3456edft3456"}
     credentials = {"username": "vip", "password": "123456dsfgsdfgsrt345ert3456ert3456edft3456"}
     with allure.step("使用混合字符密码登录"):
-        response = requests.post(f"{BASE_URL}/login", json=credentials)
+        response = client.post(f"{BASE_URL}/login", json=credentials)
     
     with allure.step("验证登录失败"):
         assert response.status_code == 401
@@ -265,7 +436,7 @@ def test_login_user_not_found():
     # {"username": "Noo", "password": "vip888"}
     credentials = {"username": "Noo", "password": "vip888"}
     with allure.step("使用不存在的用户登录"):
-        response = requests.post(f"{BASE_URL}/login", json=credentials)
+        response = client.post(f"{BASE_URL}/login", json=credentials)
     
     with allure.step("验证登录失败"):
         assert response.status_code == 401
@@ -282,7 +453,7 @@ def test_login_empty_username():
     # {"username": "", "password": "vip888"}
     credentials = {"username": "", "password": "vip888"}
     with allure.step("使用空用户名登录"):
-        response = requests.post(f"{BASE_URL}/login", json=credentials)
+        response = client.post(f"{BASE_URL}/login", json=credentials)
     
     with allure.step("验证登录失败"):
         assert response.status_code == 400
@@ -297,7 +468,7 @@ def test_login_empty_password():
     # {"username": "vip", "password": ""}
     credentials = {"username": "vip", "password": ""}
     with allure.step("使用空密码登录"):
-        response = requests.post(f"{BASE_URL}/login", json=credentials)
+        response = client.post(f"{BASE_URL}/login", json=credentials)
     
     with allure.step("验证登录失败"):
         assert response.status_code == 400
@@ -312,7 +483,7 @@ def test_login_both_empty():
     # {"username": "", "password": ""}
     credentials = {"username": "", "password": ""}
     with allure.step("用户名和密码都为空"):
-        response = requests.post(f"{BASE_URL}/login", json=credentials)
+        response = client.post(f"{BASE_URL}/login", json=credentials)
     
     with allure.step("验证登录失败"):
         assert response.status_code == 400
@@ -326,7 +497,7 @@ def test_login_null_username():
     # {"username": null, "password": "vip888"}
     credentials = {"username": None, "password": "vip888"}
     with allure.step("用户名为 null"):
-        response = requests.post(f"{BASE_URL}/login", json=credentials)
+        response = client.post(f"{BASE_URL}/login", json=credentials)
     
     with allure.step("验证登录失败"):
         assert response.status_code == 400
@@ -343,7 +514,7 @@ def test_login_integer_credentials():
     # {"username": 123456, "password": 123456}
     credentials = {"username": 123456, "password": 123456}
     with allure.step("使用数字类型登录"):
-        response = requests.post(f"{BASE_URL}/login", json=credentials)
+        response = client.post(f"{BASE_URL}/login", json=credentials)
     
     with allure.step("验证登录失败"):
         assert response.status_code == 400
@@ -358,7 +529,7 @@ def test_login_array_username():
     # {"username": [1,2,3], "password": "vip888"}
     credentials = {"username": [1, 2, 3], "password": "vip888"}
     with allure.step("使用数组类型用户名登录"):
-        response = requests.post(f"{BASE_URL}/login", json=credentials)
+        response = client.post(f"{BASE_URL}/login", json=credentials)
     
     with allure.step("验证登录失败"):
         assert response.status_code == 400
@@ -376,7 +547,7 @@ def test_login_username_too_long():
     long_username = "test123456123456786423453454534537534537834537834537834537834537834534538456453"
     credentials = {"username": long_username, "password": "vip888"}
     with allure.step(f"使用超长用户名 (长度: {len(long_username)})"):
-        response = requests.post(f"{BASE_URL}/login", json=credentials)
+        response = client.post(f"{BASE_URL}/login", json=credentials)
     
     with allure.step("验证登录失败"):
         assert response.status_code == 400
@@ -392,7 +563,7 @@ def test_login_password_too_long():
     long_password = "123456123745345378578964563123453123453123785353453123"
     credentials = {"username": "vip", "password": long_password}
     with allure.step(f"使用超长密码 (长度: {len(long_password)})"):
-        response = requests.post(f"{BASE_URL}/login", json=credentials)
+        response = client.post(f"{BASE_URL}/login", json=credentials)
     
     with allure.step("验证登录失败"):
         assert response.status_code == 400
@@ -409,7 +580,7 @@ def test_login_xss_attack():
     # {"username": "<script>alert('xss')", "password": "vip888"}
     credentials = {"username": "<script>alert('xss')", "password": "vip888"}
     with allure.step("使用 XSS 攻击字符串"):
-        response = requests.post(f"{BASE_URL}/login", json=credentials)
+        response = client.post(f"{BASE_URL}/login", json=credentials)
     
     with allure.step("验证 XSS 攻击被拦截"):
         assert response.status_code == 400
@@ -424,7 +595,7 @@ def test_login_sql_injection():
     # {"username": "vip';--", "password": "vip888"}
     credentials = {"username": "vip';--", "password": "vip888"}
     with allure.step("使用 SQL 注入字符串"):
-        response = requests.post(f"{BASE_URL}/login", json=credentials)
+        response = client.post(f"{BASE_URL}/login", json=credentials)
     
     with allure.step("验证 SQL 注入被拦截"):
         assert response.status_code == 400
@@ -437,12 +608,12 @@ def test_login_sql_injection():
 def test_protected_endpoint_success():
     """测试使用有效 token 访问受保护资源"""
     with allure.step("登录获取 token"):
-        login_resp = requests.post(f"{BASE_URL}/login", json={"username": "admin", "password": "admin123"})
+        login_resp = client.post(f"{BASE_URL}/login", json={"username": "admin", "password": "admin123"})
         token = login_resp.json()["token"]
     
     with allure.step("使用 token 访问受保护资源"):
         headers = {"Authorization": f"Bearer {token}"}
-        response = requests.get(f"{BASE_URL}/protected", headers=headers)
+        response = client.get(f"{BASE_URL}/protected", headers=headers)
     
     with allure.step("验证访问成功"):
         assert response.status_code == 200
@@ -453,7 +624,7 @@ def test_protected_endpoint_success():
 def test_protected_endpoint_unauthorized():
     """测试无 token 访问受保护资源"""
     with allure.step("不带 token 访问受保护资源"):
-        response = requests.get(f"{BASE_URL}/protected")
+        response = client.get(f"{BASE_URL}/protected")
     assert response.status_code == 401
 
 @allure.feature("认证")
@@ -462,9 +633,227 @@ def test_protected_endpoint_invalid_token():
     """测试使用无效 token 访问受保护资源"""
     with allure.step("使用无效 token 访问"):
         headers = {"Authorization": "Bearer invalid_token_123"}
-        response = requests.get(f"{BASE_URL}/protected", headers=headers)
+        response = client.get(f"{BASE_URL}/protected", headers=headers)
     assert response.status_code == 401
 
+@allure.feature("认证")
+@allure.story("退出登录")
+def test_logout_invalidates_token():
+    """测试退出登录后 token 不能再访问受保护资源"""
+    with allure.step("登录获取 token"):
+        token = client.post(f"{BASE_URL}/login", json={"username": "test", "password": "test123"}).json()["token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        assert client.get(f"{BASE_URL}/protected", headers=headers).status_code == 200
+
+    with allure.step("退出登录"):
+        assert client.post(f"{BASE_URL}/logout", headers=headers).status_code == 200
+
+    with allure.step("token 已失效，再次退出返回 401"):
+        assert client.get(f"{BASE_URL}/protected", headers=headers).status_code == 401
+        assert client.post(f"{BASE_URL}/logout", headers=headers).status_code == 401
+
+@allure.feature("认证")
+@allure.story("签名 token")
+def test_signed_tokens_verified_across_apps(tmp_path):
+    """测试签名模式下一个节点签发的 token 在共用密钥的其他节点都能校验，篡改、换密钥或吊销后被拒绝"""
+    import base64
+
+    node = {"storage": "sqlite", "db": str(tmp_path / "signed.db"), "token_mode": "signed",
+            "token_secret": "test-secret"}
+    with in_process_app(node) as node_a, in_process_app(node) as node_b, \
+            in_process_app({**node, "token_secret": "other-secret"}) as stranger:
+        def protected(session, token):
+            return session.get("http://testserver/protected", headers={"Authorization": f"Bearer {token}"})
+
+        with allure.step("登录得到签名 token，payload 中带用户名、角色和过期时间"):
+            token = node_a.post("http://testserver/login", json={"username": "vip", "password": "vip888"}).json()["token"]
+            payload, signature = token.split(".")
+            claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+            assert claims["sub"] == "vip" and claims["role"] == "vip" and claims["exp"] > time.time()
+
+        with allure.step("两个节点都校验通过，用户信息与不透明 token 的形状相同"):
+            responses = [protected(session, token) for session in (node_a, node_b)]
+            assert [r.status_code for r in responses] == [200, 200]
+            assert set(responses[1].json()["user"]) == {"username", "role", "name", "expires"}
+
+        with allure.step("篡改 payload 或签名、或者密钥不同的节点都拒绝"):
+            forged = base64.urlsafe_b64encode(json.dumps({**claims, "role": "admin"}).encode()).rstrip(b"=").decode()
+            assert protected(node_b, f"{forged}.{signature}").status_code == 401
+            assert protected(node_b, f"{payload}.{signature[:-2]}AA").status_code == 401
+            assert protected(stranger, token).status_code == 401
+
+        with allure.step("在一个节点退出登录后，共用数据库的另一个节点也拒绝该 token"):
+            logout = node_b.post("http://testserver/logout", headers={"Authorization": f"Bearer {token}"})
+            assert logout.status_code == 200
+            assert [protected(session, token).status_code for session in (node_a, node_b)] == [401, 401]
+
+def token_repo(backend, tmp_path, name="tokens.db"):
+    """空的 tokens 仓库：内存表，或 tmp_path 下 sqlite 库里的表"""
+    from store import SCHEMA, Table
+    from sqlite_store import SQLiteDatabase, SQLiteTable
+
+    if backend == "memory":
+        return Table(**SCHEMA["tokens"])
+    return SQLiteTable(SQLiteDatabase(str(tmp_path / name)), "tokens", **SCHEMA["tokens"])
+
+
+@allure.feature("认证")
+@allure.story("token 有效期")
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_tokens_expire_and_oldest_evicted(tmp_path, backend):
+    """测试 token 过期后不能再用，数量超出上限时挤掉最早签发的，/metrics 给出对应计数"""
+    from token_store import TokenStore
+
+    now = [1700000000.0]
+    tokens = TokenStore(token_repo(backend, tmp_path), ttl=2, max_tokens=3, clock=lambda: now[0], background=False)
+
+    with allure.step("依次签发 4 个 token，上限为 3"):
+        for i in range(4):
+            tokens.issue(f"t{i}", {"username": "test"})
+
+    with allure.step("最早签发的 token 被挤掉，其余可用"):
+        assert [tokens.get(f"t{i}") is not None for i in range(4)] == [False, True, True, True]
+
+    with allure.step("超过有效期后取用时失效，其余由清理删除"):
+        now[0] += 2.1
+        assert tokens.get("t1") is None
+        assert tokens.sweep() == 2
+        assert tokens.stats() == {"live": 0, "expired": 3, "evicted": 1}
+
+    with allure.step("/metrics 中的 token 计数"):
+        client.post(f"{BASE_URL}/login", json={"username": "test", "password": "test123"})
+        metrics = client.get(f"{BASE_URL}/metrics").text
+        assert "api_tokens_live " in metrics
+        assert 'api_tokens_removed_total{reason="evicted"} ' in metrics
+        assert 'api_tokens_removed_total{reason="expired"} ' in metrics
+
+@allure.feature("认证")
+@allure.story("token 有效期")
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_token_eviction_skips_removed_tokens(tmp_path, backend):
+    """测试已退出登录的 token 不算在挤掉的名额里，保存的 token 数不超过上限"""
+    from token_store import TokenStore
+
+    tokens = TokenStore(token_repo(backend, tmp_path), max_tokens=3, background=False)
+    with allure.step("签发 3 个后退出登录最早的 2 个"):
+        for i in range(3):
+            tokens.issue(f"t{i}", {"username": "test"})
+        tokens.delete("t0")
+        tokens.delete("t1")
+
+    with allure.step("再签发 3 个，只挤掉 t2"):
+        for i in range(3, 6):
+            tokens.issue(f"t{i}", {"username": "test"})
+        assert sorted(row["token"] for row in tokens) == ["t3", "t4", "t5"]
+        assert tokens.stats() == {"live": 3, "expired": 0, "evicted": 1}
+
+@allure.feature("认证")
+@allure.story("token 有效期")
+def test_token_cap_shared_by_processes_on_one_db(tmp_path):
+    """测试共用一个 sqlite 库的多个 TokenStore(多个工作进程)按全局计算上限、最早优先挤掉和过期清理"""
+    from token_store import TokenStore
+
+    now = [1700000000.0]
+    workers = [TokenStore(token_repo("sqlite", tmp_path), ttl=10, max_tokens=3, clock=lambda: now[0],
+                          background=False) for _ in range(2)]
+
+    with allure.step("两个进程交替签发 4 个 token，全局只留最新的 3 个"):
+        for i in range(4):
+            now[0] += 1
+            workers[i % 2].issue(f"t{i}", {"username": "test"})
+        assert sorted(row["token"] for row in workers[0]) == ["t1", "t2", "t3"]
+        assert [worker.stats()["live"] for worker in workers] == [3, 3]
+
+    with allure.step("一个进程的清理也删除另一个进程签发的过期 token"):
+        now[0] += 9.5
+        assert workers[0].sweep() == 2
+        assert [row["token"] for row in workers[1]] == ["t3"]
+        assert workers[0].stats() == {"live": 1, "expired": 2, "evicted": 0}
+        assert workers[1].stats() == {"live": 1, "expired": 0, "evicted": 1}
+
+
+@allure.feature("认证")
+@allure.story("token 有效期")
+def test_token_store_after_fork(tmp_path):
+    """测试 fork 时另一个线程正持有锁，子进程调用 after_fork 后仍能签发，并重新启动清理线程"""
+    from store import open_storage
+
+    storage = open_storage("sqlite", str(tmp_path / "fork.db"), sweep_interval=0.05)
+    storage.tokens.issue("parent", {"username": "test"})
+    storage.tokens._lock.acquire()
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            storage.tokens.after_fork()
+            storage.revocations.after_fork()
+            storage.tokens.issue("child", {"username": "test"})
+            storage.tokens.issue("stale", {"username": "test"}, expires=time.time() - 1)
+            deadline = time.time() + 5
+            while storage.tokens.repo.get("stale") is not None and time.time() < deadline:
+                time.sleep(0.01)
+            code = 0 if storage.tokens.repo.get("stale") is None else 3
+        finally:
+            os._exit(code)
+    storage.tokens._lock.release()
+    try:
+        deadline = time.time() + 15
+        while (status := os.waitpid(pid, os.WNOHANG))[0] == 0 and time.time() < deadline:
+            time.sleep(0.05)
+        if status[0] == 0:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        assert status[0] == pid and os.waitstatus_to_exitcode(status[1]) == 0
+        assert sorted(row["token"] for row in storage.tokens) == ["child", "parent"]
+    finally:
+        storage.close()
+
+
+@allure.feature("认证")
+@allure.story("token 有效期")
+def test_token_counts_follow_snapshot_restore():
+    """测试恢复快照后 token 计数和上限按恢复后的数据计算"""
+    from store import open_storage
+
+    storage = open_storage("memory", max_tokens=3, background=False)
+    with allure.step("保存只有 1 个 token 的快照，再签发到上限"):
+        storage.tokens.issue("t0", {"username": "test"})
+        snap = storage.snapshot()
+        for i in range(1, 4):
+            storage.tokens.issue(f"t{i}", {"username": "test"})
+        assert storage.tokens.stats()["live"] == 3
+
+    with allure.step("恢复快照后只有 t0，再签发 3 个时挤掉 t0"):
+        storage.restore(snap)
+        assert storage.tokens.stats()["live"] == 1
+        for i in range(4, 7):
+            storage.tokens.issue(f"t{i}", {"username": "test"})
+        assert sorted(row["token"] for row in storage.tokens) == ["t4", "t5", "t6"]
+
+@allure.feature("认证")
+@allure.story("签名 token")
+def test_revoked_token_not_evicted_by_token_cap():
+    """测试登录、退出登录的 token 超出数量上限后，已吊销的签名 token 仍被拒绝"""
+    from signed_tokens import RevocationList, TokenSigner
+    from store import open_storage
+
+    storage = open_storage("memory", max_tokens=3, background=False)
+    signer = TokenSigner("test-secret", revocations=RevocationList(storage.revocations))
+    with allure.step("签发并吊销一个签名 token"):
+        revoked = signer.issue("test", "user", "测试用户")
+        signer.revoke(revoked)
+        assert signer.verify(revoked) is None
+
+    with allure.step("之后大量登录、退出登录，数量远超上限"):
+        for i in range(10):
+            storage.tokens.issue(f"opaque{i}", {"username": "test"})
+            signer.revoke(signer.issue(f"user{i}", "user", "测试用户"))
+        assert storage.tokens.stats()["live"] == 3
+
+    with allure.step("最早吊销的 token 仍被拒绝"):
+        assert signer.verify(revoked) is None
+        assert storage.revocations.stats()["live"] == 11
+
 # ==================== 商品管理测试 ====================
 
 @allure.feature("商品管理")
@@ -472,7 +861,7 @@ def test_protected_endpoint_invalid_token():
 def test_get_products():
     """测试获取商品列表"""
     with allure.step("请求商品列表"):
-        response = requests.get(f"{BASE_URL}/products")
+        response = client.get(f"{BASE_URL}/products")
     
     with allure.step("验证响应"):
         assert response.status_code == 200
@@ -486,7 +875,7 @@ def test_get_products():
 def test_get_products_by_category():
     """测试按分类过滤商品"""
     with allure.step("获取手机分类商品"):
-        response = requests.get(f"{BASE_URL}/products", params={"category": "手机"})
+        response = client.get(f"{BASE_URL}/products", params={"category": "手机"})
     
     with allure.step("验证结果"):
         assert response.status_code == 200
@@ -500,12 +889,28 @@ def test_get_products_by_category():
 def test_get_products_by_status():
     """测试按状态过滤商品"""
     with allure.step("获取在售商品"):
-        response = requests.get(f"{BASE_URL}/products", params={"status": "on_sale"})
+        response = client.get(f"{BASE_URL}/products", params={"status": "on_sale"})
+    
+    with allure.step("验证结果"):
+        assert response.status_code == 200
+        data = response.json()
+        for product in data["data"]:
+            assert product["status"] == "on_sale"
+
+@allure.feature("商品管理")
+@allure.story("获取商品列表")
+def test_get_products_combined_filters():
+    """测试分类和状态组合过滤，total 与过滤结果一致"""
+    with allure.step("获取在售的手机商品"):
+        response = client.get(f"{BASE_URL}/products", params={"category": "手机", "status": "on_sale", "limit": 100})
     
     with allure.step("验证结果"):
         assert response.status_code == 200
         data = response.json()
+        assert len(data["data"]) >= 1
+        assert data["total"] == len(data["data"])
         for product in data["data"]:
+            assert product["category"] == "手机"
             assert product["status"] == "on_sale"
 
 @allure.feature("商品管理")
@@ -514,7 +919,7 @@ def test_get_single_product():
     """测试获取单个商品"""
     product_id = 1
     with allure.step(f"获取商品 ID {product_id}"):
-        response = requests.get(f"{BASE_URL}/products/{product_id}")
+        response = client.get(f"{BASE_URL}/products/{product_id}")
     
     with allure.step("验证商品信息"):
         assert response.status_code == 200
@@ -528,9 +933,108 @@ def test_get_single_product():
 def test_get_product_not_found():
     """测试获取不存在的商品"""
     with allure.step("获取不存在的商品"):
-        response = requests.get(f"{BASE_URL}/products/9999")
+        response = client.get(f"{BASE_URL}/products/9999")
     assert response.status_code == 404
 
+@allure.feature("商品管理")
+@allure.story("获取商品列表")
+def test_products_json_bytes_match_stdlib():
+    """测试列表响应与标准库 json 序列化的结果逐字节相同(中文转义、8999.0)"""
+    for path in ("/products", "/orders", "/users"):
+        with allure.step(f"请求 {path}"):
+            response = client.get(f"{BASE_URL}{path}", params={"limit": 100})
+            assert response.status_code == 200
+            data = response.json()
+
+        with allure.step("与 json.dumps(sort_keys=True) 的紧凑或缩进输出一致"):
+            expected = [json.dumps(data, sort_keys=True, separators=(",", ":")) + "\n",
+                        json.dumps(data, sort_keys=True, indent=2) + "\n"]
+            assert response.content.decode("ascii") in expected
+
+    with allure.step("商品价格保留 .0，中文按 \\uXXXX 转义"):
+        text = client.get(f"{BASE_URL}/products/1").text
+        assert "8999.0" in text
+        assert "\\u624b\\u673a" in text  # 手机
+
+@allure.feature("商品管理")
+@allure.story("条件请求")
+def test_conditional_get_with_etag():
+    """测试 ETag / If-None-Match：数据不变时返回 304，写入后 ETag 改变"""
+    with allure.step("首次请求返回强 ETag"):
+        first = client.get(f"{BASE_URL}/products", params={"status": "on_sale", "limit": 3})
+        assert first.status_code == 200
+        etag = first.headers["ETag"]
+        assert etag.startswith('"') and not etag.startswith('W/')
+
+    with allure.step("参数顺序不同的同一查询得到相同的 ETag 和响应体"):
+        again = client.get(f"{BASE_URL}/products?limit=3&status=on_sale")
+        assert again.headers["ETag"] == etag
+        assert again.content == first.content
+
+    with allure.step("带 If-None-Match 请求返回 304 且没有响应体"):
+        response = client.get(f"{BASE_URL}/products", params={"status": "on_sale", "limit": 3},
+                                headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["ETag"] == etag
+
+    with allure.step("单个商品同样支持条件请求"):
+        product = client.get(f"{BASE_URL}/products/1")
+        response = client.get(f"{BASE_URL}/products/1", headers={"If-None-Match": product.headers["ETag"]})
+        assert response.status_code == 304
+
+    with allure.step("创建用户后用户列表的旧 ETag 失效"):
+        users = client.get(f"{BASE_URL}/users", params={"limit": 100})
+        client.post(f"{BASE_URL}/users", json={"name": "缓存用户", "email": "cache@test.com"})
+        response = client.get(f"{BASE_URL}/users", params={"limit": 100},
+                                headers={"If-None-Match": users.headers["ETag"]})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != users.headers["ETag"]
+        assert response.json()["total"] == users.json()["total"] + 1
+
+    with allure.step("重置数据后恢复为原来的内容"):
+        client.post(f"{BASE_URL}/test/reset")
+        response = client.get(f"{BASE_URL}/users", params={"limit": 100})
+        assert response.headers["ETag"] == users.headers["ETag"]
+
+@allure.feature("用户管理")
+@allure.story("响应压缩")
+def test_response_compression():
+    """测试按 Accept-Encoding 压缩大响应，小响应不压缩"""
+    with allure.step("批量创建 50 个用户，使用户列表足够大"):
+        items = [{"name": f"压缩用户{i}", "email": f"gzip{i}@test.com"} for i in range(50)]
+        assert client.post(f"{BASE_URL}/users/batch", json=items).status_code == 201
+    params = {"limit": 100}
+
+    with allure.step("不接受压缩时返回原始响应体"):
+        plain = client.get(f"{BASE_URL}/users", params=params, headers={"Accept-Encoding": "identity"})
+        assert "Content-Encoding" not in plain.headers
+        assert "Accept-Encoding" in plain.headers["Vary"]
+
+    with allure.step("gzip：内容相同，传输字节更少，ETag 带编码后缀"):
+        response = client.get(f"{BASE_URL}/users", params=params, headers={"Accept-Encoding": "gzip"},
+                                stream=True)
+        wire = response.raw.read(decode_content=False)
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert len(wire) < len(plain.content) / 2
+        assert json.loads(gzip.decompress(wire)) == plain.json()
+        etag = response.headers["ETag"]
+        assert etag == plain.headers["ETag"][:-1] + '-gzip"'
+
+    with allure.step("用压缩表示的 ETag 做条件请求返回 304"):
+        response = client.get(f"{BASE_URL}/users", params=params,
+                                headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+        assert response.status_code == 304
+
+    with allure.step("deflate 同样可用"):
+        response = client.get(f"{BASE_URL}/users", params=params, headers={"Accept-Encoding": "deflate"})
+        assert response.headers["Content-Encoding"] == "deflate"
+        assert response.json() == plain.json()
+
+    with allure.step("小于阈值的响应不压缩"):
+        response = client.get(f"{BASE_URL}/products/1", headers={"Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in response.headers
+
 # ==================== 订单管理测试 ====================
 
 @allure.feature("订单管理")
@@ -538,7 +1042,7 @@ def test_get_product_not_found():
 def test_get_orders():
     """测试获取订单列表"""
     with allure.step("请求订单列表"):
-        response = requests.get(f"{BASE_URL}/orders")
+        response = client.get(f"{BASE_URL}/orders")
     
     with allure.step("验证响应"):
         assert response.status_code == 200
@@ -546,12 +1050,25 @@ def test_get_orders():
         assert "data" in data
         assert len(data["data"]) > 0
 
+@allure.feature("订单管理")
+@allure.story("获取订单列表")
+def test_get_orders_pagination():
+    """测试订单列表分页，单页大小有上限"""
+    with allure.step("每页 2 条"):
+        data = client.get(f"{BASE_URL}/orders", params={"limit": 2}).json()
+        assert len(data["data"]) == 2
+        assert data["next_cursor"]
+
+    with allure.step("limit 超过上限时被截断"):
+        data = client.get(f"{BASE_URL}/orders", params={"limit": 100000}).json()
+        assert data["limit"] == 1000
+
 @allure.feature("订单管理")
 @allure.story("获取订单列表")
 def test_get_orders_by_user():
     """测试按用户ID过滤订单"""
     with allure.step("获取用户1的订单"):
-        response = requests.get(f"{BASE_URL}/orders", params={"user_id": 1})
+        response = client.get(f"{BASE_URL}/orders", params={"user_id": 1})
     
     with allure.step("验证结果"):
         assert response.status_code == 200
@@ -564,7 +1081,7 @@ def test_get_orders_by_user():
 def test_get_orders_by_status():
     """测试按状态过滤订单"""
     with allure.step("获取已完成订单"):
-        response = requests.get(f"{BASE_URL}/orders", params={"status": "completed"})
+        response = client.get(f"{BASE_URL}/orders", params={"status": "completed"})
     
     with allure.step("验证结果"):
         assert response.status_code == 200
@@ -578,7 +1095,7 @@ def test_get_single_order():
     """测试获取单个订单"""
     order_id = "ORD20231201001"
     with allure.step(f"获取订单 {order_id}"):
-        response = requests.get(f"{BASE_URL}/orders/{order_id}")
+        response = client.get(f"{BASE_URL}/orders/{order_id}")
     
     with allure.step("验证订单信息"):
         assert response.status_code == 200
@@ -597,7 +1114,7 @@ def test_create_order():
         "quantity": 2
     }
     with allure.step("创建新订单"):
-        response = requests.post(f"{BASE_URL}/orders", json=order_data)
+        response = client.post(f"{BASE_URL}/orders", json=order_data)
     
     with allure.step("验证订单创建成功"):
         assert response.status_code == 201
@@ -609,6 +1126,60 @@ def test_create_order():
         assert data["status"] == "pending"
         assert "id" in data
 
+@allure.feature("订单管理")
+@allure.story("创建订单")
+def test_created_order_reads_back_unchanged():
+    """测试新建订单读回时与创建响应完全一致(包括非整数金额)"""
+    for quantity in (3, 1):
+        with allure.step(f"创建数量为 {quantity} 的订单"):
+            created = client.post(f"{BASE_URL}/orders", json={"user_id": 2, "product_id": 3, "quantity": quantity})
+            assert created.status_code == 201
+
+        with allure.step("按 ID 和列表读取，验证字段与类型不变"):
+            order = created.json()
+            assert client.get(f"{BASE_URL}/orders/{order['id']}").json() == order
+            listed = client.get(f"{BASE_URL}/orders", params={"user_id": 2, "limit": 100}).json()["data"]
+            assert order in listed
+
+@allure.feature("订单管理")
+@allure.story("列存")
+def test_columnar_orders_reclaim_slots():
+    """测试订单列存表更新、删除后回收旧 slot，恢复快照(重置数据)后改用新的列数组"""
+    from columnar import COLUMNAR_SCHEMA, COMPACT_MIN_SLOTS, ColumnarTable
+    from store import SCHEMA
+
+    orders = [{"id": f"ORD{i}", "user_id": i % 7, "product_id": 1, "quantity": 1, "total": 9.5,
+               "status": "pending", "created_at": "2023-12-01 10:00:00"} for i in range(500)]
+    table = ColumnarTable(orders, columns=COLUMNAR_SCHEMA["orders"], **SCHEMA["orders"])
+    snap = table.snapshot()
+
+    with allure.step("每个订单更新 6 次，slot 数不超过活行数的两倍"):
+        for n in range(6):
+            for order in orders:
+                table.update(order["id"], {"quantity": n + 2})
+            assert table.slot_count() <= max(COMPACT_MIN_SLOTS, 2 * len(table))
+        assert table.get("ORD7")["quantity"] == 7
+        assert table.page({"user_id": 3}, limit=1000)[0] == [
+            {**order, "quantity": 7} for order in orders if order["user_id"] == 3]
+
+    with allure.step("删除大部分订单后继续更新，slot 数跟着活行数下降"):
+        for order in orders[50:]:
+            table.delete(order["id"])
+        for n in range(30):
+            for order in orders[:50]:
+                table.update(order["id"], {"quantity": n})
+        assert len(table) == 50 and table.slot_count() <= COMPACT_MIN_SLOTS
+        assert [row["quantity"] for row in table] == [29] * 50
+
+    with allure.step("恢复快照后只保留快照用到的 slot，之后的写入不进入快照的列数组"):
+        snapshot_slots = len(snap[0].columns.seqs)
+        table.restore(snap)
+        assert table.slot_count() == 500
+        table.update("ORD1", {"quantity": 99})
+        assert table.slot_count() == 501 and len(snap[0].columns.seqs) == snapshot_slots
+        table.restore(snap)
+        assert table.slot_count() == 500 and list(table) == orders
+
 @allure.feature("订单管理")
 @allure.story("创建订单")
 def test_create_order_invalid_product():
@@ -619,19 +1190,165 @@ def test_create_order_invalid_product():
         "quantity": 1
     }
     with allure.step("使用不存在的商品创建订单"):
-        response = requests.post(f"{BASE_URL}/orders", json=order_data)
+        response = client.post(f"{BASE_URL}/orders", json=order_data)
     
     with allure.step("验证创建失败"):
         assert response.status_code == 400
 
+@allure.feature("订单管理")
+@allure.story("请求体校验")
+@pytest.mark.parametrize("path, body, error_code", [
+    ("/orders", {"user_id": 1, "product_id": 1, "quantity": "abc"}, "INVALID_QUANTITY_TYPE"),
+    ("/orders", {"user_id": 1, "product_id": 1, "quantity": 1.5}, "INVALID_QUANTITY_TYPE"),
+    ("/orders", {"user_id": 1, "product_id": 1, "quantity": 0}, "QUANTITY_TOO_SMALL"),
+    ("/orders", {"user_id": 1, "quantity": 1}, "MISSING_PRODUCT_ID"),
+    ("/orders", {"user_id": True, "product_id": 1}, "INVALID_USER_ID_TYPE"),
+    ("/orders", [1, 2], "INVALID_BODY_TYPE"),
+    ("/users", {"name": "缺少邮箱"}, "MISSING_EMAIL"),
+    ("/users", {"name": 123, "email": "a@example.com"}, "INVALID_NAME_TYPE"),
+])
+def test_request_body_validated_by_schema(path, body, error_code):
+    """测试请求体按 Swagger schema 校验：不合法时返回 400 和对应的 error_code，而不是 500"""
+    with allure.step(f"POST {path} {body}"):
+        response = client.post(f"{BASE_URL}{path}", json=body)
+
+    with allure.step(f"验证返回 400 / {error_code}"):
+        assert response.status_code == 400
+        data = response.json()
+        assert data["success"] is False
+        assert data["error_code"] == error_code
+
+@allure.feature("订单管理")
+@allure.story("请求体校验")
+def test_batch_items_validated_by_schema():
+    """测试批量接口逐条按 schema 校验，不合法的条目在结果里带 error_code"""
+    with allure.step("提交 3 条订单，其中 2 条数量不合法"):
+        items = [{"user_id": 1, "product_id": 3}, {"user_id": 1, "product_id": 3, "quantity": "x"}, None]
+        response = client.post(f"{BASE_URL}/orders/batch", json=items)
+
+    with allure.step("验证逐条结果"):
+        assert response.status_code == 207
+        results = response.json()["results"]
+        assert results[0]["status"] == 201
+        assert results[1]["error_code"] == "INVALID_QUANTITY_TYPE"
+        assert results[2]["error_code"] == "NULL_ITEM"
+
+@allure.feature("部署")
+@allure.story("应用工厂")
+def test_apps_with_different_storage_coexist(tmp_path):
+    """测试同一进程里的多个 app 各有自己的存储和响应缓存，版本号相同的缓存不会串到另一个 app"""
+    sqlite = {"storage": "sqlite", "db": str(tmp_path / "apps.db")}
+    with in_process_app({"storage": "memory"}) as first, in_process_app(sqlite) as second, \
+            in_process_app({"storage": "memory"}) as third:
+        def names(session):
+            return [u["name"] for u in session.get("http://testserver/users?limit=100").json()["data"]]
+
+        with allure.step("每个 app 创建一个用户并读取列表(进入各自的响应缓存)"):
+            for session, name in ((first, "Alpha"), (second, "Gamma"), (third, "Beta")):
+                session.post("http://testserver/users", json={"name": name, "email": f"{name}@test.com"})
+                assert name in names(session)
+
+        with allure.step("列表只包含自己的数据，两个内存 app 的版本号相同也互不影响"):
+            assert "Beta" not in names(first) and "Gamma" not in names(first)
+            assert "Alpha" not in names(second) and "Beta" not in names(second)
+            assert "Alpha" not in names(third) and "Gamma" not in names(third)
+
+@allure.feature("部署")
+@allure.story("应用工厂")
+def test_closed_apps_release_request_logs():
+    """测试反复创建、关闭 app 后，进程退出时要关闭的请求日志不会越积越多"""
+    import request_log
+
+    before = len(request_log._open_logs)
+    for _ in range(20):
+        with in_process_app({}) as session:
+            session.get("http://testserver/users")
+    assert len(request_log._open_logs) == before
+
+
+@allure.feature("订单管理")
+@allure.story("请求体校验")
+def test_non_finite_numbers_rejected():
+    """测试 NaN、Infinity 不会绕过类型和范围检查"""
+    from validation import compile_schema
+
+    with allure.step("POST /orders 数量为 NaN"):
+        response = client.post(f"{BASE_URL}/orders", data='{"user_id": 1, "product_id": 1, "quantity": NaN}',
+                               headers={"Content-Type": "application/json"})
+        assert response.status_code == 400
+        assert response.json()["error_code"] == "INVALID_QUANTITY_TYPE"
+
+    with allure.step("number 字段的 NaN、±Infinity 在范围检查之前被拒绝"):
+        validate = compile_schema({"type": "object", "properties": {"price": {"type": "number", "minimum": 0}}})
+        for value in (float("nan"), float("inf"), float("-inf")):
+            assert validate({"price": value})[0] == "INVALID_PRICE_VALUE"
+        assert validate({"price": 1.5}) is None
+        assert validate({"price": 10 ** 400}) is None
+        assert validate({}) is None
+
 # ==================== 测试辅助接口测试 ====================
 
+@allure.feature("订单管理")
+@allure.story("订单统计")
+def test_order_stats_follow_new_orders():
+    """测试订单统计随新建订单增量更新，并与全量重算一致"""
+    with allure.step("记录当前统计"):
+        before = client.get(f"{BASE_URL}/orders/stats").json()
+        pending = {g["status"]: g for g in before["by_status"]}["pending"]
+
+    with allure.step("创建 1 个单独订单和 2 个批量订单"):
+        client.post(f"{BASE_URL}/orders", json={"user_id": 3, "product_id": 1, "quantity": 2})
+        client.post(f"{BASE_URL}/orders/batch", json=[{"user_id": 3, "product_id": 3}, {"user_id": 4, "product_id": 3}])
+
+    with allure.step("验证总数、金额与分组"):
+        after = client.get(f"{BASE_URL}/orders/stats").json()
+        assert after["count"] == before["count"] + 3
+        assert after["total"] == before["total"] + 8999.00 * 2 + 1899.00 * 2
+        by_status = {g["status"]: g for g in after["by_status"]}
+        assert by_status["pending"]["count"] == pending["count"] + 3
+        by_user = {g["user_id"]: g for g in after["by_user_id"]}
+        assert by_user[3]["count"] == 3
+
+    with allure.step("一致性校验通过"):
+        check = client.get(f"{BASE_URL}/orders/stats/check").json()
+        assert check["consistent"] is True
+        assert check["checked"] == after["count"]
+
+@allure.feature("订单管理")
+@allure.story("批量创建订单")
+def test_create_orders_batch():
+    """测试批量创建订单与按 ID 批量查询订单、商品"""
+    items = [
+        {"user_id": 1, "product_id": 1, "quantity": 2},
+        {"user_id": 1, "product_id": 99999},
+        {"user_id": 2, "product_id": 3},
+    ]
+    with allure.step("提交 3 条，其中 1 条商品不存在"):
+        response = client.post(f"{BASE_URL}/orders/batch", json=items)
+
+    with allure.step("验证逐条结果"):
+        assert response.status_code == 207
+        results = response.json()["results"]
+        assert results[1] == {"index": 1, "status": 400, "error": "商品不存在"}
+        assert results[0]["data"]["total"] == 8999.00 * 2
+        ids = [results[0]["data"]["id"], results[2]["data"]["id"]]
+        assert len(set(ids)) == 2
+
+    with allure.step("按 ids 批量查询订单"):
+        data = client.get(f"{BASE_URL}/orders", params={"ids": ",".join(ids)}).json()
+        assert data["data"] == [results[0]["data"], results[2]["data"]]
+
+    with allure.step("按 ids 批量查询商品，非法 ID 返回 400"):
+        products = client.get(f"{BASE_URL}/products", params={"ids": "3,1"}).json()["data"]
+        assert [p["id"] for p in products] == [3, 1]
+        assert client.get(f"{BASE_URL}/products", params={"ids": "1,abc"}).status_code == 400
+
 @allure.feature("测试辅助")
 @allure.story("获取测试账号")
 def test_get_test_accounts():
     """测试获取所有测试账号信息"""
     with allure.step("请求测试账号列表"):
-        response = requests.get(f"{BASE_URL}/test/accounts")
+        response = client.get(f"{BASE_URL}/test/accounts")
     
     with allure.step("验证响应"):
         assert response.status_code == 200
@@ -650,12 +1367,46 @@ def test_get_test_accounts():
 def test_reset_data():
     """测试重置数据功能"""
     with allure.step("重置所有数据"):
-        response = requests.post(f"{BASE_URL}/test/reset")
+        response = client.post(f"{BASE_URL}/test/reset")
     
     with allure.step("验证重置成功"):
         assert response.status_code == 200
         assert "message" in response.json()
 
+@allure.feature("测试辅助")
+@allure.story("重置数据")
+def test_reset_restores_all_collections():
+    """测试重置会恢复全部用户、商品和订单"""
+    with allure.step("修改用户、商品和订单"):
+        client.delete(f"{BASE_URL}/users/7")
+        client.post(f"{BASE_URL}/users", json={"name": "临时用户", "email": "tmp@test.com"})
+        order = client.post(f"{BASE_URL}/orders", json={"user_id": 1, "product_id": 1}).json()
+
+    with allure.step("重置后验证数据与启动时一致"):
+        client.post(f"{BASE_URL}/test/reset")
+        users = client.get(f"{BASE_URL}/users", params={"limit": 100}).json()
+        assert [u["id"] for u in users["data"]] == [1, 2, 3, 4, 5, 6, 7]
+        assert client.get(f"{BASE_URL}/orders/{order['id']}").status_code == 404
+        assert client.get(f"{BASE_URL}/products").json()["total"] == 8
+
+@allure.feature("测试辅助")
+@allure.story("数据快照")
+def test_snapshot_and_restore():
+    """测试命名快照的保存与反复恢复"""
+    with allure.step("新增用户后保存快照"):
+        user = client.post(f"{BASE_URL}/users", json={"name": "快照用户", "email": "snap@test.com"}).json()
+        response = client.post(f"{BASE_URL}/test/snapshot/with_user")
+        assert response.status_code == 200
+
+    for _ in range(2):
+        with allure.step("删除用户后恢复快照"):
+            client.delete(f"{BASE_URL}/users/{user['id']}")
+            assert client.post(f"{BASE_URL}/test/restore/with_user").status_code == 200
+            assert client.get(f"{BASE_URL}/users/{user['id']}").json()["name"] == "快照用户"
+
+    with allure.step("恢复不存在的快照返回 404"):
+        assert client.post(f"{BASE_URL}/test/restore/no_such_snapshot").status_code == 404
+
 # ==================== 端到端流程测试 ====================
 
 @allure.feature("端到端测试")
@@ -665,14 +1416,14 @@ def test_e2e_shopping_flow():
     """端到端测试：完整购物流程"""
     # 1. 登录
     with allure.step("步骤1: 用户登录"):
-        login_resp = requests.post(f"{BASE_URL}/login", json={"username": "user1", "password": "123456"})
+        login_resp = client.post(f"{BASE_URL}/login", json={"username": "user1", "password": "123456"})
         assert login_resp.status_code == 200
         token = login_resp.json()["token"]
         allure.attach(token, "登录Token", allure.attachment_type.TEXT)
     
     # 2. 浏览商品
     with allure.step("步骤2: 浏览手机商品"):
-        products_resp = requests.get(f"{BASE_URL}/products", params={"category": "手机"})
+        products_resp = client.get(f"{BASE_URL}/products", params={"category": "手机"})
         assert products_resp.status_code == 200
         products = products_resp.json()["data"]
         assert len(products) > 0
@@ -681,7 +1432,7 @@ def test_e2e_shopping_flow():
     
     # 3. 查看商品详情
     with allure.step("步骤3: 查看商品详情"):
-        detail_resp = requests.get(f"{BASE_URL}/products/{selected_product['id']}")
+        detail_resp = client.get(f"{BASE_URL}/products/{selected_product['id']}")
         assert detail_resp.status_code == 200
     
     # 4. 创建订单
@@ -691,14 +1442,14 @@ def test_e2e_shopping_flow():
             "product_id": selected_product["id"],
             "quantity": 1
         }
-        order_resp = requests.post(f"{BASE_URL}/orders", json=order_data)
+        order_resp = client.post(f"{BASE_URL}/orders", json=order_data)
         assert order_resp.status_code == 201
         order = order_resp.json()
         allure.attach(str(order), "创建的订单", allure.attachment_type.TEXT)
     
     # 5. 查看订单
     with allure.step("步骤5: 查看订单详情"):
-        order_detail_resp = requests.get(f"{BASE_URL}/orders/{order['id']}")
+        order_detail_resp = client.get(f"{BASE_URL}/orders/{order['id']}")
         assert order_detail_resp.status_code == 200
         assert order_detail_resp.json()["status"] == "pending"
 
@@ -716,10 +1467,291 @@ def test_e2e_multiple_accounts():
     
     for account in test_accounts:
         with allure.step(f"测试账号: {account['username']}"):
-            response = requests.post(f"{BASE_URL}/login", json={
+            response = client.post(f"{BASE_URL}/login", json={
                 "username": account["username"],
                 "password": account["password"]
             })
             assert response.status_code == 200, f"账号 {account['username']} 登录失败"
             data = response.json()
             assert data["user"]["role"] == account["expected_role"], f"账号 {account['username']} 角色不匹配"
+
+# ==================== 并发测试 ====================
+
+@allure.feature("并发测试")
+@allure.story("并发读写用户")
+def test_concurrent_user_writes():
+    """并发测试：32 个线程同时创建/更新/删除/列表，ID 不重复、更新不丢失"""
+    workers = 32
+
+    def worker(i):
+        session = new_session()
+        created = session.post(f"{BASE_URL}/users", json={"name": f"并发{i}", "email": f"c{i}@test.com"})
+        assert created.status_code == 201
+        user_id = created.json()["id"]
+        assert session.put(f"{BASE_URL}/users/{target_id}", json={f"f{i}": i}).status_code == 200
+        assert session.get(f"{BASE_URL}/users", params={"limit": 50}).status_code == 200
+        if i % 2:
+            assert session.delete(f"{BASE_URL}/users/{user_id}").status_code == 200
+        return user_id
+
+    with allure.step("创建被并发更新的用户"):
+        target_id = client.post(f"{BASE_URL}/users", json={"name": "并发目标", "email": "target@test.com"}).json()["id"]
+
+    with allure.step(f"{workers} 个线程并发读写"):
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            ids = list(pool.map(worker, range(workers)))
+
+    with allure.step("验证分配的 ID 互不相同且不与已有用户重复"):
+        assert len(set(ids)) == workers
+        assert target_id not in ids
+
+    with allure.step("验证每个线程的更新都保留了下来"):
+        user = client.get(f"{BASE_URL}/users/{target_id}").json()
+        for i in range(workers):
+            assert user[f"f{i}"] == i
+
+    with allure.step("验证删除生效、未删除的用户可读"):
+        for i, user_id in enumerate(ids):
+            expected = 404 if i % 2 else 200
+            assert client.get(f"{BASE_URL}/users/{user_id}").status_code == expected
+
+# ==================== 接口文档测试 ====================
+
+@allure.feature("接口文档")
+@allure.story("Swagger 规范与静态文件")
+def test_swagger_spec_and_assets_cached():
+    """测试规范带 ETag、支持 304 和压缩，文档页引用的静态文件带版本号且可以长期缓存"""
+    import re
+
+    with allure.step("规范包含所有接口，再次请求返回 304"):
+        spec = client.get(f"{BASE_URL}/apispec_1.json")
+        assert spec.status_code == 200
+        assert {"/users", "/login", "/orders/{order_id}"} <= set(spec.json()["paths"])
+        etag = spec.headers["ETag"]
+        again = client.get(f"{BASE_URL}/apispec_1.json", headers={"If-None-Match": etag})
+        assert again.status_code == 304
+
+    with allure.step("gzip 压缩的规范解压后与原始规范相同"):
+        raw = client.get(f"{BASE_URL}/apispec_1.json", headers={"Accept-Encoding": "gzip"}, stream=True)
+        assert raw.headers["Content-Encoding"] == "gzip"
+        assert gzip.decompress(raw.raw.read()) == spec.content
+
+    with allure.step("文档页引用带版本号的静态文件"):
+        page = client.get(f"{BASE_URL}/apidocs/")
+        assert page.status_code == 200
+        bundle = re.search(r'src="(/flasgger_static/swagger-ui-bundle\.js\?v=\w+)"', page.text).group(1)
+
+    with allure.step("带版本号的静态文件长期缓存，不带版本号的每次验证"):
+        asset = client.get(f"{BASE_URL}{bundle}")
+        assert asset.status_code == 200
+        assert asset.headers["Content-Encoding"] == "gzip"
+        assert "immutable" in asset.headers["Cache-Control"]
+        plain = client.get(f"{BASE_URL}/flasgger_static/swagger-ui-bundle.js", headers={"Accept-Encoding": "identity"})
+        assert plain.headers["Cache-Control"] == "no-cache"
+        assert plain.content == asset.content
+
+# ==================== 监控测试 ====================
+
+@allure.feature("监控")
+@allure.story("Prometheus 指标")
+def test_metrics_count_requests_per_route():
+    """测试 /metrics 按路由规则统计请求数和延迟分位数"""
+    def samples():
+        text = client.get(f"{BASE_URL}/metrics").text
+        result = {}
+        for line in text.splitlines():
+            if line and not line.startswith("#"):
+                name, value = line.rsplit(" ", 1)
+                result[name] = float(value)
+        return result
+
+    counter = 'api_requests_total{method="GET",route="/users/<int:user_id>",status="%s"}'
+    before = samples()
+
+    with allure.step("请求 3 个存在的用户和 2 个不存在的用户"):
+        for user_id in (1, 2, 3, 99998, 99999):
+            client.get(f"{BASE_URL}/users/{user_id}")
+
+    with allure.step("验证计数按状态码累加，延迟分位数有序"):
+        after = samples()
+        assert after[counter % 200] - before.get(counter % 200, 0) == 3
+        assert after[counter % 404] - before.get(counter % 404, 0) == 2
+        labels = 'method="GET",route="/users/<int:user_id>",status_class="2xx"'
+        quantiles = [after[f'api_request_duration_seconds{{{labels},quantile="{q}"}}']
+                     for q in ("0.5", "0.9", "0.99", "0.999")]
+        assert 0 < quantiles[0] <= quantiles[1] <= quantiles[2] <= quantiles[3]
+        assert after[f'api_response_size_bytes_count{{{labels}}}'] >= 3
+        assert after['api_requests_in_flight{method="GET",route="/metrics"}'] == 1
+
+@allure.feature("监控")
+@allure.story("Prometheus 指标")
+def test_metrics_response_size_after_compression():
+    """测试 api_response_size_bytes 统计的是压缩后实际发出的字节数"""
+    with in_process_app({"compress_min_size": 0}) as session:
+        url = "http://testserver/users?limit=100"
+        compressed = session.get(url, headers={"Accept-Encoding": "gzip"})
+        assert compressed.headers["Content-Encoding"] == "gzip"
+        plain = session.get(url, headers={"Accept-Encoding": "identity"})
+        assert "Content-Encoding" not in plain.headers
+        sizes = [int(compressed.headers["Content-Length"]), int(plain.headers["Content-Length"])]
+        assert sizes[0] < sizes[1]
+
+        text = session.get("http://testserver/metrics").text
+        labels = 'method="GET",route="/users",status_class="2xx"'
+        assert f"api_response_size_bytes_sum{{{labels}}} {sum(sizes)}" in text.splitlines()
+
+@allure.feature("监控")
+@allure.story("按请求剖析")
+def test_profile_single_request(tmp_path):
+    """测试 ?__profile 返回热点函数，X-Profile: collapsed 不改变原响应"""
+    with allure.step("?__profile 返回 JSON 剖析报告"):
+        response = client.get(f"{BASE_URL}/users", params={"limit": 2, "__profile": ""})
+        assert response.status_code == 200
+        report = response.json()
+        assert report["path"] == "/users"
+        assert report["status"] == 200
+        assert report["functions"]
+        assert all(f["cumtime_ms"] >= 0 and f["calls"] >= 1 for f in report["functions"])
+
+    with allure.step("X-Profile: collapsed 返回原响应，调用栈文件写到配置的目录"):
+        plain = client.get(f"{BASE_URL}/users", params={"limit": 2})
+        with in_process_app({"profile_dir": str(tmp_path)}) as session:
+            url = "http://testserver/users?limit=2"
+            profiled = session.get(url, headers={"X-Profile": "collapsed"})
+            assert profiled.json() == session.get(url).json()
+        path = profiled.headers["X-Profile-File"]
+        assert os.path.dirname(path) == str(tmp_path) and path.endswith(".folded")
+        os.remove(path)
+
+    with allure.step("不带标记的请求不受影响"):
+        assert "X-Profile-File" not in plain.headers
+        assert plain.json()["limit"] == 2
+
+
+@allure.feature("监控")
+@allure.story("按请求剖析")
+def test_profile_keeps_newest_files(tmp_path):
+    """测试调用栈文件只保留最新的 keep 个"""
+    from profiling import ProfilingMiddleware
+
+    def hello(environ, start_response):
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        return [b"hello"]
+
+    profiler = ProfilingMiddleware(hello, allow="any", directory=str(tmp_path), keep=3)
+    written = []
+    for i in range(5):
+        headers = {}
+        body = profiler({"HTTP_X_PROFILE": "collapsed", "PATH_INFO": f"/p{i}", "REQUEST_METHOD": "GET"},
+                        lambda status, response_headers: headers.update(response_headers))
+        assert body == [b"hello"]
+        written.append(headers["X-Profile-File"])
+        os.utime(written[-1], (1000 + i, 1000 + i))
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(path) for path in written[-3:])
+
+# ==================== 生产模式测试 ====================
+
+@allure.feature("部署")
+@allure.story("多进程生产模式")
+def test_prefork_workers_share_state(tmp_path):
+    """测试多个工作进程共享数据和指标，SIGTERM 后优雅退出"""
+    with running_server("--workers", "3", "--threads", "2", "--db", str(tmp_path / "w.db")) as (url, server):
+        with allure.step("创建的用户在每个工作进程里都能读到"):
+            user = requests.post(f"{url}/users", json={"name": "多进程", "email": "w@test.com"}).json()
+            # 每个请求新建连接，由不同的工作进程处理
+            statuses = [requests.get(f"{url}/users/{user['id']}", headers={"Connection": "close"}).status_code
+                        for _ in range(12)]
+            assert statuses == [200] * 12
+
+        with allure.step("任一进程导出的指标包含所有进程处理的请求"):
+            metrics = requests.get(f"{url}/metrics").text
+            assert 'api_requests_total{method="GET",route="/users/<int:user_id>",status="200"} 12' in metrics
+
+        with allure.step("SIGTERM 后所有进程正常退出"):
+            server.send_signal(signal.SIGTERM)
+            assert server.wait(timeout=15) == 0
+
+
+@allure.feature("部署")
+@allure.story("ASGI 入口")
+def test_asgi_server_keepalive_and_chunked():
+    """测试 ASGI 服务器在同一连接上处理多个请求、接收分块请求体，SIGTERM 后正常退出"""
+    with running_server(script="asgi.py") as (url, server):
+        with allure.step("同一个 keep-alive 连接上连续请求，响应与 WSGI 服务一致"):
+            with requests.Session() as session:
+                responses = [session.get(f"{url}/products/{i}") for i in (1, 2, 99999)]
+                assert [r.status_code for r in responses] == [200, 200, 404]
+                assert responses[0].json() == client.get(f"{BASE_URL}/products/1").json()
+
+        with allure.step("分块传输的请求体"):
+            body = iter(['{"name": "分块", '.encode('utf-8'), b'"email": "chunk@test.com"}'])
+            response = requests.post(f"{url}/users", data=body, headers={"Content-Type": "application/json"})
+            assert response.status_code == 201
+            assert response.json()["email"] == "chunk@test.com"
+
+        with allure.step("SIGTERM 后正常退出"):
+            server.send_signal(signal.SIGTERM)
+            assert server.wait(timeout=15) == 0
+
+# ==================== 流量回放测试 ====================
+
+@allure.feature("测试辅助")
+@allure.story("流量录制与回放")
+def test_traffic_record_and_replay(tmp_path):
+    """测试录制文件轮转后仍能按顺序完整回放"""
+    from traffic import TrafficRecorder, read_records, recorded_files, replay
+
+    path = str(tmp_path / "traffic.jsonl")
+    body = '{"name": "回放用户", "email": "replay@test.com"}'.encode('utf-8')
+    requests_to_record = [
+        ("GET", "/users", "limit=2", b"", 200),
+        ("POST", "/users", "", body, 201),
+        ("GET", "/products/1", "", b"", 200),
+        ("GET", "/users/99999", "", b"", 404),
+    ] * 5
+
+    with allure.step("录制 20 个请求，文件很小以触发轮转"):
+        recorder = TrafficRecorder(path, max_bytes=512, backups=10, buffer_lines=2)
+        for i, (method, url_path, query, data, status) in enumerate(requests_to_record):
+            recorder.record(method, url_path, query, [("Content-Type", "application/json")],
+                            data, 1000.0 + i * 0.001, 1.0, status)
+        recorder.close()
+        files = recorded_files(path)
+        assert len(files) > 1
+        records = list(read_records(files))
+        assert [(r["method"], r["path"]) for r in records] == \
+            [(method, url_path) for method, url_path, *_ in requests_to_record]
+
+    with allure.step("以 4 并发、10 倍速回放"):
+        result = replay(iter(records), BASE_URL, concurrency=4, speed=10, new_session=new_session)
+        assert result["count"] == 20
+        assert result["errors"] == 0
+        assert result["mismatched"] == 0
+        assert result["statuses"] == {200: 10, 201: 5, 404: 5}
+        assert result["latency_ms"]["p50"] <= result["latency_ms"]["max"]
+
+
+@allure.feature("测试辅助")
+@allure.story("流量录制与回放")
+@pytest.mark.parametrize("secrets", [False, True])
+def test_traffic_recording_redacts_credentials(tmp_path, secrets):
+    """测试录制文件默认不含登录密码和 token，打开 record_secrets 后保留原值"""
+    path = str(tmp_path / "traffic.jsonl")
+    with in_process_app({"record": path, "record_secrets": secrets, "token_mode": "opaque"}) as session:
+        with allure.step("登录并带 token 访问受保护接口"):
+            token = session.post("http://testserver/login",
+                                 json={"username": "admin", "password": "admin123"}).json()["token"]
+            session.get("http://testserver/protected", headers={"Authorization": f"Bearer {token}"})
+
+    with open(path, encoding="utf-8") as f:
+        recorded = f.read()
+    login, protected = [json.loads(line) for line in recorded.splitlines()]
+    if secrets:
+        with allure.step("record_secrets 打开时原样录制"):
+            assert json.loads(login["body"])["password"] == "admin123"
+            assert protected["headers"]["Authorization"] == f"Bearer {token}"
+    else:
+        with allure.step("默认替换密码和 Authorization，其余字段保留"):
+            assert "admin123" not in recorded and token not in recorded
+            assert json.loads(login["body"]) == {"username": "admin", "password": "[REDACTED]"}
+            assert protected["headers"]["Authorization"] == "[REDACTED]"
@@ -0,0 +1,240 @@
+"""登录 token 仓库：过期时间(TTL)、过期索引、后台清理和数量上限
+
+token 行仍然保存在存储后端的 tokens 仓库里(内存或 sqlite)，``TokenStore`` 包在外面：
+
+- ``issue`` 按 ``ttl`` 算出过期时间写入行的 ``expires``(ISO 格式，与原来相同)，
+  ``get`` 取到已过期的 token 时当场删除并返回 None
+- 所有 token 的 TTL 相同，过期时间按签发顺序单调不减，过期索引就是一个按签发顺序排列的队列
+  (只有一个槽的时间轮)：签发时追加到队尾，清理时从队头取出已过期的，每个 token 只进出队列一次，
+  均摊 O(1)，不需要堆
+- 后台线程每隔 ``sweep_interval`` 秒清理一次；fork 出的子进程调用 ``after_fork`` 重新创建锁、
+  丢弃继承来的队列并重新启动清理线程
+- token 数超过 ``max_tokens`` 时从队头(最早签发的)开始挤掉，0 表示不限
+- ``stats()`` 返回当前 token 数以及过期清理(expired)和超出上限挤掉(evicted)的累计数
+
+``issue`` 也可以直接给出过期时间(签名 token 的吊销记录随 token 本身过期)，这时队列不再严格有序，
+清理按队列顺序进行，过期时间靠前的记录可能晚一些才被清理，但不会被提前删除。
+
+快照恢复、重新装载后丢弃队列，第一次签发、清理或取统计时再按行里的 ``expires`` 重建，
+恢复快照本身仍与 token 数无关。
+
+仓库能在库里按字段批量删除时(sqlite 后端的 ``delete_expired`` / ``delete_oldest``)不用进程内的队列：
+清理是一条 ``DELETE ... WHERE expires <= ?``，超出上限时按 ``expires`` 删除最早的，当前 token 数直接数表里的行。
+多个工作进程共用一个库时，上限、最早优先和 ``live`` 都是全局的；
+``expired`` / ``evicted`` 仍是本进程删除的个数。
+"""
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+DEFAULT_TTL = 24 * 3600
+DEFAULT_MAX_TOKENS = 100000
+DEFAULT_SWEEP_INTERVAL = 60
+# 清理时每次加锁最多从队列取出的 token 数，签发不会被长时间挡住
+SWEEP_BATCH = 1024
+
+
+def expires_at(row):
+    """行的过期时间戳；没有或无法解析时视为已过期"""
+    try:
+        return datetime.fromisoformat(row['expires']).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return 0.0
+
+
+class TokenStore:
+    """带 TTL 的 token 仓库，包装存储后端的 tokens 仓库
+
+    ``clock`` 返回当前时间戳(测试和基准可以换成假时钟)；``background=False`` 时不启动清理线程，
+    由调用方自己调用 ``sweep``。
+    """
+
+    def __init__(self, repo, ttl=DEFAULT_TTL, max_tokens=DEFAULT_MAX_TOKENS,
+                 sweep_interval=DEFAULT_SWEEP_INTERVAL, clock=time.time, background=True):
+        self.repo = repo
+        self.ttl = ttl
+        self.max_tokens = max_tokens
+        self.sweep_interval = sweep_interval
+        self.clock = clock
+        self.background = background
+        self.expired = 0
+        self.evicted = 0
+        # 过期和上限由仓库在库里处理，不维护进程内的队列
+        self.in_repo = hasattr(repo, 'delete_expired') and hasattr(repo, 'delete_oldest')
+        self._lock = threading.Lock()
+        # None 表示需要按仓库现有的行重建(见 _index)
+        self._queue = None
+        self._live = 0
+        self._stop = threading.Event()
+        self._thread = None
+        if background:
+            self._start_sweeper()
+
+    # ---------- 读写 ----------
+
+    def get(self, token):
+        """取 token 对应的行；不存在或已过期时返回 None(已过期的顺便删除)"""
+        row = self.repo.get(token)
+        if row is None:
+            return None
+        if expires_at(row) <= self.clock():
+            self._remove(token, expired=True)
+            return None
+        return row
+
+    def issue(self, token, fields, expires=None):
+        """保存新 token，返回保存的行；token 已存在时抛出 KeyError
+
+        ``expires`` 是过期时间戳，默认为当前时间加 ttl
+        """
+        if expires is None:
+            expires = self.clock() + self.ttl
+        row = {self.repo.pk: token, **fields, "expires": datetime.fromtimestamp(expires).isoformat()}
+        self.repo.insert(row)
+        if not self.in_repo:
+            with self._lock:
+                if self._queue is None:
+                    # 重建时已经包含刚插入的行
+                    self._index()
+                else:
+                    self._queue.append((expires, token))
+                    self._live += 1
+        self._evict()
+        return row
+
+    def delete(self, token):
+        """删除 token(例如退出登录)，返回是否真的删除了"""
+        if not self.repo.delete(token):
+            return False
+        with self._lock:
+            # 队列待重建时计数随之重算
+            if self._queue is not None and not self.in_repo:
+                self._live -= 1
+        return True
+
+    def _remove(self, token, expired):
+        """删除 token 并计数；已经被删掉(其他线程或进程抢先)时返回 False"""
+        if not self.delete(token):
+            return False
+        with self._lock:
+            if expired:
+                self.expired += 1
+            else:
+                self.evicted += 1
+        return True
+
+    def _evict(self):
+        """token 数超过上限时从队头挤掉最早签发的
+
+        退出登录或取用时已过期删除的 token 仍留在队列里，删除失败的跳过，直到真的删掉足够的 token
+        """
+        if self.in_repo:
+            if self.max_tokens:
+                evicted = self.repo.delete_oldest("expires", self.max_tokens)
+                with self._lock:
+                    self.evicted += evicted
+            return
+        while True:
+            with self._lock:
+                queue = self._index()
+                if not self.max_tokens or self._live <= self.max_tokens or not queue:
+                    return
+                victim = queue.popleft()[1]
+            self._remove(victim, expired=False)
+
+    def sweep(self, now=None):
+        """删除到 now(默认当前时间)为止已过期的 token，返回删除的个数"""
+        now = self.clock() if now is None else now
+        if self.in_repo:
+            removed = self.repo.delete_expired("expires", datetime.fromtimestamp(now).isoformat())
+            with self._lock:
+                self.expired += removed
+            return removed
+        removed = 0
+        while True:
+            with self._lock:
+                queue = self._index()
+                batch = []
+                while queue and queue[0][0] <= now and len(batch) < SWEEP_BATCH:
+                    batch.append(queue.popleft()[1])
+            if not batch:
+                return removed
+            removed += sum(self._remove(token, expired=True) for token in batch)
+
+    def stats(self):
+        if self.in_repo:
+            live = len(self.repo)
+            with self._lock:
+                return {"live": live, "expired": self.expired, "evicted": self.evicted}
+        with self._lock:
+            self._index()
+            return {"live": self._live, "expired": self.expired, "evicted": self.evicted}
+
+    # ---------- 后台清理 ----------
+
+    def _start_sweeper(self):
+        self._thread = threading.Thread(target=self._run, name="token-sweeper", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except Exception:
+                # 存储暂时不可用(例如 sqlite 被锁)时等下一轮再清理，线程不退出
+                continue
+
+    def after_fork(self):
+        """在 fork 出的子进程里调用：父进程的锁可能正被其他线程持有、清理线程不会被继承，
+        队列里也有父进程之后不再知道的删除，全部重新创建(队列在第一次用到时按库里的行重建)"""
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._queue = None
+        if self.background:
+            self._start_sweeper()
+
+    def close(self):
+        """停止后台清理线程"""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive() and thread is not threading.current_thread():
+            thread.join(timeout=5)
+
+    # ---------- 与其他仓库一致的快照接口 ----------
+
+    def _index(self):
+        """过期队列；数据被整体替换后第一次用到时按仓库现有的行重建队列和计数(调用方持有锁)"""
+        if self._queue is None:
+            rows = sorted((expires_at(row), row[self.repo.pk]) for row in self.repo)
+            self._queue = deque(rows)
+            self._live = len(rows)
+        return self._queue
+
+    def _reindex(self):
+        with self._lock:
+            self._queue = None
+
+    @property
+    def version(self):
+        return self.repo.version
+
+    def __len__(self):
+        return len(self.repo)
+
+    def __iter__(self):
+        return iter(self.repo)
+
+    def load(self, rows):
+        self.repo.load(rows)
+        self._reindex()
+
+    def snapshot(self):
+        return self.repo.snapshot()
+
+    def restore(self, snap):
+        self.repo.restore(snap)
+        self._reindex()
+
+    def drop_snapshot(self, snap):
+        self.repo.drop_snapshot(snap)
@@ -0,0 +1,258 @@
+"""流量录制与回放
+
+录制：``TrafficRecorder`` 把每个请求(方法、路径、查询串、请求头、请求体、开始时间、耗时、状态码)
+作为一行 JSON 追加到文件。写入先攒在内存里，满 ``buffer_lines`` 行或距上次写入超过
+``flush_interval`` 秒才落盘；文件超过 ``max_bytes`` 时轮转为 ``<文件>.1`` … ``<文件>.<backups>``。
+api_server 用 ``--record <文件>`` 打开录制。
+
+录制文件默认不含凭据：``Authorization``、``Cookie``、``X-Api-Key`` 请求头的值和 JSON 请求体里的
+``password`` 字段都替换为 ``[REDACTED]``。确实需要原样回放登录流程时用 ``--record-secrets`` 关闭替换，
+这样录下的文件里有明文密码和有效的 token，要当作凭据保管。
+
+回放：按原来的时间间隔(可以用 --speed 加速，0 表示不等待)把录下的请求发到另一个实例，
+统计吞吐量、延迟分布，以及状态码与录制时不一致的请求数::
+
+    python traffic.py traffic.jsonl --base-url http://localhost:5001 --concurrency 8 --speed 10
+
+只读的请求可以原样重放；依赖登录 token 的请求(凭据被替换时还包括登录本身)在新实例上可能得到 401，
+会计入状态码不一致。
+"""
+import argparse
+import base64
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_RECORD_FILE = "traffic.jsonl"
+
+# 不录制的请求头：由 HTTP 客户端在回放时重新生成
+SKIP_HEADERS = frozenset(("host", "content-length", "connection", "transfer-encoding"))
+# 默认替换掉值的请求头和 JSON 请求体字段
+SECRET_HEADERS = frozenset(("authorization", "cookie", "x-api-key"))
+SECRET_FIELDS = ("password",)
+REDACTED = "[REDACTED]"
+
+
+def redact_body(body):
+    """把 JSON 对象请求体中的密码字段替换为 REDACTED；不是 JSON 对象或没有这些字段时原样返回"""
+    if not any(field.encode() in body for field in SECRET_FIELDS):
+        return body
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return body
+    if not isinstance(data, dict) or not any(field in data for field in SECRET_FIELDS):
+        return body
+    for field in SECRET_FIELDS:
+        if field in data:
+            data[field] = REDACTED
+    return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+
+class TrafficRecorder:
+    """缓冲写入、按大小轮转的 JSON lines 录制文件
+
+    ``secrets`` 为 False(默认)时凭据类请求头和密码字段替换为 ``[REDACTED]``。
+    """
+
+    def __init__(self, path=DEFAULT_RECORD_FILE, max_bytes=64 * 1024 * 1024, backups=5,
+                 buffer_lines=256, flush_interval=1.0, secrets=False):
+        self.path = path
+        self.secrets = secrets
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.buffer_lines = buffer_lines
+        self.flush_interval = flush_interval
+        self.recorded = 0
+        self._lines = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def record(self, method, path, query, headers, body, start, duration, status):
+        """追加一条请求记录；body 是请求体原始字节"""
+        entry = {
+            "ts": round(start, 6),
+            "method": method,
+            "path": path,
+            "query": query,
+            "headers": {k: v if self.secrets or k.lower() not in SECRET_HEADERS else REDACTED
+                        for k, v in headers if k.lower() not in SKIP_HEADERS},
+            "duration_ms": round(duration, 3),
+            "status": status,
+        }
+        if body and not self.secrets:
+            body = redact_body(body)
+        if body:
+            try:
+                entry["body"] = body.decode('utf-8')
+            except UnicodeDecodeError:
+                entry["body_b64"] = base64.b64encode(body).decode('ascii')
+        line = json.dumps(entry, ensure_ascii=False) + '\n'
+        with self._lock:
+            if self._file is None:
+                return
+            self._lines.append(line)
+            self.recorded += 1
+            if len(self._lines) >= self.buffer_lines \
+                    or time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._flush()
+
+    def _flush(self):
+        if self._lines:
+            self._file.write(''.join(self._lines))
+            self._file.flush()
+            self._lines.clear()
+        self._last_flush = time.monotonic()
+        if self._file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._flush()
+                self._file.close()
+                self._file = None
+
+
+def recorded_files(path):
+    """录制文件及其轮转出的旧文件，按时间从早到晚排列"""
+    rotated = []
+    i = 1
+    while os.path.exists(f"{path}.{i}"):
+        rotated.append(f"{path}.{i}")
+        i += 1
+    return rotated[::-1] + ([path] if os.path.exists(path) else [])
+
+
+def read_records(paths):
+    """逐行流式读取录制文件，不把整个文件读进内存"""
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def replay(records, base_url, concurrency=8, speed=1.0, timeout=30, new_session=None):
+    """回放请求记录并返回统计结果
+
+    speed 是时间缩放倍数：1 按录制时的间隔发送，10 快十倍，0 表示不等待、尽快发送。
+    同时在途的请求最多 concurrency 个，记录边读边发。
+    每个发送线程用 new_session() 创建自己的 Session(默认 requests.Session)。
+    """
+    # 只有回放用到 requests；api_server 导入录制功能时不必加载它
+    import requests
+
+    new_session = new_session or requests.Session
+
+    local = threading.local()
+    slots = threading.BoundedSemaphore(concurrency)
+    lock = threading.Lock()
+    latencies = []
+    statuses = {}
+    stats = {"errors": 0, "mismatched": 0}
+
+    def send(record):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = new_session()
+        url = f"{base_url}{record['path']}"
+        if record.get('query'):
+            url += f"?{record['query']}"
+        if 'body_b64' in record:
+            data = base64.b64decode(record['body_b64'])
+        else:
+            data = record.get('body', '').encode('utf-8') or None
+        start = time.perf_counter()
+        try:
+            response = session.request(record['method'], url, headers=record.get('headers'),
+                                       data=data, timeout=timeout)
+        except requests.RequestException:
+            with lock:
+                stats["errors"] += 1
+            return
+        finally:
+            slots.release()
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            if record.get('status') is not None and response.status_code != record['status']:
+                stats["mismatched"] += 1
+
+    first_ts = None
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for record in records:
+            if speed > 0:
+                if first_ts is None:
+                    first_ts = record['ts']
+                delay = started + (record['ts'] - first_ts) / speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            slots.acquire()
+            pool.submit(send, record)
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    count = len(latencies) + stats["errors"]
+    return {
+        "count": count,
+        "errors": stats["errors"],
+        "mismatched": stats["mismatched"],
+        "statuses": dict(sorted(statuses.items())),
+        "elapsed": elapsed,
+        "throughput": count / elapsed if elapsed > 0 else 0.0,
+        "latency_ms": {name: percentile(latencies, p) * 1000
+                       for name, p in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0))},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回放 api_server --record 录制的请求")
+    parser.add_argument('file', nargs='?', default=DEFAULT_RECORD_FILE,
+                        help="录制文件 (默认 traffic.jsonl，会一并回放轮转出的旧文件)")
+    parser.add_argument('--base-url', default='http://localhost:5001')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="时间缩放倍数：1 按原速，10 快十倍，0 尽快发送")
+    args = parser.parse_args()
+
+    files = recorded_files(args.file)
+    if not files:
+        parser.error(f"录制文件不存在: {args.file}")
+    result = replay(read_records(files), args.base_url, args.concurrency, args.speed)
+
+    print(f"请求数: {result['count']}  失败: {result['errors']}  状态码不一致: {result['mismatched']}")
+    print(f"状态码: {result['statuses']}")
+    print(f"耗时: {result['elapsed']:.2f}s  吞吐量: {result['throughput']:.1f} req/s")
+    print("延迟(ms): " + "  ".join(f"{name}={value:.2f}" for name, value in result['latency_ms'].items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""请求体校验：把路由文档字符串里 flasgger YAML 声明的约束编译成校验函数
+
+启动时对每个声明了 ``in: body`` 参数的路由解析一次 YAML，把 schema 生成为一段直线式的 Python 代码
+(与手写的 if 链相同：字段名、错误码和提示都是常量)再编译成函数，请求到来时直接调用，
+不再解析 YAML，也不逐项解释 schema。
+
+支持 ``required``、``type``、``minLength``、``maxLength``、``minimum``、``maximum``；
+数组请求体(批量接口)的 ``items`` 编译成校验函数的 ``items`` 属性，由视图逐条校验。
+嵌套对象只检查类型。检查顺序与 login 原来手写的校验相同，第一个不满足的约束决定错误码：
+
+1. 必填字段是否存在                    ``MISSING_<字段>``
+2. 逐个字段检查 null 与类型            ``NULL_<字段>``、``INVALID_<字段>_TYPE``
+   number 类型的 NaN、Infinity           ``INVALID_<字段>_VALUE``
+3. 字符串(minLength >= 1)去掉空白后为空 ``EMPTY_<字段>``
+4. 长度与数值范围                      ``<字段>_TOO_SHORT``、``<字段>_TOO_LONG``、
+                                      ``<字段>_TOO_SMALL``、``<字段>_TOO_LARGE``
+
+校验函数通过时返回 None，否则返回 (error_code, message)。整个请求体缺失(或不是合法 JSON)时是
+``EMPTY_BODY``，类型不对时是 ``INVALID_BODY_TYPE``。
+"""
+import inspect
+import math
+
+import yaml
+
+# schema 的 type -> Python 类型；bool 是 int 的子类，integer / number 不接受 true / false
+TYPES = {
+    "string": "str",
+    "integer": "int",
+    "number": "(int, float)",
+    "boolean": "bool",
+    "object": "dict",
+    "array": "list",
+}
+
+
+def _type_test(var, schema):
+    """生成“var 不是 schema 声明的类型”的表达式；没有声明 type 时返回 None"""
+    types = TYPES.get(schema.get("type"))
+    if types is None:
+        return None
+    test = f"not isinstance({var}, {types})"
+    if schema["type"] in ("integer", "number"):
+        test = f"{var}.__class__ is bool or {test}"
+    return test
+
+
+def _finite_check(var, schema, code, label):
+    """number 类型生成拒绝 NaN、Infinity 的语句(NaN 与任何数比较都为 False，范围检查拦不住)；其他类型返回 None"""
+    if schema.get("type") != "number":
+        return None
+    # 大整数转换成 float 会溢出，只检查 float
+    return f"if {var}.__class__ is float and not isfinite({var}): return {(f'INVALID_{code}_VALUE', f'{label}必须是有限的数值')!r}"
+
+
+def _type_error(code, prefix, expected, var):
+    """生成类型错误的 return 语句，提示里带上实际类型"""
+    return f"return {code!r}, {prefix + '，期望 ' + expected + '，实际为 '!r} + type({var}).__name__"
+
+
+def _length_error(code, prefix, var):
+    return f"return {code!r}, {prefix!r} + str(len({var})) + '字符'"
+
+
+def _guarded(var, statement):
+    """var 可能为 None(字段不存在)时，只在有值时执行 statement；var 为 None 表示一定有值"""
+    if var is None:
+        return f"    {statement}"
+    return f"    if {var} is not None:\n        {statement}"
+
+
+def compile_schema(schema, name="BODY", label="请求体", null_error=None, required=True):
+    """把 schema 编译成校验函数
+
+    ``null_error`` 是值为 None 时返回的错误，默认 ``NULL_<name>``；``required`` 为 False 时 None 直接通过。
+    生成的源码保存在函数的 ``source`` 属性上，数组元素的校验函数在 ``items`` 属性上。
+    """
+    if null_error is None:
+        null_error = (f"NULL_{name}", f"{label}不能为 null")
+    lines = ["def validate(value):",
+             f"    if value is None: return {null_error if required else None!r}"]
+    test = _type_test("value", schema)
+    if test:
+        lines.append(f"    if {test}:")
+        lines.append("        " + _type_error(f"INVALID_{name}_TYPE", f"{label}类型错误", schema["type"], "value"))
+    check = _finite_check("value", schema, name, label)
+    if check:
+        lines.append(f"    {check}")
+
+    properties = schema.get("properties") or {}
+    required_fields = schema.get("required") or ()
+    if properties or required_fields:
+        if schema.get("type") != "object":
+            lines.append("    if not isinstance(value, dict): return None")
+        for field in required_fields:
+            lines.append(f"    if {field!r} not in value: return {(f'MISSING_{field.upper()}', f'缺少必填字段: {field}')!r}")
+
+        # 逐个字段取值(v0、v1 …)并检查 null 与类型，后面几步直接用取出的值。
+        # 必填且声明了类型的字段到这里一定不是 None，后面的检查不再判断
+        blank, lengths, ranges = [], [], []
+        for i, (field, spec) in enumerate(properties.items()):
+            code, var = field.upper(), f"v{i}"
+            lines.append(f"    {var} = value.get({field!r})")
+            test = _type_test(var, spec)
+            present = var
+            if test:
+                field_null = (f"NULL_{code}", f"{field} 不能为 null")
+                type_error = _type_error(f"INVALID_{code}_TYPE", f"{field} 类型错误", spec["type"], var)
+                if field in required_fields:
+                    lines.append(f"    if {var} is None: return {field_null!r}")
+                    lines.append(f"    if {test}:")
+                    present = None
+                else:
+                    # 可选字段：不存在时跳过，显式给出 null 才报错
+                    lines.append(f"    if {var} is None:")
+                    lines.append(f"        if {field!r} in value: return {field_null!r}")
+                    lines.append(f"    elif {test}:")
+                lines.append(f"        {type_error}")
+            check = _finite_check(var, spec, code, f"{field} ")
+            if check:
+                lines.append(_guarded(present, check))
+            min_length, max_length = spec.get("minLength"), spec.get("maxLength")
+            checked_blank = spec.get("type") == "string" and bool(min_length)
+            if checked_blank:
+                blank.append((present, var, (f"EMPTY_{code}", f"{field} 不能为空")))
+            # 去掉空白后不为空的字符串长度至少为 1，minLength 为 1 时不必再查
+            if checked_blank and min_length == 1:
+                min_length = None
+            if min_length or max_length is not None:
+                lengths.append((present, var, field, code, min_length, max_length))
+            minimum, maximum = spec.get("minimum"), spec.get("maximum")
+            if minimum is not None or maximum is not None:
+                ranges.append((present, var, field, code, minimum, maximum))
+
+        for present, var, error in blank:
+            lines.append(_guarded(present, f"if not {var}.strip(): return {error!r}"))
+        for present, var, field, code, min_length, max_length in lengths:
+            if min_length:
+                lines.append(_guarded(present, f"if len({var}) < {min_length}: " + _length_error(
+                    f"{code}_TOO_SHORT", f"{field} 长度不足，最少{min_length}字符，当前", var)))
+            if max_length is not None:
+                lines.append(_guarded(present, f"if len({var}) > {max_length}: " + _length_error(
+                    f"{code}_TOO_LONG", f"{field} 长度超出限制，最大{max_length}字符，当前", var)))
+        for present, var, field, code, minimum, maximum in ranges:
+            if minimum is not None:
+                lines.append(_guarded(present, f"if {var} < {minimum!r}: "
+                                               f"return {(f'{code}_TOO_SMALL', f'{field} 不能小于 {minimum}')!r}"))
+            if maximum is not None:
+                lines.append(_guarded(present, f"if {var} > {maximum!r}: "
+                                               f"return {(f'{code}_TOO_LARGE', f'{field} 不能大于 {maximum}')!r}"))
+    lines.append("    return None")
+
+    source = "\n".join(lines)
+    namespace = {"isfinite": math.isfinite}
+    exec(compile(source, f"<schema {name}>", "exec"), namespace)
+    validate = namespace["validate"]
+    validate.source = source
+    validate.items = None
+    if schema.get("type") == "array" and "items" in schema:
+        validate.items = compile_schema(schema["items"], "ITEM", "条目")
+    return validate
+
+
+def body_schema(doc):
+    """从文档字符串的 YAML 部分取出请求体参数：(schema, 是否必填)，没有时返回 (None, False)"""
+    if not doc or "---" not in doc:
+        return None, False
+    spec = yaml.load(inspect.cleandoc(doc).split("---", 1)[1], Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+    for param in (spec or {}).get("parameters") or ():
+        if param.get("in") == "body" and param.get("schema"):
+            return param["schema"], bool(param.get("required"))
+    return None, False
+
+
+def compile_validators(app):
+    """为 app 上每个声明了请求体 schema 的路由编译校验函数，返回 {endpoint: 校验函数}
+
+    请求体不是必填的路由，请求体缺失时不校验。
+    """
+    validators = {}
+    for endpoint, view in app.view_functions.items():
+        schema, required = body_schema(view.__doc__)
+        if schema is not None:
+            validators[endpoint] = compile_schema(schema, null_error=("EMPTY_BODY", "请求体不能为空"),
+                                                  required=required)
+    return validators
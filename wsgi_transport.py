@@ -0,0 +1,70 @@
+"""requests 的进程内传输：请求直接交给 WSGI 应用处理，不经过 socket 和 HTTP 服务器
+
+调用方照常用 requests 的 Session 发请求，只是把一个 URL 前缀挂到 ``WSGITransport`` 上(``wsgi_session``)::
+
+    session = wsgi_session(app, "http://testserver")
+    session.get("http://testserver/users")
+
+其他前缀的请求仍然走网络。应用看到的 WSGI environ 与开发服务器给的一致(REMOTE_ADDR 为 127.0.0.1)；
+响应包装成 urllib3 的 HTTPResponse 交给 requests，自动解压 gzip、
+``response.raw.read(decode_content=False)`` 读取原始字节等行为与走网络时相同。
+分块上传的请求体和流式响应都先收齐再交付。
+"""
+import io
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPResponse
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+# 由传输层决定的请求头：请求体收齐后长度已知，由 EnvironBuilder 重新计算
+_HOP_HEADERS = frozenset(("content-length", "transfer-encoding", "connection"))
+
+
+def _read_body(body):
+    """把 requests 准备好的请求体(bytes / str / 文件 / 分块迭代器)读成 bytes"""
+    if body is None or isinstance(body, bytes):
+        return body
+    if isinstance(body, str):
+        return body.encode('utf-8')
+    if hasattr(body, 'read'):
+        return _read_body(body.read())
+    return b"".join(chunk.encode('utf-8') if isinstance(chunk, str) else chunk for chunk in body)
+
+
+class WSGITransport(HTTPAdapter):
+    """把请求交给 WSGI 应用的 requests 传输适配器，可以在多个线程里同时使用"""
+
+    def __init__(self, app):
+        super().__init__()
+        self.app = app
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        url = urlsplit(request.url)
+        headers = [(name, value) for name, value in request.headers.items() if name.lower() not in _HOP_HEADERS]
+        builder = EnvironBuilder(path=url.path, base_url=f"{url.scheme}://{url.netloc}", query_string=url.query,
+                                 method=request.method, headers=headers, data=_read_body(request.body),
+                                 environ_base={"REMOTE_ADDR": "127.0.0.1"})
+        try:
+            environ = builder.get_environ()
+        finally:
+            builder.close()
+        body, status, response_headers = run_wsgi_app(self.app, environ, buffered=True)
+        code, _, reason = status.partition(' ')
+        raw = HTTPResponse(body=io.BytesIO(b"".join(body)), headers=list(response_headers.items()),
+                           status=int(code), reason=reason, preload_content=False, decode_content=False,
+                           request_method=request.method)
+        return self.build_response(request, raw)
+
+
+def wsgi_session(app, base_url):
+    """base_url 下的请求交给 app 处理的 Session
+
+    不读取代理、.netrc 等环境设置(trust_env=False)：进程内的请求用不到它们，
+    而 requests 每发一个请求都要扫描一遍环境变量，占了进程内请求一半的时间。
+    """
+    session = requests.Session()
+    session.trust_env = False
+    session.mount(base_url, WSGITransport(app))
+    return session